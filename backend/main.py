@@ -1,14 +1,39 @@
 from fastapi import FastAPI, Depends
 import os
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from database import get_db
 from dependencies import require_role, get_current_user
 from routers import leads, tasks, pipeline, interactions, analytics, reports, admin, notifications
 
+from services.scheduler import scheduler
+from services.sla_check import sla_checker, CHECK_INTERVAL_SECONDS
+from services.archival import run_archive_policy
+from services.report_export import purge_expired_exports
+from services.audit_log import audit_writer
+from services.health import health_sampler
+
+# Background jobs (services/scheduler.py): leased in the DB so only one worker runs each
+scheduler.register("sla_check", CHECK_INTERVAL_SECONDS, sla_checker.run)
+scheduler.register("archive_leads", int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24")) * 3600, run_archive_policy)
+scheduler.register("purge_expired_exports", 6 * 3600, purge_expired_exports)
+scheduler.register("replay_audit_fallback", 3600, audit_writer.replay_fallback)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    audit_writer.start()
+    await scheduler.start()
+    await health_sampler.start()
+    yield
+    await health_sampler.stop()
+    await scheduler.stop()
+    audit_writer.stop()
+
 app = FastAPI(
     title="Jeevana Vidya Online School CRM",
     description="Enterprise-grade CRM for educational institutions",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Build allowed origins: always include local dev origins,
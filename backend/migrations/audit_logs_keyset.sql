@@ -0,0 +1,36 @@
+-- Audit log listing: keyset pagination, filtered indexes and search (GET /api/v1/admin/audit-logs)
+-- Execute this in Supabase SQL Editor
+
+-- 1. Every listing is ordered by (created_at DESC, id DESC). Each filter gets a composite
+-- index ending in that order, so a page is an index range scan however large the table grows.
+CREATE INDEX IF NOT EXISTS idx_audit_logs_created_id ON audit_logs(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_user_created ON audit_logs(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_resource_created ON audit_logs(resource, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_action_created ON audit_logs(action, created_at DESC, id DESC);
+
+-- The single-column indexes are prefixes of the ones above
+DROP INDEX IF EXISTS idx_audit_logs_user_id;
+DROP INDEX IF EXISTS idx_audit_logs_action;
+DROP INDEX IF EXISTS idx_audit_logs_resource;
+DROP INDEX IF EXISTS idx_audit_logs_created_at;
+
+-- 2. search: substring match over resource, resource id and details, served by a trigram index.
+-- Adding the stored column rewrites audit_logs once.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS search_text TEXT
+    GENERATED ALWAYS AS (
+        LOWER(resource || ' ' || COALESCE(resource_id::TEXT, '') || ' ' || COALESCE(details::TEXT, ''))
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_audit_logs_search_text ON audit_logs USING GIN (search_text gin_trgm_ops);
+
+-- 3. search also matches the acting user's name or email. The API passes matching user ids
+-- as an in() list (served by idx_audit_logs_user_created); when too many users match for a
+-- URL, it filters on this computed column instead (PostgREST calls it like a column).
+CREATE OR REPLACE FUNCTION actor_search_text(audit_logs)
+RETURNS TEXT AS $$
+    SELECT LOWER(COALESCE(p.full_name, '') || ' ' || COALESCE(p.email, ''))
+    FROM profiles p
+    WHERE p.id = $1.user_id;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,76 @@
+-- Leases for the in-process scheduler (services/scheduler.py)
+-- Execute this in Supabase SQL Editor
+-- Every API worker runs a scheduler loop; these functions make sure each due job
+-- is claimed by exactly one of them. A lease that is not released (crashed worker)
+-- expires after p_lease_seconds and the job becomes claimable again.
+
+-- 1. Periodic system jobs (sla_check, archive_leads, ...)
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name TEXT PRIMARY KEY,
+    interval_seconds INTEGER NOT NULL,
+    next_run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_by TEXT,
+    locked_until TIMESTAMPTZ,
+    last_started_at TIMESTAMPTZ,
+    last_finished_at TIMESTAMPTZ,
+    last_status VARCHAR(20) CHECK (last_status IN ('running', 'completed', 'failed')),
+    last_error TEXT,
+    last_result JSONB
+);
+
+-- Registers the job on first call; returns TRUE when this worker now holds the lease
+CREATE OR REPLACE FUNCTION claim_scheduled_job(
+    p_name TEXT,
+    p_interval_seconds INTEGER,
+    p_worker TEXT,
+    p_lease_seconds INTEGER
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+    INSERT INTO scheduled_jobs (name, interval_seconds, next_run_at)
+    VALUES (p_name, p_interval_seconds, NOW() + p_interval_seconds * INTERVAL '1 second')
+    ON CONFLICT (name) DO NOTHING;
+
+    UPDATE scheduled_jobs SET
+        interval_seconds = p_interval_seconds,
+        next_run_at = NOW() + p_interval_seconds * INTERVAL '1 second',
+        locked_by = p_worker,
+        locked_until = NOW() + p_lease_seconds * INTERVAL '1 second',
+        last_started_at = NOW(),
+        last_status = 'running'
+    WHERE name = p_name
+      AND next_run_at <= NOW()
+      AND (locked_until IS NULL OR locked_until < NOW());
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 2. Scheduled reports
+ALTER TABLE scheduled_reports ADD COLUMN IF NOT EXISTS locked_by TEXT;
+ALTER TABLE scheduled_reports ADD COLUMN IF NOT EXISTS locked_until TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_scheduled_reports_due ON scheduled_reports(next_run)
+    WHERE status = 'active';
+
+-- Leases up to p_limit due reports; SKIP LOCKED keeps concurrent claimers from blocking each other
+CREATE OR REPLACE FUNCTION claim_due_scheduled_reports(
+    p_worker TEXT,
+    p_lease_seconds INTEGER,
+    p_limit INTEGER
+)
+RETURNS SETOF scheduled_reports AS $$
+    UPDATE scheduled_reports s SET
+        locked_by = p_worker,
+        locked_until = NOW() + p_lease_seconds * INTERVAL '1 second'
+    WHERE s.id IN (
+        SELECT id FROM scheduled_reports
+        WHERE status = 'active'
+          AND next_run <= NOW()
+          AND (locked_until IS NULL OR locked_until < NOW())
+        ORDER BY next_run
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING s.*;
+$$ LANGUAGE sql;
@@ -0,0 +1,124 @@
+-- Chunked, resumable lead archival (services/archival.py)
+-- Execute this in Supabase SQL Editor, after phase_5_tables.sql and background_scheduler.sql
+
+-- 1. One row per archival run: criteria, progress and the keyset checkpoint
+CREATE TABLE IF NOT EXISTS archive_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'running', 'completed', 'failed')),
+    cutoff TIMESTAMPTZ NOT NULL,              -- Leads created before this are archived
+    statuses TEXT[],                           -- NULL or empty: any status
+    archived_reason VARCHAR(100),
+    requested_by UUID REFERENCES profiles(id),
+    total_estimate BIGINT,                     -- Matching leads when the job was queued
+    archived_count BIGINT NOT NULL DEFAULT 0,
+    last_created_at TIMESTAMPTZ,               -- Checkpoint: last (created_at, id) archived
+    last_id UUID,
+    locked_by TEXT,
+    locked_until TIMESTAMPTZ,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    completed_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_archive_jobs_queue ON archive_jobs(created_at)
+    WHERE status IN ('pending', 'running');
+
+-- At most one queued or running job: concurrent requests (an admin and the archive_leads
+-- policy job, or two workers) cannot both queue one
+CREATE UNIQUE INDEX IF NOT EXISTS idx_archive_jobs_one_active ON archive_jobs((TRUE))
+    WHERE status IN ('pending', 'running');
+
+-- Chunks walk leads in (created_at, id) order
+CREATE INDEX IF NOT EXISTS idx_leads_created_id ON leads(created_at, id);
+
+-- 2. Lease queued jobs for one scheduler worker. Jobs left 'running' by a worker that
+-- died are picked up again once their lease expires, and resume from their checkpoint.
+CREATE OR REPLACE FUNCTION claim_archive_jobs(
+    p_worker TEXT,
+    p_lease_seconds INTEGER,
+    p_limit INTEGER
+)
+RETURNS SETOF archive_jobs AS $$
+    UPDATE archive_jobs j SET
+        status = 'running',
+        locked_by = p_worker,
+        locked_until = NOW() + p_lease_seconds * INTERVAL '1 second',
+        updated_at = NOW()
+    WHERE j.id IN (
+        SELECT id FROM archive_jobs
+        WHERE status = 'pending' OR (status = 'running' AND locked_until < NOW())
+        ORDER BY created_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING j.*;
+$$ LANGUAGE sql;
+
+-- 3. Archive the next p_limit leads after the checkpoint in one transaction:
+-- copy them to leads_archive, delete them from leads, advance the checkpoint
+-- and renew the lease. A failure rolls back the whole chunk, never half of it.
+-- Returns {"archived": n, "done": bool, "ids": [archived lead ids]}.
+CREATE OR REPLACE FUNCTION archive_leads_chunk(
+    p_job_id UUID,
+    p_worker TEXT,
+    p_limit INTEGER,
+    p_lease_seconds INTEGER
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_job archive_jobs%ROWTYPE;
+    v_count INTEGER;
+    v_last_created_at TIMESTAMPTZ;
+    v_last_id UUID;
+    v_ids JSONB;
+BEGIN
+    SELECT * INTO v_job FROM archive_jobs WHERE id = p_job_id FOR UPDATE;
+    IF NOT FOUND OR v_job.locked_by IS DISTINCT FROM p_worker THEN
+        RAISE EXCEPTION 'Archive job % is not leased to %', p_job_id, p_worker;
+    END IF;
+
+    WITH batch AS (
+        SELECT l.* FROM leads l
+        WHERE l.created_at < v_job.cutoff
+          AND (COALESCE(cardinality(v_job.statuses), 0) = 0 OR l.status::TEXT = ANY(v_job.statuses))
+          AND (v_job.last_created_at IS NULL OR (l.created_at, l.id) > (v_job.last_created_at, v_job.last_id))
+        ORDER BY l.created_at, l.id
+        LIMIT p_limit
+        FOR UPDATE
+    ), archived AS (
+        INSERT INTO leads_archive (original_lead_id, parent_name, email, archived_data, archived_reason, archived_by)
+        SELECT b.id, b.parent_name, b.email, to_jsonb(b), v_job.archived_reason, v_job.requested_by
+        FROM batch b
+        RETURNING original_lead_id
+    ), deleted AS (
+        DELETE FROM leads WHERE id IN (SELECT original_lead_id FROM archived)
+        RETURNING id
+    ), last_row AS (
+        SELECT created_at, id FROM batch ORDER BY created_at DESC, id DESC LIMIT 1
+    )
+    SELECT (SELECT COUNT(*) FROM deleted), (SELECT COALESCE(jsonb_agg(id), '[]'::JSONB) FROM deleted),
+           (SELECT created_at FROM last_row), (SELECT id FROM last_row)
+    INTO v_count, v_ids, v_last_created_at, v_last_id;
+
+    UPDATE archive_jobs SET
+        archived_count = archived_count + v_count,
+        last_created_at = COALESCE(v_last_created_at, last_created_at),
+        last_id = COALESCE(v_last_id, last_id),
+        locked_until = NOW() + p_lease_seconds * INTERVAL '1 second',
+        updated_at = NOW()
+    WHERE id = p_job_id;
+
+    RETURN jsonb_build_object('archived', v_count, 'done', v_count < p_limit, 'ids', v_ids);
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4. Archive jobs are audited with their own action
+ALTER TABLE audit_logs DROP CONSTRAINT IF EXISTS audit_logs_action_check;
+ALTER TABLE audit_logs ADD CONSTRAINT audit_logs_action_check
+    CHECK (action IN ('created', 'updated', 'deleted', 'viewed', 'exported', 'impersonated', 'archived'));
+
+-- Only the backend (service role) runs archival
+REVOKE EXECUTE ON FUNCTION claim_archive_jobs(TEXT, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION archive_leads_chunk(UUID, TEXT, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
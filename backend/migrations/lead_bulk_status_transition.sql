@@ -0,0 +1,66 @@
+-- Set-based lead status transition for the pipeline board (POST /api/v1/pipeline/bulk-status)
+-- Execute this in Supabase SQL Editor, after lead_status_transition.sql
+
+-- Same side effects as transition_lead_status, applied to many leads in one statement:
+-- locks the leads, captures previous status and time-in-stage, updates them and writes
+-- interactions, history rows and (for visit_scheduled) auto-tasks in bulk.
+-- Returns a JSON array of the updated leads with their students; unknown ids are skipped.
+CREATE OR REPLACE FUNCTION transition_leads_status(
+    p_lead_ids UUID[],
+    p_status leads.status%TYPE,
+    p_changed_by UUID
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_result JSONB;
+BEGIN
+    WITH previous AS (
+        SELECT id, status::TEXT AS previous_status, COALESCE(status_changed_at, created_at) AS stage_started
+        FROM leads
+        WHERE id = ANY(p_lead_ids)
+        FOR UPDATE
+    ),
+    updated AS (
+        UPDATE leads l SET
+            status = p_status,
+            updated_at = NOW(),
+            last_interaction_at = NOW(),
+            status_changed_at = CASE
+                WHEN p.previous_status IS DISTINCT FROM p_status::TEXT THEN NOW()
+                ELSE l.status_changed_at
+            END
+        FROM previous p
+        WHERE l.id = p.id
+        RETURNING l.*, p.previous_status, p.stage_started
+    ),
+    logged_interactions AS (
+        INSERT INTO interactions (lead_id, type, summary, created_by)
+        SELECT id, 'status_change', 'Status updated to ' || INITCAP(REPLACE(p_status::TEXT, '_', ' ')), p_changed_by
+        FROM updated
+    ),
+    logged_history AS (
+        INSERT INTO lead_status_history (lead_id, previous_status, new_status, changed_by, time_in_previous_stage)
+        SELECT id, previous_status, p_status, p_changed_by, NOW() - stage_started
+        FROM updated
+    ),
+    auto_tasks AS (
+        INSERT INTO tasks (lead_id, title, description, status, assigned_to)
+        SELECT id, 'Prepare for Visit', 'Ensure brochure packet and counseling room are ready.', 'pending',
+               COALESCE(assigned_to, p_changed_by)
+        FROM updated
+        WHERE p_status::TEXT = 'visit_scheduled'
+    )
+    SELECT COALESCE(jsonb_agg(
+        (to_jsonb(u) - 'stage_started') || jsonb_build_object(
+            'students', COALESCE(
+                (SELECT jsonb_agg(to_jsonb(s)) FROM students s WHERE s.lead_id = u.id),
+                '[]'::JSONB
+            )
+        )
+    ), '[]'::JSONB)
+    INTO v_result
+    FROM updated u;
+
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql;
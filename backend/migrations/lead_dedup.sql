@@ -0,0 +1,22 @@
+-- Duplicate lead detection on email/phone
+-- Execute this in Supabase SQL Editor
+-- Normalization must match services/lead_search.py (normalize_email / normalize_phone)
+
+-- 1. Normalized identity columns (kept current by Postgres)
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS email_normalized TEXT
+    GENERATED ALWAYS AS (NULLIF(LOWER(BTRIM(email)), '')) STORED;
+
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS phone_normalized TEXT
+    GENERATED ALWAYS AS (NULLIF(RIGHT(REGEXP_REPLACE(COALESCE(phone, ''), '\D', '', 'g'), 10), '')) STORED;
+
+-- 2. Flag for leads inserted in 'flag' mode while a match already existed
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS duplicate_of UUID REFERENCES leads(id) ON DELETE SET NULL;
+
+-- 3. Exact-match lookups at ingest time (partial: many leads lack one of the two)
+-- Not UNIQUE: existing data already contains duplicates and 'flag' mode keeps them
+CREATE INDEX IF NOT EXISTS idx_leads_email_normalized ON leads (email_normalized)
+    WHERE email_normalized IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_leads_phone_normalized ON leads (phone_normalized)
+    WHERE phone_normalized IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_leads_duplicate_of ON leads(duplicate_of)
+    WHERE duplicate_of IS NOT NULL;
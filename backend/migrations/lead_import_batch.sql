@@ -0,0 +1,34 @@
+-- Atomic lead + student insert for spreadsheet imports (services/lead_import.py)
+-- Execute this in Supabase SQL Editor, after lead_dedup.sql
+
+-- p_leads: JSON array of leads with client-generated ids; p_students: JSON array of
+-- students whose lead_id points into p_leads. Both inserts run in one transaction, so
+-- a failing student row rolls back its whole batch instead of leaving leads without
+-- their students. Returns a JSON array of the inserted leads, each with its students, in input order.
+CREATE OR REPLACE FUNCTION import_leads_batch(p_leads JSONB, p_students JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_result JSONB;
+BEGIN
+    INSERT INTO leads (id, parent_name, email, phone, status, source, assigned_to,
+                       last_interaction_at, created_by, duplicate_of)
+    SELECT r.id, r.parent_name, r.email, r.phone, r.status, r.source, r.assigned_to,
+           r.last_interaction_at, r.created_by, r.duplicate_of
+    FROM jsonb_populate_recordset(NULL::leads, p_leads) r;
+
+    INSERT INTO students (lead_id, name, grade_applying_for, dob)
+    SELECT s.lead_id, s.name, s.grade_applying_for, s.dob
+    FROM jsonb_populate_recordset(NULL::students, COALESCE(p_students, '[]'::JSONB)) s;
+
+    SELECT COALESCE(jsonb_agg(
+        to_jsonb(l) || jsonb_build_object('students', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(s)) FROM students s WHERE s.lead_id = l.id), '[]'::JSONB))
+        ORDER BY e.ord
+    ), '[]'::JSONB)
+    INTO v_result
+    FROM jsonb_array_elements(p_leads) WITH ORDINALITY AS e(elem, ord)
+    JOIN leads l ON l.id = (e.elem->>'id')::UUID;
+
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,78 @@
+-- Atomic lead status transition (replaces the multi round-trip logic in leads.update_lead_status)
+-- Execute this in Supabase SQL Editor
+
+-- 1. Track when the lead entered its current stage (used for time-in-stage)
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMPTZ;
+UPDATE leads SET status_changed_at = COALESCE(updated_at, created_at) WHERE status_changed_at IS NULL;
+
+ALTER TABLE lead_status_history ADD COLUMN IF NOT EXISTS time_in_previous_stage INTERVAL;
+CREATE INDEX IF NOT EXISTS idx_lead_status_history_lead_id ON lead_status_history(lead_id);
+
+-- 2. Transition function
+-- Locks the lead, captures previous status and time-in-stage, updates the lead,
+-- writes interaction + history (+ auto-task for visit_scheduled) and returns
+-- the updated lead with its students as JSON. Returns NULL if the lead does not exist.
+CREATE OR REPLACE FUNCTION transition_lead_status(
+    p_lead_id UUID,
+    p_status leads.status%TYPE,
+    p_changed_by UUID
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_previous_status TEXT;
+    v_stage_started TIMESTAMPTZ;
+    v_lead leads%ROWTYPE;
+BEGIN
+    SELECT status::TEXT, COALESCE(status_changed_at, created_at)
+    INTO v_previous_status, v_stage_started
+    FROM leads
+    WHERE id = p_lead_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE leads SET
+        status = p_status,
+        updated_at = NOW(),
+        last_interaction_at = NOW(),
+        status_changed_at = CASE
+            WHEN v_previous_status IS DISTINCT FROM p_status::TEXT THEN NOW()
+            ELSE status_changed_at
+        END
+    WHERE id = p_lead_id
+    RETURNING * INTO v_lead;
+
+    INSERT INTO interactions (lead_id, type, summary, created_by)
+    VALUES (
+        p_lead_id,
+        'status_change',
+        'Status updated to ' || INITCAP(REPLACE(p_status::TEXT, '_', ' ')),
+        p_changed_by
+    );
+
+    INSERT INTO lead_status_history (lead_id, previous_status, new_status, changed_by, time_in_previous_stage)
+    VALUES (p_lead_id, v_previous_status, p_status, p_changed_by, NOW() - v_stage_started);
+
+    -- Automation: Auto-Task
+    IF p_status::TEXT = 'visit_scheduled' THEN
+        INSERT INTO tasks (lead_id, title, description, status, assigned_to)
+        VALUES (
+            p_lead_id,
+            'Prepare for Visit',
+            'Ensure brochure packet and counseling room are ready.',
+            'pending',
+            COALESCE(v_lead.assigned_to, p_changed_by)
+        );
+    END IF;
+
+    RETURN to_jsonb(v_lead) || jsonb_build_object(
+        'previous_status', v_previous_status,
+        'students', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(s)) FROM students s WHERE s.lead_id = p_lead_id),
+            '[]'::JSONB
+        )
+    );
+END;
+$$ LANGUAGE plpgsql;
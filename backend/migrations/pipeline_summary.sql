@@ -0,0 +1,31 @@
+-- Server-side pipeline summary (GET /api/v1/pipeline/summary)
+-- Execute this in Supabase SQL Editor
+
+-- 1. SLA thresholds (hours per status) live in app_settings.sla_thresholds
+-- Statuses missing from the map, or with 0 hours, are never overdue
+INSERT INTO app_settings (key, value) VALUES
+('sla_thresholds', '{"new": 24, "attempted_contact": 48, "connected": 72, "visit_scheduled": 168, "application_submitted": 72}')
+ON CONFLICT (key) DO NOTHING;
+
+-- 2. Supports both the per-status count and the overdue range check
+CREATE INDEX IF NOT EXISTS idx_leads_status_last_interaction ON leads(status, last_interaction_at);
+
+-- 3. Count per status plus count past SLA, in one pass over the index
+CREATE OR REPLACE FUNCTION pipeline_summary()
+RETURNS TABLE (status TEXT, count BIGINT, overdue_count BIGINT) AS $$
+    WITH sla AS (
+        SELECT t.status, t.hours::TEXT::NUMERIC AS sla_hours
+        FROM app_settings a, jsonb_each(a.value) AS t(status, hours)
+        WHERE a.key = 'sla_thresholds'
+    )
+    SELECT
+        l.status::TEXT,
+        COUNT(*),
+        COUNT(*) FILTER (
+            WHERE s.sla_hours > 0
+            AND l.last_interaction_at < NOW() - s.sla_hours * INTERVAL '1 hour'
+        )
+    FROM leads l
+    LEFT JOIN sla s ON s.status = l.status::TEXT
+    GROUP BY l.status;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,18 @@
+-- Bulk profile email updates for scripts/backfill_emails.py
+-- Execute this in Supabase SQL Editor
+
+-- Set email on existing profiles from [{"id": ..., "email": ...}, ...] in one statement.
+-- An UPDATE rather than an upsert: rows never need inserting, and an upsert of
+-- (id, email) alone would trip NOT NULL columns on the insert path.
+CREATE OR REPLACE FUNCTION update_profile_emails(p_changes JSONB)
+RETURNS INTEGER AS $$
+    WITH changed AS (
+        UPDATE profiles p SET email = c.email
+        FROM jsonb_to_recordset(p_changes) AS c(id UUID, email TEXT)
+        WHERE p.id = c.id AND p.email IS DISTINCT FROM c.email
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM changed;
+$$ LANGUAGE sql;
+
+REVOKE EXECUTE ON FUNCTION update_profile_emails(JSONB) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,4 @@
+-- Look up profiles by email (admin user creation, scripts/backfill_emails.py)
+-- Execute this in Supabase SQL Editor
+
+CREATE INDEX IF NOT EXISTS idx_profiles_email ON profiles(email) WHERE email IS NOT NULL;
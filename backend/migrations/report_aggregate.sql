@@ -0,0 +1,56 @@
+-- Grouped report results (services/report_aggregate.py)
+-- Execute this in Supabase SQL Editor
+
+-- Per-group lead count, enrolled count and interaction count for one report.
+-- p_group_column: 'status', 'source', 'assigned_to' or NULL for a single total row
+-- p_filters: the report filters (status/source as a value or an array, assigned_to, date_from, date_to)
+-- p_assigned_to: permission scope, NULL when the caller can view all leads
+CREATE OR REPLACE FUNCTION report_aggregate(
+    p_group_column TEXT,
+    p_filters JSONB DEFAULT '{}'::JSONB,
+    p_assigned_to UUID DEFAULT NULL
+)
+RETURNS TABLE (group_key TEXT, total_leads BIGINT, enrolled BIGINT, interactions BIGINT) AS $$
+DECLARE
+    v_group_expr TEXT;
+BEGIN
+    IF p_group_column IS NULL THEN
+        v_group_expr := 'NULL::TEXT';
+    ELSIF p_group_column IN ('status', 'source', 'assigned_to') THEN
+        v_group_expr := format('l.%I::TEXT', p_group_column);
+    ELSE
+        RAISE EXCEPTION 'Unsupported report grouping: %', p_group_column;
+    END IF;
+
+    RETURN QUERY EXECUTE format($q$
+        WITH scoped AS (
+            SELECT l.id, l.status::TEXT AS status, %s AS group_key
+            FROM leads l
+            WHERE ($1->'status' IS NULL OR l.status::TEXT IN (SELECT jsonb_array_elements_text(
+                      CASE jsonb_typeof($1->'status') WHEN 'array' THEN $1->'status' ELSE jsonb_build_array($1->'status') END)))
+              AND ($1->'source' IS NULL OR l.source::TEXT IN (SELECT jsonb_array_elements_text(
+                      CASE jsonb_typeof($1->'source') WHEN 'array' THEN $1->'source' ELSE jsonb_build_array($1->'source') END)))
+              AND ($1->>'assigned_to' IS NULL OR l.assigned_to = ($1->>'assigned_to')::UUID)
+              AND ($1->>'date_from' IS NULL OR l.created_at >= ($1->>'date_from')::TIMESTAMPTZ)
+              AND ($1->>'date_to' IS NULL OR l.created_at <= ($1->>'date_to')::TIMESTAMPTZ)
+              AND ($2::UUID IS NULL OR l.assigned_to = $2)
+        ),
+        lead_interactions AS (
+            SELECT i.lead_id, COUNT(*) AS n
+            FROM interactions i
+            JOIN scoped s ON s.id = i.lead_id
+            GROUP BY i.lead_id
+        )
+        SELECT
+            s.group_key,
+            COUNT(*)::BIGINT,
+            COUNT(*) FILTER (WHERE s.status = 'enrolled')::BIGINT,
+            COALESCE(SUM(li.n), 0)::BIGINT
+        FROM scoped s
+        LEFT JOIN lead_interactions li ON li.lead_id = s.id
+        GROUP BY s.group_key
+        ORDER BY COUNT(*) DESC
+    $q$, v_group_expr)
+    USING p_filters, p_assigned_to;
+END;
+$$ LANGUAGE plpgsql STABLE;
@@ -0,0 +1,92 @@
+-- Report result cache (services/report_cache.py)
+-- Execute this in Supabase SQL Editor, after report_export_jobs.sql
+
+-- 1. Data generation: a sequence advanced once by every transaction that writes to the
+-- tables reports read. Cached previews and files are keyed by it, so they are reused until
+-- lead data changes. nextval() takes no row lock, so concurrent writers never queue on it.
+--
+-- nextval() runs before the writer's rows become visible, so a reader could see the new
+-- generation, still read the old data and cache it under the new key. To close that window
+-- each bumping writer holds a shared advisory lock until it commits, and
+-- report_data_generation() only returns a generation when it can take the same lock
+-- exclusively, i.e. when no bump is awaiting its commit. Otherwise it returns NULL and the
+-- caller skips the cache for that request. Writers never wait on each other; a writer waits
+-- at most for one reader's single-row SELECT.
+CREATE SEQUENCE IF NOT EXISTS report_data_generation_seq;
+
+CREATE OR REPLACE FUNCTION bump_report_data_generation()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Once per transaction, however many rows and statements it touches
+    IF current_setting('report_cache.bumped_xid', TRUE) IS DISTINCT FROM txid_current()::TEXT THEN
+        PERFORM pg_advisory_xact_lock_shared(hashtext('report_data_generation'));
+        PERFORM nextval('report_data_generation_seq');
+        PERFORM set_config('report_cache.bumped_xid', txid_current()::TEXT, TRUE);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deferred to commit, so the advisory lock is only held while the transaction commits
+DROP TRIGGER IF EXISTS bump_report_generation ON leads;
+CREATE CONSTRAINT TRIGGER bump_report_generation
+    AFTER INSERT OR UPDATE OR DELETE ON leads
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION bump_report_data_generation();
+
+DROP TRIGGER IF EXISTS bump_report_generation ON students;
+CREATE CONSTRAINT TRIGGER bump_report_generation
+    AFTER INSERT OR UPDATE OR DELETE ON students
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION bump_report_data_generation();
+
+DROP TRIGGER IF EXISTS bump_report_generation ON interactions;
+CREATE CONSTRAINT TRIGGER bump_report_generation
+    AFTER INSERT OR UPDATE OR DELETE ON interactions
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION bump_report_data_generation();
+
+-- Counselor names are shown in grouped reports
+DROP TRIGGER IF EXISTS bump_report_generation ON profiles;
+CREATE CONSTRAINT TRIGGER bump_report_generation
+    AFTER UPDATE OF full_name ON profiles
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION bump_report_data_generation();
+
+-- Constraint triggers cannot fire on TRUNCATE
+DROP TRIGGER IF EXISTS bump_report_generation_truncate ON leads;
+CREATE TRIGGER bump_report_generation_truncate
+    AFTER TRUNCATE ON leads
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_report_data_generation();
+
+DROP TRIGGER IF EXISTS bump_report_generation_truncate ON students;
+CREATE TRIGGER bump_report_generation_truncate
+    AFTER TRUNCATE ON students
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_report_data_generation();
+
+DROP TRIGGER IF EXISTS bump_report_generation_truncate ON interactions;
+CREATE TRIGGER bump_report_generation_truncate
+    AFTER TRUNCATE ON interactions
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_report_data_generation();
+
+-- NULL while a writer has bumped the generation but not yet committed (see above)
+CREATE OR REPLACE FUNCTION report_data_generation()
+RETURNS BIGINT AS $$
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('report_data_generation')) THEN
+        RETURN NULL;
+    END IF;
+    -- Before the first nextval() last_value is already 1: report 0 so the first write changes it
+    RETURN (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM report_data_generation_seq);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Earlier versions of this migration kept the generation in a single-row table
+DROP TABLE IF EXISTS report_data_generation;
+
+-- 2. Each run records the cache key of its result, and whether its file was reused from an earlier run
+ALTER TABLE report_runs ADD COLUMN IF NOT EXISTS cache_key TEXT;
+ALTER TABLE report_runs ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_report_runs_cache_key ON report_runs(cache_key, completed_at DESC)
+    WHERE status = 'completed' AND NOT cache_hit;
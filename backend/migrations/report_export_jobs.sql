@@ -0,0 +1,34 @@
+-- Asynchronous report exports (POST /api/v1/reports/export?mode=async)
+-- Execute this in Supabase SQL Editor, after background_scheduler.sql
+
+-- 1. A queued export is a pending report_runs row carrying what to render
+ALTER TABLE report_runs ADD COLUMN IF NOT EXISTS format VARCHAR(20);
+ALTER TABLE report_runs ADD COLUMN IF NOT EXISTS report_config JSONB;
+ALTER TABLE report_runs ADD COLUMN IF NOT EXISTS locked_by TEXT;
+ALTER TABLE report_runs ADD COLUMN IF NOT EXISTS locked_until TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_report_runs_queue ON report_runs(run_at)
+    WHERE status IN ('pending', 'running') AND report_config IS NOT NULL;
+
+-- 2. Lease up to p_limit queued exports for one scheduler worker.
+-- Runs left 'running' by a worker that died are picked up again once their lease expires.
+CREATE OR REPLACE FUNCTION claim_pending_export_runs(
+    p_worker TEXT,
+    p_lease_seconds INTEGER,
+    p_limit INTEGER
+)
+RETURNS SETOF report_runs AS $$
+    UPDATE report_runs r SET
+        status = 'running',
+        locked_by = p_worker,
+        locked_until = NOW() + p_lease_seconds * INTERVAL '1 second'
+    WHERE r.id IN (
+        SELECT id FROM report_runs
+        WHERE report_config IS NOT NULL
+          AND (status = 'pending' OR (status = 'running' AND locked_until < NOW()))
+        ORDER BY run_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING r.*;
+$$ LANGUAGE sql;
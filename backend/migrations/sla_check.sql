@@ -0,0 +1,40 @@
+-- Set-based SLA check (services/sla_check.py)
+-- Execute this in Supabase SQL Editor, after pipeline_summary.sql
+
+-- 1. Cooldown lookups: "was this owner alerted about this lead recently?"
+CREATE INDEX IF NOT EXISTS idx_notifications_user_link_created ON notifications(user_id, link, created_at DESC);
+
+-- 2. Overdue, assigned leads, minus those already alerted within the cooldown window,
+-- one keyset page (ordered by id, after p_after_id) at a time: a set-returning RPC is
+-- capped by PostgREST max-rows, so the caller pages until a short page comes back.
+-- SLA hours come from app_settings.sla_thresholds.
+DROP FUNCTION IF EXISTS sla_overdue_leads(NUMERIC);
+
+CREATE OR REPLACE FUNCTION sla_overdue_leads(
+    p_cooldown_hours NUMERIC DEFAULT 24,
+    p_after_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 1000
+)
+RETURNS TABLE (id UUID, parent_name TEXT, assigned_to UUID, status TEXT, last_interaction_at TIMESTAMPTZ) AS $$
+    WITH sla AS (
+        SELECT t.status, t.hours::TEXT::NUMERIC AS sla_hours
+        FROM app_settings a, jsonb_each(a.value) AS t(status, hours)
+        WHERE a.key = 'sla_thresholds'
+    )
+    SELECT l.id, l.parent_name::TEXT, l.assigned_to, l.status::TEXT, l.last_interaction_at
+    FROM sla s
+    JOIN leads l ON l.status::TEXT = s.status
+    WHERE s.sla_hours > 0
+      AND l.assigned_to IS NOT NULL
+      AND (p_after_id IS NULL OR l.id > p_after_id)
+      AND l.last_interaction_at < NOW() - s.sla_hours * INTERVAL '1 hour'
+      AND NOT EXISTS (
+          SELECT 1 FROM notifications n
+          WHERE n.user_id = l.assigned_to
+            AND n.link = '/leads/' || l.id
+            AND n.type = 'alert'
+            AND n.created_at > NOW() - p_cooldown_hours * INTERVAL '1 hour'
+      )
+    ORDER BY l.id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
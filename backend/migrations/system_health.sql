@@ -0,0 +1,23 @@
+-- Database figures for the admin health sampler (services/health.py)
+-- Execute this in Supabase SQL Editor, after report_export_jobs.sql and lead_archival_jobs.sql
+
+-- One call doubles as the latency ping: open connections to this database, and the
+-- background jobs queue across every worker, read from the lease and job tables:
+-- periodic jobs under lease, scheduled reports that are due or running, queued or running
+-- export runs and archive jobs. Every worker reports the same number.
+CREATE OR REPLACE FUNCTION system_health_stats()
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'database_connections', (SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()),
+        'jobs_queue_size',
+            (SELECT COUNT(*) FROM scheduled_jobs WHERE locked_until > NOW())
+          + (SELECT COUNT(*) FROM scheduled_reports
+             WHERE status = 'active' AND (next_run <= NOW() OR locked_until > NOW()))
+          + (SELECT COUNT(*) FROM report_runs
+             WHERE status IN ('pending', 'running') AND report_config IS NOT NULL)
+          + (SELECT COUNT(*) FROM archive_jobs WHERE status IN ('pending', 'running'))
+    );
+$$ LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = public, pg_catalog;
+
+REVOKE EXECUTE ON FUNCTION system_health_stats() FROM PUBLIC, anon, authenticated;
@@ -44,9 +44,15 @@ class LeadBase(BaseModel):
 class LeadCreate(LeadBase):
     students: List[StudentCreate] = []
 
+class DedupMode(str, Enum):
+    flag = "flag"    # Insert anyway, set duplicate_of to the existing lead
+    skip = "skip"    # Don't insert
+    merge = "merge"  # Fill blanks on the existing lead and attach new students
+
 class Lead(LeadBase):
     id: UUID
     created_by: Optional[UUID] = None
+    duplicate_of: Optional[UUID] = None
     created_at: datetime
     updated_at: datetime
     students: List[Student] = []
@@ -54,6 +60,14 @@ class Lead(LeadBase):
     class Config:
         from_attributes = True
 
+class LeadSuggestion(BaseModel):
+    id: UUID
+    parent_name: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    status: Optional[str] = None
+    assigned_to: Optional[UUID] = None
+
 class LeadUpdate(BaseModel):
     parent_name: Optional[str] = None
     email: Optional[str] = None
@@ -226,11 +240,12 @@ class ReportBuildResponse(BaseModel):
     report_id: Optional[UUID] = None
     preview_data: List[Dict[str, Any]]
     row_count: int
+    count_method: str = "exact"  # 'estimated' when row_count is the planner estimate
 
 class ReportExportRequest(BaseModel):
     report_id: Optional[str] = None
     report_config: Optional[dict] = None  # Full report definition for unsaved exports
-    format: str  # 'csv', 'pdf', 'xlsx', 'sheets'
+    format: str  # 'csv', 'pdf', 'xlsx', 'parquet', 'arrow', 'sheets'
 
 class ReportExportResponse(BaseModel):
     download_url: str
@@ -407,6 +422,11 @@ class SystemHealth(BaseModel):
     cpu_usage: float
     memory_usage: float
     disk_usage: float
+    event_loop_lag_ms: float = 0.0
+    database_latency_ms: Optional[float] = None
+    cache: Optional[Dict[str, Any]] = None
+    sampled_at: Optional[datetime] = None
+    history: List[Dict[str, Any]] = []  # Earlier samples, oldest first
 
 class AuditLog(BaseModel):
     id: UUID
@@ -431,6 +451,8 @@ class AuditLogListResponse(BaseModel):
     total: int
     page: int
     limit: int
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for the next page; None on the last page
+    count_method: str = "exact"  # 'estimated' when total is the planner estimate
 
 class AppSetting(BaseModel):
     id: UUID
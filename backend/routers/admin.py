@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime, timedelta
 from uuid import UUID, uuid4
 import json
+import base64
 import hashlib
 import secrets
+from concurrent.futures import ThreadPoolExecutor
 from database import get_db
 from dependencies import get_current_user, require_role, require_permission
 from models import (
@@ -13,6 +15,14 @@ from models import (
     WebhookCreate, Webhook, APIKeyCreate, APIKey, APIKeyCreateResponse,
     SystemHealth, AuditLog, AuditLogListResponse, AppSetting, ArchiveCriteria
 )
+from starlette.concurrency import run_in_threadpool
+from services.archival import (
+    archive_leads as archive_leads_job, get_archive_job, resume_archive_job, ArchivalError, ArchiveInProgress
+)
+from services.audit_log import audit_writer
+from services.auth_users import auth_user_directory
+from services.health import health_sampler
+from services.scheduler import scheduler
 
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 # Force reload for psutil
@@ -112,16 +122,11 @@ async def create_user(
             err_str = str(auth_err).lower()
             if "already registered" in err_str or "already been registered" in err_str:
                 print(f"⚠️ User {user_data.email} already exists in Auth. Linking to profile...")
-                # Search for existing user ID
-                # Note: list_users returns a list of User objects directly in python client v2
-                all_users = supabase.auth.admin.list_users(per_page=1000)
-                # If list_users returns an object with .users, handle it (older versions/wrappers)
-                users_list = all_users if isinstance(all_users, list) else getattr(all_users, 'users', [])
-                
-                existing_user = next((u for u in users_list if hasattr(u, 'email') and u.email == user_data.email), None)
+                # Indexed lookup first (profiles.email), paged auth listing only as a fallback
+                existing_id = await run_in_threadpool(auth_user_directory.find_id, user_data.email)
                 
-                if existing_user:
-                    user_id = existing_user.id
+                if existing_id:
+                    user_id = existing_id
                     print(f"✅ Found existing User ID: {user_id}")
                 else:
                     raise HTTPException(status_code=400, detail="User exists in Auth but could not be found via Admin API.")
@@ -130,6 +135,7 @@ async def create_user(
 
         if not user_id:
              raise HTTPException(status_code=500, detail="Failed to create or find auth user")
+        auth_user_directory.remember(user_data.email, str(user_id))
 
         # 2. Create Profile Entry
         profile_data = {
@@ -152,14 +158,8 @@ async def create_user(
             # raise HTTPException(status_code=500, detail="Failed to create profile")
         
         # Log audit
-        audit_data = {
-            "user_id": user.get("id"),
-            "action": "created",
-            "resource": "user",
-            "resource_id": str(user_id),
-            "details": json.dumps({"email": user_data.email, "role": user_data.role})
-        }
-        supabase.table("audit_logs").insert(audit_data).execute()
+        audit_writer.log(user.get("id"), "created", "user", str(user_id),
+                         details={"email": user_data.email, "role": user_data.role})
         
         return {
             "user_id": str(user_id),
@@ -205,16 +205,11 @@ async def update_user(
     if not result.data:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Log audit
-    audit_data = {
-        "user_id": user.get("id"),
-        "action": "updated",
-        "resource": "user",
-        "resource_id": str(user_id),
-        "before_data": json.dumps(before_data),
-        "after_data": json.dumps(result.data[0])
-    }
-    supabase.table("audit_logs").insert(audit_data).execute()
+    # Log audit: only the fields that were updated
+    after_data = result.data[0]
+    audit_writer.log(user.get("id"), "updated", "user", str(user_id),
+                     before_data={k: before_data.get(k) for k in update_data},
+                     after_data={k: after_data.get(k) for k in update_data})
     
     return {"message": "User updated successfully"}
 
@@ -244,16 +239,10 @@ async def delete_user(
         supabase.auth.admin.delete_user(str(user_id))
     except Exception as e:
         print(f"Failed to delete auth user: {e}")
+    auth_user_directory.forget(str(user_id))
     
     # Log audit
-    audit_data = {
-        "user_id": user.get("id"),
-        "action": "deleted",
-        "resource": "user",
-        "resource_id": str(user_id),
-        "before_data": json.dumps(user_data)
-    }
-    supabase.table("audit_logs").insert(audit_data).execute()
+    audit_writer.log(user.get("id"), "deleted", "user", str(user_id), before_data=user_data)
     
     return {"message": "User deleted successfully"}
 
@@ -271,14 +260,8 @@ async def impersonate_user(
         raise HTTPException(status_code=404, detail="User not found")
     
     # Log audit
-    audit_data = {
-        "user_id": user.get("id"),
-        "action": "impersonated",
-        "resource": "user",
-        "resource_id": str(user_id),
-        "details": json.dumps({"impersonated_user": target_result.data[0]["email"]})
-    }
-    supabase.table("audit_logs").insert(audit_data).execute()
+    audit_writer.log(user.get("id"), "impersonated", "user", str(user_id),
+                     details={"impersonated_user": target_result.data[0]["email"]})
     
     # In production, generate a special impersonation token
     impersonation_token = f"imp_{secrets.token_urlsafe(32)}"
@@ -288,50 +271,107 @@ async def impersonate_user(
         "expires_at": datetime.now() + timedelta(hours=1)
     }
 
+BULK_USER_CHUNK_SIZE = 200
+AUTH_DELETE_CONCURRENCY = 8  # Parallel Supabase Auth admin calls per bulk delete
+
+def _bulk_profiles(ids: List[str], apply) -> Dict[str, str]:
+    """
+    Run apply(query) (an update or delete on profiles) with one in_() filter per chunk.
+    A chunk the database rejects (e.g. a foreign key on one profile) is retried row by row.
+    Returns {user_id: "ok" | "not_found" | error message}.
+    """
+    supabase = get_db()
+    results = {}
+    for i in range(0, len(ids), BULK_USER_CHUNK_SIZE):
+        chunk = ids[i:i + BULK_USER_CHUNK_SIZE]
+        try:
+            res = apply(supabase.table("profiles")).in_("id", chunk).execute()
+            done = {p["id"] for p in res.data or []}
+            results.update({uid: "ok" if uid in done else "not_found" for uid in chunk})
+        except Exception:
+            for uid in chunk:
+                try:
+                    res = apply(supabase.table("profiles")).eq("id", uid).execute()
+                    results[uid] = "ok" if res.data else "not_found"
+                except Exception as e:
+                    results[uid] = str(e)
+    return results
+
+def _delete_auth_users(ids: List[str]) -> Dict[str, Optional[str]]:
+    """Delete Supabase Auth users concurrently. Returns {user_id: None or error message}."""
+    supabase = get_db()
+
+    def delete(uid: str) -> Optional[str]:
+        try:
+            supabase.auth.admin.delete_user(uid)
+            return None
+        except Exception as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=AUTH_DELETE_CONCURRENCY) as pool:
+        return dict(zip(ids, pool.map(delete, ids)))
+
 @router.post("/users/bulk-action")
 async def bulk_user_action(
     bulk_action: BulkUserAction,
     user=Depends(require_permission("users.delete"))
 ):
-    """Perform bulk action on users (admin only)"""
-    supabase = get_db()
+    """
+    Perform bulk action on users (admin only).
+    Profiles are updated/deleted with one in_() query per BULK_USER_CHUNK_SIZE
+    users; deletes also remove the Supabase Auth users, AUTH_DELETE_CONCURRENCY
+    at a time. Returns a result per user.
+    """
+    user_ids = list(dict.fromkeys(str(uid) for uid in bulk_action.user_ids))
     
     if bulk_action.action == "activate":
         update_data = {"status": "active"}
     elif bulk_action.action == "deactivate":
         update_data = {"status": "inactive"}
     elif bulk_action.action == "delete":
-        # Delete users
-        for user_id in bulk_action.user_ids:
-            supabase.table("profiles").delete().eq("id", str(user_id)).execute()
-        
-        # Log audit
-        audit_data = {
-            "user_id": user.get("id"),
-            "action": "deleted",
-            "resource": "user",
-            "details": json.dumps({"bulk_delete": [str(uid) for uid in bulk_action.user_ids]})
-        }
-        supabase.table("audit_logs").insert(audit_data).execute()
-        
-        return {"message": f"{len(bulk_action.user_ids)} users deleted"}
+        update_data = None
     else:
         raise HTTPException(status_code=400, detail="Invalid action")
     
-    # Update users
-    for user_id in bulk_action.user_ids:
-        supabase.table("profiles").update(update_data).eq("id", str(user_id)).execute()
+    if update_data:
+        outcomes = await run_in_threadpool(_bulk_profiles, user_ids, lambda q: q.update(update_data))
+        results = [
+            {"user_id": uid, "status": "updated" if outcome == "ok" else outcome}
+            if outcome in ("ok", "not_found") else {"user_id": uid, "status": "failed", "error": outcome}
+            for uid, outcome in outcomes.items()
+        ]
+        done = [r["user_id"] for r in results if r["status"] == "updated"]
+        audit_writer.log(user.get("id"), "updated", "user",
+                         details={"bulk_action": bulk_action.action, "user_ids": done})
+    else:
+        outcomes = await run_in_threadpool(_bulk_profiles, user_ids, lambda q: q.delete())
+        # Auth users go too, also when the profile was already missing
+        auth_ids = [uid for uid, outcome in outcomes.items() if outcome in ("ok", "not_found")]
+        auth_errors = await run_in_threadpool(_delete_auth_users, auth_ids)
+        for uid in auth_ids:
+            auth_user_directory.forget(uid)
+        results = []
+        for uid, outcome in outcomes.items():
+            auth_error = auth_errors.get(uid)
+            if outcome not in ("ok", "not_found"):
+                results.append({"user_id": uid, "status": "failed", "error": outcome})
+            elif outcome == "not_found" and auth_error:
+                results.append({"user_id": uid, "status": "not_found"})
+            elif auth_error:
+                print(f"Failed to delete auth user {uid}: {auth_error}")
+                results.append({"user_id": uid, "status": "deleted", "error": f"Auth user not deleted: {auth_error}"})
+            else:
+                results.append({"user_id": uid, "status": "deleted"})
+        done = [r["user_id"] for r in results if r["status"] == "deleted"]
+        audit_writer.log(user.get("id"), "deleted", "user", details={"bulk_delete": done})
     
-    # Log audit
-    audit_data = {
-        "user_id": user.get("id"),
-        "action": "updated",
-        "resource": "user",
-        "details": json.dumps({"bulk_action": bulk_action.action, "user_ids": [str(uid) for uid in bulk_action.user_ids]})
+    verb = "updated" if update_data else "deleted"
+    return {
+        "message": f"{len(done)} users {verb}",
+        "succeeded": len(done),
+        "failed": len(results) - len(done),
+        "results": results
     }
-    supabase.table("audit_logs").insert(audit_data).execute()
-    
-    return {"message": f"{len(bulk_action.user_ids)} users updated"}
 
 # ============================================
 # Roles & Permissions Endpoints
@@ -526,56 +566,35 @@ async def disconnect_integration(
 
 @router.get("/health", response_model=SystemHealth)
 async def get_system_health(user=Depends(require_role(["admin"]))):
-    """Get system health status (admin only)"""
-    try:
-        import psutil
-        
-        # 1. Get system metrics
-        cpu_usage = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-
-        # 2. Check Database Connection (Real Ping)
-        try:
-            # Execute a lightweight query to check connectivity
-            supabase = get_db()
-            supabase.table("custom_roles").select("id").limit(1).execute()
-            database_status = "healthy"
-        except Exception as e:
-            print(f"Health Check DB Error: {e}")
-            database_status = "disconnected"
-
-        # 3. Determine Server Status based on load
-        if cpu_usage > 90 or memory.percent > 95:
-            server_status = "high_load"
-        else:
-            server_status = "healthy"
-        
-        return SystemHealth(
-            server_status=server_status,
-            database_status=database_status,
-            database_connections=10,  # Placeholder (Supabase doesn't expose this easily via client)
-            jobs_queue_size=0,
-            cpu_usage=cpu_usage,
-            memory_usage=memory.percent,
-            disk_usage=disk.percent
-        )
-    except ImportError:
-        # Fallback if psutil is not installed
-        return SystemHealth(
-            server_status="healthy",
-            database_status="unknown",
-            database_connections=0,
-            jobs_queue_size=0,
-            cpu_usage=0.0,
-            memory_usage=0.0,
-            disk_usage=0.0
-        )
+    """
+    Get system health status (admin only): the latest sample from the
+    background sampler (services/health.py) plus its recent history.
+    """
+    sample = health_sampler.latest() or await health_sampler.sample()
+    return SystemHealth(**sample, history=health_sampler.history()[:-1])
 
 # ============================================
 # Audit Logs Endpoints
 # ============================================
 
+AUDIT_SEARCH_MAX_USERS = 100  # Matching users passed as an in() list; beyond that, filter on actor_search_text
+
+def _contains_pattern(value: str) -> str:
+    """Quoted ilike substring pattern for a PostgREST or=() expression; LIKE wildcards in value match literally"""
+    for ch in ("\\", "%", "_"):
+        value = value.replace(ch, "\\" + ch)
+    return '"' + f"*{value}*".replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _encode_audit_cursor(log_data: dict) -> str:
+    return base64.urlsafe_b64encode(f"{log_data['created_at']}|{log_data['id']}".encode()).decode()
+
+def _decode_audit_cursor(cursor: str):
+    try:
+        created_at, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at).isoformat(), str(UUID(log_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/audit-logs", response_model=AuditLogListResponse)
 async def get_audit_logs(
     date_from: Optional[str] = Query(None),
@@ -586,12 +605,24 @@ async def get_audit_logs(
     search: Optional[str] = Query(None),
     limit: int = Query(50, le=100),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None),
+    count: str = Query("exact"),
     user=Depends(require_role(["admin"]))
 ):
-    """Get audit log entries (admin only)"""
+    """
+    Get audit log entries (admin only), newest first.
+    Pass the returned next_cursor as cursor= for the next page: keyset
+    pagination on (created_at, id), which costs the same on every page
+    (offset still works but scans every skipped row). count=estimated uses the
+    planner's estimate instead of counting every matching entry.
+    """
     supabase = get_db()
     
-    query = supabase.table("audit_logs").select("*, profiles(full_name, email)", count="exact").order("created_at", desc=True)
+    if count not in ["exact", "estimated"]:
+        raise HTTPException(status_code=400, detail="Invalid count method")
+    
+    query = supabase.table("audit_logs").select("*, profiles(full_name, email)", count=count) \
+        .order("created_at", desc=True).order("id", desc=True)
     
     if date_from:
         query = query.gte("created_at", date_from)
@@ -603,12 +634,34 @@ async def get_audit_logs(
         query = query.eq("action", action)
     if resource:
         query = query.eq("resource", resource)
-    
-    query = query.limit(limit).offset(offset)
-    result = query.execute()
+    if search and search.strip():
+        # Trigram index on audit_logs.search_text (migrations/audit_logs_keyset.sql),
+        # plus entries by users whose name or email matches
+        pattern = _contains_pattern(search.strip().lower())
+        matched = supabase.table("profiles").select("id") \
+            .or_(f"full_name.ilike.{pattern},email.ilike.{pattern}") \
+            .limit(AUDIT_SEARCH_MAX_USERS + 1).execute().data or []
+        conditions = [f"search_text.ilike.{pattern}"]
+        if len(matched) > AUDIT_SEARCH_MAX_USERS:
+            # Too many for an in() list: match the acting user's name/email row by row
+            conditions.append(f"actor_search_text.ilike.{pattern}")
+        elif matched:
+            conditions.append(f"user_id.in.({','.join(p['id'] for p in matched)})")
+        query = query.or_(",".join(conditions))
+    
+    if cursor:
+        created_at, log_id = _decode_audit_cursor(cursor)
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{log_id})')
+    elif offset:
+        query = query.offset(offset)
+    
+    # One extra row tells whether there is a next page
+    result = query.limit(limit + 1).execute()
+    rows = result.data or []
+    next_cursor = _encode_audit_cursor(rows[limit - 1]) if len(rows) > limit else None
     
     logs = []
-    for log_data in result.data if result.data else []:
+    for log_data in rows[:limit]:
         user_profile = log_data.get("profiles")
         
         logs.append(AuditLog(
@@ -631,7 +684,9 @@ async def get_audit_logs(
         logs=logs,
         total=result.count if result.count else 0,
         page=offset // limit + 1,
-        limit=limit
+        limit=limit,
+        next_cursor=next_cursor,
+        count_method=count
     )
 
 @router.get("/audit-logs/{log_id}", response_model=AuditLog)
@@ -692,83 +747,36 @@ async def archive_leads(criteria: ArchiveCriteria, user=Depends(require_role(["a
     """
     Archive leads older than X days to leads_archive table 
     and remove from primary leads table.
+    Runs as a background job; poll the returned status_url for progress.
     """
-    supabase = get_db()
-    
-    # Calculate cutoff
-    cutoff = datetime.now() - timedelta(days=criteria.days_older_than)
-    cutoff_str = cutoff.isoformat()
-    
-    # Fetch candidates
-    query = supabase.table("leads").select("*") \
-        .lt("created_at", cutoff_str)
-    
-    if criteria.statuses:
-        query = query.in_("status", criteria.statuses)
-        
-    res = query.execute()
-    leads_to_archive = res.data if res.data else []
-    
-    if not leads_to_archive:
-        return {"message": "No leads match criteria", "count": 0, "dry_run": criteria.dry_run}
-
-    if criteria.dry_run:
-        return {
-            "message": "Dry Run Result", 
-            "count": len(leads_to_archive), 
-            "preview": leads_to_archive[:5]
-        }
-    
-    # Perform Archival
-    archive_entries = []
-    ids_to_delete = []
-    
-    for lead in leads_to_archive:
-        ids_to_delete.append(lead['id'])
-        entry = {
-            "original_lead_id": lead['id'],
-            "parent_name": lead.get('parent_name'),
-            "email": lead.get('email'),
-            "archived_data": lead, 
-            "archived_reason": f"older_than_{criteria.days_older_than}_days",
-            "archived_by": user['id']
-        }
-        archive_entries.append(entry)
-    
-    # Insert Archive Records
-    chunk_size = 100
-    for i in range(0, len(archive_entries), chunk_size):
-        chunk = archive_entries[i:i+chunk_size]
-        try:
-            supabase.table("leads_archive").insert(chunk).execute()
-        except Exception as e:
-            # If insert fails, abort delete? Or log?
-            # For simplicity, we abort delete of this chunk?
-            # But we are iterating in memory.
-            # We'll skip adding to deletion list if insert failed?
-            # Too complex for MVP endpoint.
-            # We'll assume success or HTTPException.
-            # But let's raise so user knows.
-            raise HTTPException(status_code=500, detail=f"Archival failed: {str(e)}")
-        
-    # Delete from Leads
-    deleted_count = 0
-    for i in range(0, len(ids_to_delete), chunk_size):
-        chunk_ids = ids_to_delete[i:i+chunk_size]
-        del_res = supabase.table("leads").delete().in_("id", chunk_ids).execute()
-        deleted_count += len(del_res.data) if del_res.data else 0
-        
-    # Log Audit
-    audit_entry = {
-        "user_id": user['id'],
-        "action": "archived",
-        "resource": "leads",
-        "details": {
-            "count": deleted_count,
-            "cutoff_date": cutoff_str,
-            "statuses": criteria.statuses
-        }
-    }
-    supabase.table("audit_logs").insert(audit_entry).execute()
-        
-    return {"message": "Archival Complete", "count": deleted_count}
+    try:
+        result = await run_in_threadpool(
+            archive_leads_job, criteria.days_older_than, criteria.statuses, criteria.dry_run, user['id']
+        )
+    except ArchiveInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ArchivalError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if result.get("job_id"):
+        scheduler.wake()
+    return result
+
+@router.get("/archive-jobs/{job_id}")
+async def get_archive_job_status(job_id: UUID, user=Depends(require_role(["admin"]))):
+    """Progress of an archive job"""
+    job = await run_in_threadpool(get_archive_job, str(job_id))
+    if not job:
+        raise HTTPException(status_code=404, detail="Archive job not found")
+    return job
+
+@router.post("/archive-jobs/{job_id}/resume")
+async def resume_archive(job_id: UUID, user=Depends(require_role(["admin"]))):
+    """Requeue a failed archive job; it continues from its last archived chunk"""
+    try:
+        job = await run_in_threadpool(resume_archive_job, str(job_id))
+    except ArchiveInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not job:
+        raise HTTPException(status_code=409, detail="Only failed archive jobs can be resumed")
+    scheduler.wake()
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/api/v1/admin/archive-jobs/{job['id']}"}
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from typing import List, Optional
 from database import supabase
-from models import Lead, LeadCreate, StudentCreate
-from dependencies import get_current_user, require_permission
+from models import Lead, LeadCreate, StudentCreate, LeadSuggestion, DedupMode
+from dependencies import get_current_user, require_permission, require_role
 from services.webhook import webhook_service
+from services.lead_search import lead_search_index
+from services.lead_import import LeadImporter
+from services.dedup import lead_deduplicator
 
 router = APIRouter(
     prefix="/api/v1/leads",
@@ -11,6 +14,12 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+def _prefix_pattern(value: str) -> str:
+    """Quoted ilike prefix pattern for a PostgREST or=() expression; LIKE wildcards in value match literally"""
+    for ch in ("\\", "%", "_"):
+        value = value.replace(ch, "\\" + ch)
+    return '"' + (value + "%").replace("\\", "\\\\").replace('"', '\\"') + '"'
+
 @router.get("/", response_model=List[Lead])
 async def get_leads(
     status: Optional[str] = None, 
@@ -71,7 +80,11 @@ async def get_leads(
     return data
 
 @router.post("/", response_model=Lead)
-async def create_lead(lead: LeadCreate, user=Depends(require_permission("leads.create"))):
+async def create_lead(
+    lead: LeadCreate,
+    dedup: DedupMode = Query(DedupMode.flag),
+    user=Depends(require_permission("leads.create"))
+):
     # 1. Prepare Lead Data
     lead_data = lead.dict(exclude={"students"})
     lead_data["created_by"] = user['id']
@@ -79,14 +92,28 @@ async def create_lead(lead: LeadCreate, user=Depends(require_permission("leads.c
     if not lead_data.get("assigned_to"):
         lead_data["assigned_to"] = user['id']
 
-    # 2. Insert Lead
+    # 2. Duplicate check (normalized email/phone, one indexed query)
+    duplicate = lead_deduplicator.find_one(lead_data)
+    if duplicate:
+        if dedup == DedupMode.skip:
+            raise HTTPException(status_code=409, detail={
+                "message": "A lead with this email or phone already exists",
+                "duplicate_of": duplicate["id"]
+            })
+        if dedup == DedupMode.merge:
+            merged = lead_deduplicator.merge(duplicate, lead_data, [s.dict() for s in lead.students])
+            lead_search_index.upsert(merged)
+            return merged
+        lead_data["duplicate_of"] = duplicate["id"]
+
+    # 3. Insert Lead
     response = supabase.table("leads").insert(lead_data).execute()
     if not response.data:
         raise HTTPException(status_code=400, detail="Failed to create lead")
     
     new_lead = response.data[0]
     
-    # 3. Insert Students
+    # 4. Insert Students
     if lead.students:
         students_data = [s.dict() for s in lead.students]
         for s in students_data:
@@ -97,11 +124,62 @@ async def create_lead(lead: LeadCreate, user=Depends(require_permission("leads.c
     else:
         new_lead["students"] = []
     
-    # 4. Webhook: Lead Created
+    # 5. Keep typeahead index current
+    lead_search_index.upsert(new_lead)
+
+    # 6. Webhook: Lead Created
     await webhook_service.dispatch_event("lead.created", new_lead)
 
     return new_lead
 
+@router.post("/import")
+async def import_leads(
+    file: UploadFile = File(...),
+    dedup: DedupMode = Query(DedupMode.flag),
+    user=Depends(require_permission("leads.create"))
+):
+    """
+    Bulk import leads from a CSV or XLSX upload.
+    Rows are streamed, validated against LeadCreate and inserted in batches;
+    invalid rows are reported by row number and skipped. Duplicates (by
+    normalized email/phone, in the DB or earlier in the file) follow `dedup`.
+    """
+    filename = (file.filename or "").lower()
+    if not filename.endswith((".csv", ".xlsx")):
+        raise HTTPException(status_code=400, detail="Only .csv and .xlsx files are supported")
+
+    return await LeadImporter(user, dedup).run(file)
+
+@router.get("/suggest", response_model=List[LeadSuggestion])
+async def suggest_leads(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=25),
+    user=Depends(get_current_user)
+):
+    """Typeahead for the global search box: name/email/phone prefix matches from the in-memory index"""
+    perms = user.get("permissions", {})
+    can_view_all = perms.get("leads.view_all") or perms.get("*")
+    owner_id = None if can_view_all else user['id']
+
+    lead_search_index.ensure_fresh()
+    results = lead_search_index.search(q, limit=limit, owner_id=owner_id)
+    if results is not None:
+        return results
+
+    # Index still warming up, or too many other leads share the prefix: same scoping as get_leads, prefix ilike against the DB
+    query = supabase.table("leads").select("id, parent_name, email, phone, status, assigned_to").limit(limit)
+    if owner_id:
+        query = query.eq("assigned_to", owner_id)
+    pattern = _prefix_pattern(q)
+    query = query.or_(f"parent_name.ilike.{pattern},email.ilike.{pattern},phone.ilike.{pattern}")
+    response = query.execute()
+    return response.data or []
+
+@router.get("/suggest/stats")
+async def get_suggest_index_stats(user=Depends(require_role(["admin"]))):
+    """Size, memory footprint and freshness of the typeahead index"""
+    return lead_search_index.stats()
+
 @router.get("/{id}", response_model=Lead)
 async def get_lead(id: str, user=Depends(get_current_user)):
     perms = user.get("permissions", {})
@@ -128,71 +206,25 @@ async def get_lead(id: str, user=Depends(get_current_user)):
 
 @router.patch("/{id}/status", response_model=Lead)
 async def update_lead_status(id: str, status: str, user=Depends(require_permission("leads.edit"))):
-    # 1. Update Status & Last Interaction
-    response = supabase.table("leads").update({
-        "status": status, 
-        "updated_at": "now()",
-        "last_interaction_at": "now()"
-    }).eq("id", id).execute()
+    # 1. Transition in one round-trip (migrations/lead_status_transition.sql):
+    # locks the lead, records previous status + time-in-stage in lead_status_history,
+    # logs the interaction, creates the visit auto-task and returns the lead with students
+    response = supabase.rpc("transition_lead_status", {
+        "p_lead_id": id,
+        "p_status": status,
+        "p_changed_by": user['id']
+    }).execute()
     if not response.data:
         raise HTTPException(status_code=404, detail="Lead not found")
-    
-    updated_lead = response.data[0]
-    
-    # Webhook: Status Changed
+
+    updated_lead = response.data
+    lead_search_index.upsert(updated_lead)
+
+    # 2. Webhook: Status Changed
     await webhook_service.dispatch_event("lead.status_changed", updated_lead)
     if status == "enrolled":
         await webhook_service.dispatch_event("student.enrolled", updated_lead)
 
-    # 2. Log Interaction & History
-    try:
-        # Log Interaction
-        interaction_data = {
-            "lead_id": id,
-            "type": "status_change",
-            "summary": f"Status updated to {status.replace('_', ' ').title()}",
-            "created_by": user['id']
-        }
-        supabase.table("interactions").insert(interaction_data).execute()
-
-        # Log History (New for Phase 2)
-        # We try to calculate time spent in previous stage if we had the previous record
-        # But for this MVP step, we just log the transition
-        history_data = {
-            "lead_id": id,
-            "previous_status": None, # Ideally fetched before update, but skipping for speed unless critical
-            "new_status": status,
-            "changed_by": user['id'],
-            # "time_in_previous_stage": ... (Requires fetching previous state first)
-        }
-        # To do it right: fetch lead BEFORE update.
-        # But we already updated line 126. 
-        # Let's just log the new status. detailed history analysis can reconstruct from timestamps.
-        supabase.table("lead_status_history").insert(history_data).execute()
-
-    except Exception as e:
-        print(f"Error logging interaction/history: {e}")
-    
-    # 3. Automation: Auto-Task
-    try:
-        if status == "visit_scheduled":
-            task_data = {
-                "lead_id": id,
-                "title": "Prepare for Visit",
-                "description": "Ensure brochure packet and counseling room are ready.",
-                "status": "pending",
-                "assigned_to": updated_lead.get("assigned_to") or user['id']
-                # due_date could be set to 24h before visit if we had visit date, 
-                # for now let's leave it null or set to tomorrow
-            }
-            supabase.table("tasks").insert(task_data).execute()
-    except Exception as e:
-        print(f"Error creating auto-task: {e}")
-
-    # Return updated lead with students
-    stud_res = supabase.table("students").select("*").eq("lead_id", id).execute()
-    updated_lead["students"] = stud_res.data if stud_res.data else []
-    
     return updated_lead
 
 @router.patch("/{id}/assign")
@@ -204,6 +236,7 @@ async def assign_lead(id: str, assigned_to: str, user=Depends(require_permission
     
     # Return updated lead with students to match response model
     updated_lead = response.data[0]
+    lead_search_index.upsert(updated_lead)
     # Fetch students again to be compliant with response model (or modify model to make students optional)
     stud_res = supabase.table("students").select("*").eq("lead_id", id).execute()
     updated_lead["students"] = stud_res.data if stud_res.data else []
@@ -5,6 +5,11 @@ from datetime import datetime, timedelta, timezone
 from database import get_db
 from models import Lead, LeadStatus, PipelineSummary
 from dependencies import get_current_user, require_role, require_permission
+from services.webhook import webhook_service
+from services.lead_search import lead_search_index
+from services.cache import cache_service
+from services.sla_check import sla_checker
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter(
     prefix="/api/v1/pipeline",
@@ -12,6 +17,9 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+PIPELINE_SUMMARY_CACHE_KEY = "pipeline:summary"
+PIPELINE_SUMMARY_TTL = 30  # seconds
+
 @router.get("/summary", response_model=List[PipelineSummary])
 async def get_pipeline_summary(
     current_user: dict = Depends(require_role(["admin", "manager"])),
@@ -19,59 +27,21 @@ async def get_pipeline_summary(
 ):
     """
     Get a summary of leads in each stage, including overdue counts.
-    Optimized: Single DB query instead of loop.
+    Aggregated in Postgres by the pipeline_summary RPC (migrations/pipeline_summary.sql)
+    against the SLA map in app_settings.sla_thresholds, cached for PIPELINE_SUMMARY_TTL seconds.
     """
-    # 1. Fetch all leads with necessary fields in ONE query
-    response = db.table("leads").select("status, last_interaction_at").execute()
-    leads = response.data or []
-    
-    # 2. Define SLA mapping (hours)
-    sla_map = {
-        "new": 24, # 1 day
-        "attempted_contact": 48, # 2 days
-        "connected": 72, # 3 days
-        "visit_scheduled": 24 * 7, # 1 week
-        "application_submitted": 72,
-        "enrolled": 0,
-        "lost": 0
-    }
-    
-    # 3. Aggregate in memory
-    summary_map = {s.value: {"count": 0, "overdue": 0} for s in LeadStatus}
-    now = datetime.now(timezone.utc)
-
-    for lead in leads:
-        status_val = lead.get('status')
-        if status_val not in summary_map:
-            continue
-            
-        summary_map[status_val]["count"] += 1
-        
-        # Check overdue
-        limit_hours = sla_map.get(status_val, 0)
-        if limit_hours > 0:
-            last_inter_str = lead.get('last_interaction_at')
-            if last_inter_str:
-                # Handle varying ISO formats if necessary, though Supabase is consistent
-                try:
-                    # Parse assuming UTC or offset-naive as UTC
-                    # last_inter_str likely contains offset if from Supabase timestamptz
-                    last_interaction = datetime.fromisoformat(last_inter_str.replace('Z', '+00:00'))
-                    
-                    # Ensure timezone awareness for comparison
-                    if last_interaction.tzinfo is None:
-                         last_interaction = last_interaction.replace(tzinfo=timezone.utc)
-                         
-                    if (now - last_interaction).total_seconds() / 3600 > limit_hours:
-                        summary_map[status_val]["overdue"] += 1
-                except ValueError:
-                    pass # Skip invalid dates
-
-    # 4. Convert dictionary to list of models
+    rows = await cache_service.get(PIPELINE_SUMMARY_CACHE_KEY)
+    if rows is None:
+        response = db.rpc("pipeline_summary", {}).execute()
+        rows = response.data or []
+        await cache_service.set(PIPELINE_SUMMARY_CACHE_KEY, rows, ttl=PIPELINE_SUMMARY_TTL)
+
+    stats = {row["status"]: row for row in rows}
+
     summary = []
     for s in LeadStatus:
-        stats = summary_map[s.value]
-        summary.append(PipelineSummary(status=s, count=stats["count"], overdue_count=stats["overdue"]))
+        row = stats.get(s.value, {})
+        summary.append(PipelineSummary(status=s, count=row.get("count", 0), overdue_count=row.get("overdue_count", 0)))
         
     return summary
     
@@ -95,9 +65,61 @@ async def bulk_assign_leads(
     # Using python client update with 'in' filter logic requires specific syntax or loop
     # db.table("leads").update(...).in_("id", list) works in recent versions
     
-    data, count = db.table("leads").update({"assigned_to": str(request.new_owner_id)}).in_("id", [str(id) for id in request.lead_ids]).execute()
-    
-    return {"message": f"Successfully reassigned {len(data[1]) if data and len(data) > 1 else 'leads'}"}
+    res = db.table("leads").update({"assigned_to": str(request.new_owner_id)}).in_("id", [str(id) for id in request.lead_ids]).execute()
+    updated = res.data or []
+
+    # Owner-scoped suggestions follow the new owner
+    lead_search_index.upsert_many(updated)
+
+    return {"message": f"Successfully reassigned {len(updated)} leads"}
+
+class BulkStatusRequest(BaseModel):
+    lead_ids: List[UUID]
+    status: LeadStatus
+
+BULK_STATUS_CHUNK_SIZE = 500
+
+@router.post("/bulk-status")
+async def bulk_update_status(
+    request: BulkStatusRequest,
+    current_user: dict = Depends(require_permission("leads.edit")),
+    db=Depends(get_db)
+):
+    """
+    Move many leads to one stage (pipeline board multi-drag).
+    Each chunk is a single transition_leads_status RPC call
+    (migrations/lead_bulk_status_transition.sql) that batches the lead update,
+    interactions, status history and auto-tasks; webhooks go out as one background batch.
+    """
+    lead_ids = list(dict.fromkeys(str(id) for id in request.lead_ids))
+    if not lead_ids:
+        raise HTTPException(status_code=400, detail="No leads selected")
+
+    status = request.status.value
+    updated = []
+    for i in range(0, len(lead_ids), BULK_STATUS_CHUNK_SIZE):
+        res = db.rpc("transition_leads_status", {
+            "p_lead_ids": lead_ids[i:i + BULK_STATUS_CHUNK_SIZE],
+            "p_status": status,
+            "p_changed_by": current_user["id"]
+        }).execute()
+        updated.extend(res.data or [])
+
+    lead_search_index.upsert_many(updated)
+    await cache_service.delete(PIPELINE_SUMMARY_CACHE_KEY)
+
+    # Webhooks: one batch per event, sent in the background so slow endpoints don't hold up the board
+    webhook_service.dispatch_batch_in_background("lead.status_changed", updated)
+    if status == "enrolled":
+        webhook_service.dispatch_batch_in_background("student.enrolled", updated)
+
+    found = {str(UUID(lead["id"])) for lead in updated}
+    return {
+        "message": f"Moved {len(updated)} leads to {status}",
+        "updated": len(updated),
+        "not_found": [id for id in lead_ids if id not in found],
+        "leads": updated
+    }
 
 @router.get("/aging")
 async def get_aging_report(
@@ -122,63 +144,15 @@ async def get_aging_report(
 
 @router.post("/run-sla-check")
 async def run_sla_check(
-    current_user: dict = Depends(require_role(["admin", "manager"])),
-    db=Depends(get_db)
+    current_user: dict = Depends(require_role(["admin", "manager"]))
 ):
     """
     Check for overdue leads and create notifications for lead owners.
+    Leads alerted within the cooldown window are skipped; the same job also
+    runs in the background every SLA_CHECK_INTERVAL_MINUTES.
     """
-    # 1. Reuse summary logic to identify overdue leads
-    # Better to fetch overdue leads directly
-    now = datetime.now(timezone.utc)
-    
-    # SLA Rules
-    sla_map = {
-        "new": 24, 
-        "attempted_contact": 48,
-        "connected": 72,
-        "visit_scheduled": 24 * 7,
-        "application_submitted": 72
+    result = await run_in_threadpool(sla_checker.run)
+    return {
+        "message": f"SLA Check complete. Created {result['notifications_created']} notifications.",
+        **result
     }
-    
-    notifications_created = 0
-    
-    for status, limit_hours in sla_map.items():
-        if limit_hours <= 0: continue
-            
-        threshold_time = (now - timedelta(hours=limit_hours)).isoformat()
-        
-        # Find leads in this status updated before threshold
-        leads_res = db.table("leads").select("id, parent_name, assigned_to, last_interaction_at")\
-            .eq("status", status)\
-            .lt("last_interaction_at", threshold_time)\
-            .execute()
-            
-        overdue_leads = leads_res.data or []
-        
-        for lead in overdue_leads:
-            owner_id = lead.get("assigned_to")
-            if not owner_id: continue
-            
-            # Create notification
-            # Check if recent notification exists to avoid spam? 
-            # For now, just create. User can mark all read.
-            
-            msg = f"Lead {lead.get('parent_name')} is overdue (Status: {status}). Please follow up."
-            
-            notif = {
-                "user_id": owner_id,
-                "title": "SLA Warning: Overdue Lead",
-                "message": msg,
-                "read": False,
-                "type": "alert",
-                "link": f"/leads/{lead.get('id')}"
-            }
-            
-            try:
-                db.table("notifications").insert(notif).execute()
-                notifications_created += 1
-            except Exception as e:
-                print(f"Failed to create notification for lead {lead.get('id')}: {e}")
-                
-    return {"message": f"SLA Check complete. Created {notifications_created} notifications."}
@@ -1,11 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from typing import Optional, List
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from uuid import UUID, uuid4
 import json
-import csv
-import io
-from fastapi.responses import StreamingResponse
+import asyncio
+import os
+from fastapi.responses import StreamingResponse, FileResponse
 from database import get_db
 from dependencies import get_current_user, require_permission
 from models import (
@@ -13,97 +13,56 @@ from models import (
     ReportExportRequest, ReportExportResponse, ScheduledReportCreate,
     ScheduledReport, ReportRun
 )
+from services.report_export import (
+    render_report, stream_csv, stream_xlsx, stream_pdf, stream_parquet, stream_arrow,
+    XLSX_MEDIA_TYPE, PARQUET_MEDIA_TYPE, ARROW_MEDIA_TYPE,
+    compute_next_run, export_path, enqueue_export, find_cached_run, tee_to_file, EXTENSIONS, PLACEHOLDER_FORMATS
+)
+from services.report_cache import data_generation, report_cache_key, preview_cache_key, PREVIEW_TTL_SECONDS
+from services.cache import cache_service
+from services.report_query import compile_report
+from services.report_aggregate import is_aggregate, aggregate_report
+from services.scheduler import scheduler
+from services.report_templates import REPORT_TEMPLATES, is_system_report, template_registry
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter(prefix="/api/v1/reports", tags=["reports"])
 
-# Pre-built report templates
-REPORT_TEMPLATES = [
-    {
-        "id": "leads_overview",
-        "name": "Leads Overview",
-        "description": "Complete overview of all leads with key metrics",
-        "fields": ["parent_name", "email", "phone", "status", "source", "created_at", "assigned_to"],
-        "filters": {}
-    },
-    {
-        "id": "enrollment_report",
-        "name": "Enrollment Report",
-        "description": "All enrolled students with details",
-        "fields": ["parent_name", "email", "phone", "student_name", "grade", "enrolled_date"],
-        "filters": {"status": "enrolled"}
-    },
-    {
-        "id": "pipeline_status",
-        "name": "Pipeline Status Report",
-        "description": "Current pipeline status breakdown",
-        "fields": ["status", "count", "percentage"],
-        "filters": {}
-    },
-    {
-        "id": "counselor_activity",
-        "name": "Counselor Activity Report",
-        "description": "Counselor performance and activity metrics",
-        "fields": ["counselor_name", "total_leads", "interactions", "enrollments", "conversion_rate"],
-        "filters": {}
-    },
-    {
-        "id": "source_analysis",
-        "name": "Lead Source Analysis",
-        "description": "Lead generation and conversion by source",
-        "fields": ["source", "total_leads", "enrolled", "conversion_rate"],
-        "filters": {}
-    }
-]
+PREVIEW_ROWS = 100
 
 @router.get("/templates", response_model=List[ReportTemplate])
-async def get_report_templates(user=Depends(require_permission("reports.view"))):
-    """Get report templates (system + custom)"""
-    supabase = get_db()
-    
-    # 1. Get system templates
-    templates = [ReportTemplate(**template, is_system=True) for template in REPORT_TEMPLATES]
-    
-    # 2. Get custom reports from DB
-    try:
-        query = supabase.table("reports").select("*")
-        # Optional: Filter by user or team if needed
-        # query = query.eq("created_by", user.get("id")) 
-        result = query.execute()
-        
-        if result.data:
-            for item in result.data:
-                # Handle JSON fields which might be returned as strings or dicts depending on Supabase client
-                fields = item.get("fields")
-                if isinstance(fields, str):
-                    fields = json.loads(fields)
-                
-                filters = item.get("filters")
-                if isinstance(filters, str):
-                    filters = json.loads(filters)
-                
-                templates.append(ReportTemplate(
-                    id=item["id"],
-                    name=item["name"],
-                    description=item.get("description", ""),
-                    fields=fields or [],
-                    filters=filters or {},
-                    is_system=False
-                ))
-    except Exception as e:
-        print(f"⚠️ Error fetching custom reports: {e}")
-        # Continue with just system templates if DB fails
-    
+async def get_report_templates(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    user=Depends(require_permission("reports.view"))
+):
+    """
+    Get report templates (system + custom) from the in-memory registry
+    (services/report_templates.py). Custom reports are the user's own, or all
+    of them for admins. The total for pagination is in X-Total-Count.
+    """
+    templates, total = await run_in_threadpool(template_registry.list_for_user, user, limit, offset)
+    response.headers["X-Total-Count"] = str(total)
     return templates
 
 @router.post("/build", response_model=ReportBuildResponse)
 async def build_report(
     report: ReportCreate,
     save: bool = Query(False),
+    count: str = Query("exact"),
     user=Depends(require_permission("reports.view"))
 ):
-    """Build a custom report and return preview data"""
+    """
+    Build a custom report and return preview data.
+    count=exact counts every matching lead; count=estimated uses the planner's
+    estimate for large results (PostgREST), which is much cheaper on big tables.
+    """
     supabase = get_db()
     
+    if count not in ["exact", "estimated"]:
+        raise HTTPException(status_code=400, detail="Invalid count method")
+    
     report_id = None
     
     if save:
@@ -125,54 +84,59 @@ async def build_report(
             raise HTTPException(status_code=500, detail="Failed to create report")
         
         report_id = insert_result.data[0]["id"]
+        template_registry.add(insert_result.data[0])
     
-    # Build query based on report definition
-    query = supabase.table("leads").select("*")
-    
-    # Apply filters
-    if report.filters:
-        for key, value in report.filters.items():
-            if key == "status":
-                query = query.eq("status", value)
-            elif key == "source":
-                query = query.eq("source", value)
-            elif key == "assigned_to":
-                query = query.eq("assigned_to", value)
-            elif key == "date_from":
-                query = query.gte("created_at", value)
-            elif key == "date_to":
-                query = query.lte("created_at", value)
-    
-    # Apply permission-based filtering (Role Agnostic)
-    perms = user.get("permissions", {})
-    can_view_all = perms.get("leads.view_all") or perms.get("*")
-    
-    if not can_view_all:
-        query = query.eq("assigned_to", user.get("id"))
+    definition = report.model_dump()
+    report_uuid = UUID(report_id) if report_id else None
     
-    result = query.execute()
-    data = result.data if result.data else []
-    
-    # Filter fields
-    preview_data = []
-    for row in data[:100]:  # Limit preview to 100 rows
-        filtered_row = {field: row.get(field) for field in report.fields if field in row}
-        preview_data.append(filtered_row)
-    
-    return ReportBuildResponse(
-        report_id=UUID(report_id) if report_id else None,
-        preview_data=preview_data,
-        row_count=len(data)
-    )
+    # Previews are cached per definition, permission scope and data generation,
+    # so repeat builds are free until lead data changes (services/report_cache.py)
+    generation = await run_in_threadpool(data_generation, supabase)
+    preview_key = preview_cache_key(report_cache_key(definition, user, f"preview:{count}", generation))
+    cached = await cache_service.get(preview_key) if preview_key else None
+    if cached:
+        return ReportBuildResponse(report_id=report_uuid, **cached)
+    
+    if is_aggregate(definition):
+        # Grouped report: one row per group, aggregated in Postgres (services/report_aggregate.py)
+        try:
+            _, groups = await run_in_threadpool(aggregate_report, supabase, definition, user)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = {"preview_data": groups[:PREVIEW_ROWS], "row_count": len(groups), "count_method": "exact"}
+    else:
+        # Compile the definition into one projected, filtered, ordered query (services/report_query.py).
+        # The preview reads PREVIEW_ROWS rows; the total comes from a separate HEAD count request,
+        # so the cost does not grow with the number of matching leads.
+        compiled = compile_report(definition)
+        preview_data, row_count = await asyncio.gather(
+            run_in_threadpool(compiled.preview, supabase, user, PREVIEW_ROWS),
+            run_in_threadpool(compiled.count, supabase, user, count)
+        )
+        result = {"preview_data": preview_data, "row_count": row_count, "count_method": count}
+    
+    if preview_key:
+        await cache_service.set(preview_key, result, ttl=PREVIEW_TTL_SECONDS)
+    return ReportBuildResponse(report_id=report_uuid, **result)
 
 @router.post("/export")
 async def export_report(
     export_request: ReportExportRequest,
+    mode: str = Query("sync"),
     user=Depends(require_permission("reports.view"))
 ):
-    """Export report to specified format"""
+    """
+    Export report to specified format.
+    mode=sync streams the file in the response; mode=async queues a background
+    export job and returns its run id to poll at GET /reports/runs/{run_id}.
+    """
     supabase = get_db()
     
+    if mode not in ["sync", "async"]:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    if export_request.format not in EXTENSIONS and export_request.format not in PLACEHOLDER_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{export_request.format}'")
+    
     # Get report definition
     report = None
     
@@ -200,169 +164,103 @@ async def export_report(
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
     
-    # Build query
-    query = supabase.table("leads").select("*")
-    
-    # Apply filters from report
-    if report.get("filters"):
-        filters = json.loads(report["filters"]) if isinstance(report["filters"], str) else report["filters"]
-        for key, value in filters.items():
-            if key == "status":
-                query = query.eq("status", value)
-            elif key == "source":
-                query = query.eq("source", value)
-    
-    # Apply permission-based filtering (Role Agnostic)
-    perms = user.get("permissions", {})
-    can_view_all = perms.get("leads.view_all") or perms.get("*")
-    
-    if not can_view_all:
-        query = query.eq("assigned_to", user.get("id"))
+    if mode == "async":
+        if export_request.format not in EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"Format '{export_request.format}' cannot be exported in the background")
+        is_custom = report.get("id") and not is_system_report(report["id"])
+        run = await run_in_threadpool(
+            enqueue_export, report, export_request.format, user, report["id"] if is_custom else None
+        )
+        scheduler.wake()
+        return {
+            "run_id": run["id"],
+            "status": run["status"],
+            "status_url": f"/api/v1/reports/runs/{run['id']}"
+        }
     
-    result = query.execute()
-    data = result.data if result.data else []
-    
-    # Get fields
-    fields = json.loads(report["fields"]) if isinstance(report["fields"], str) else report["fields"]
-    
-    # Filter data by fields
-    filtered_data = []
-    for row in data:
-        filtered_row = {field: row.get(field) for field in fields}
-        filtered_data.append(filtered_row)
-    
-    # Generate export file (simplified - in production, use pandas/openpyxl)
-    # Generate content based on format
-    content_stream = None
-    media_type = "text/plain"
-    filename = "report.txt"
+    # report_runs.report_id references saved reports; system template ids are not UUIDs
+    try:
+        run_report_id = str(UUID(export_request.report_id)) if export_request.report_id else None
+    except ValueError:
+        run_report_id = None
 
-    if export_request.format == "csv":
+    def log_run(row_count: int, run_id: Optional[str] = None, cache_key: Optional[str] = None,
+                cache_hit: bool = False):
+        # Log report run (Safely)
         try:
-            output = io.StringIO()
-            fieldnames = fields if fields else (list(filtered_data[0].keys()) if filtered_data else [])
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(filtered_data)
-            output.seek(0)
-            content_stream = output
-            media_type = "text/csv"
-            filename = "report_export.csv"
+            run_data = {
+                "report_id": run_report_id,
+                "status": "completed",
+                "format": export_request.format,
+                "row_count": row_count,
+                "download_url": "Direct Download",
+                "cache_key": cache_key,
+                "cache_hit": cache_hit,
+                "run_by": user.get("id"),
+                "completed_at": datetime.now().isoformat(),
+                "expires_at": (datetime.now() + timedelta(days=7)).isoformat()
+            }
+            if run_id:
+                # The streamed file was kept for the cache, so the run can be downloaded again
+                run_data["id"] = run_id
+                run_data["download_url"] = f"/api/v1/reports/runs/{run_id}/download"
+            # Only try to insert if we have a valid UUID for report_id, or if schema allows generic text
+            # To be safe, we skip insert if it's likely to fail, or just try/except it (which we do)
+            supabase.table("report_runs").insert(run_data).execute()
         except Exception as e:
-            # Fallback for CSV generation error
-            content_stream = io.StringIO(f"Error generating CSV: {str(e)}")
-            filename = "error.txt"
+            print(f"⚠️ Report logging failed (ignoring): {e}")
 
-    elif export_request.format == "xlsx":
-        try:
-            from openpyxl import Workbook
-            wb = Workbook()
-            ws = wb.active
-            
-            # Write header
-            fieldnames = fields if fields else (list(filtered_data[0].keys()) if filtered_data else [])
-            ws.append(fieldnames)
-            
-            # Write rows
-            for row in filtered_data:
-                ws.append([row.get(field, "") for field in fieldnames])
-            
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
-            
-            content_stream = output
-            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            filename = "report_export.xlsx"
-        except Exception as e:
-            content_stream = io.BytesIO(f"Error generating Excel: {str(e)}".encode())
-            media_type = "text/plain"
-            filename = "error.txt"
+    streamers = {
+        # Streamed page by page; the run is logged once the last page is sent
+        "csv": (stream_csv, "text/csv"),
+        # Write-only workbook built in a spooled temp file, then streamed in chunks
+        "xlsx": (stream_xlsx, XLSX_MEDIA_TYPE),
+        # Page-sized tables, capped at REPORT_PDF_MAX_ROWS rows
+        "pdf": (stream_pdf, "application/pdf"),
+        # Typed columns, one row group per PARQUET_ROW_GROUP_ROWS rows, built in a spooled temp file
+        "parquet": (stream_parquet, PARQUET_MEDIA_TYPE),
+        # Arrow IPC file, one record batch per page of leads
+        "arrow": (stream_arrow, ARROW_MEDIA_TYPE),
+    }
+    if export_request.format in streamers:
+        stream, media_type = streamers[export_request.format]
+        filename = f"report_export.{EXTENSIONS[export_request.format]}"
 
-    elif export_request.format == "pdf":
-        try:
-            from reportlab.lib import colors
-            from reportlab.lib.pagesizes import letter, landscape
-            from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-            from reportlab.lib.styles import getSampleStyleSheet
-            
-            output = io.BytesIO()
-            doc = SimpleDocTemplate(output, pagesize=landscape(letter))
-            elements = []
-            
-            styles = getSampleStyleSheet()
-            elements.append(Paragraph(f"Report: {report.get('name', 'Export')}", styles['Title']))
-            elements.append(Spacer(1, 12))
-            
-            # Prepare data for table
-            # Header
-            fieldnames = fields if fields else (list(filtered_data[0].keys()) if filtered_data else [])
-            data = [[f.replace('_', ' ').title() for f in fieldnames]]
-            
-            # Rows
-            for row in filtered_data:
-                # Convert all values to string for PDF
-                data.append([str(row.get(field, "")) for field in fieldnames])
-            
-            if not data:
-                data = [["No Data"]]
+        # Same definition, scope, format and data generation as an earlier export: send its file
+        generation = await run_in_threadpool(data_generation, supabase)
+        cache_key = report_cache_key(report, user, export_request.format, generation)
+        cached = await run_in_threadpool(find_cached_run, cache_key) if cache_key else None
+        if cached:
+            await run_in_threadpool(log_run, cached.get("row_count") or 0, None, cache_key, True)
+            return FileResponse(
+                export_path(cached["id"], export_request.format), media_type=media_type, filename=filename
+            )
 
-            # Create Table
-            # Dynamic column width? Auto for now
-            t = Table(data)
-            
-            # Add style
-            style = TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ])
-            t.setStyle(style)
-            elements.append(t)
-            
-            doc.build(elements)
-            output.seek(0)
-            
-            content_stream = output
-            media_type = "application/pdf"
-            filename = "report_export.pdf"
-            
-        except Exception as e:
-            content_stream = io.BytesIO(f"Error generating PDF: {str(e)}".encode())
-            media_type = "text/plain"
-            filename = "error.txt"
+        if not cache_key:
+            # Generation unknown (a write is committing): stream without keeping a copy
+            return StreamingResponse(
+                stream(report, user, on_complete=log_run),
+                media_type=media_type,
+                headers={"Content-Disposition": f"attachment; filename={filename}"}
+            )
 
-    elif export_request.format == "sheets":
-        # Phase 5 Placeholder
-        msg = f"The Google Sheets export feature is part of Phase 5.\nPlease use 'Export as CSV' for now to get your data."
-        content_stream = io.BytesIO(msg.encode())
-        filename = f"feature_coming_soon_{export_request.format}.txt"
+        # Otherwise stream it, keeping a copy under a new run id for the next request
+        run_id = str(uuid4())
+        return StreamingResponse(
+            tee_to_file(
+                stream(report, user, on_complete=lambda rows: log_run(rows, run_id, cache_key)),
+                export_path(run_id, export_request.format)
+            ),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
 
-    # Log report run (Safely)
-    try:
-        run_data = {
-            "report_id": str(export_request.report_id) if isinstance(export_request.report_id, UUID) else None,
-            "status": "completed",
-            "row_count": len(filtered_data),
-            "download_url": "Direct Download",
-            "run_by": user.get("id"),
-            "completed_at": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(days=7)).isoformat()
-        }
-        # Only try to insert if we have a valid UUID for report_id, or if schema allows generic text
-        # To be safe, we skip insert if it's likely to fail, or just try/except it (which we do)
-        supabase.table("report_runs").insert(run_data).execute()
-    except Exception as e:
-        print(f"⚠️ Report logging failed (ignoring): {e}")
+    # Placeholder formats: nothing is queried
+    content, media_type, filename = render_report(export_request.format)
+    await run_in_threadpool(log_run, 0)
 
     return StreamingResponse(
-        iter([content_stream.getvalue()]),
+        iter([content]),
         media_type=media_type,
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -376,20 +274,7 @@ async def schedule_report(
     supabase = get_db()
     
     # Calculate next run time
-    now = datetime.now()
-    if scheduled_report.frequency == "daily":
-        next_run = now.replace(
-            hour=scheduled_report.schedule_time.hour if scheduled_report.schedule_time else 9,
-            minute=scheduled_report.schedule_time.minute if scheduled_report.schedule_time else 0
-        )
-        if next_run <= now:
-            next_run += timedelta(days=1)
-    elif scheduled_report.frequency == "weekly":
-        next_run = now + timedelta(days=7)
-    elif scheduled_report.frequency == "monthly":
-        next_run = now + timedelta(days=30)
-    else:  # once
-        next_run = now + timedelta(hours=1)
+    next_run = compute_next_run(scheduled_report.frequency, scheduled_report.schedule_time, datetime.now(timezone.utc))
     
     schedule_data = {
         "report_id": str(scheduled_report.report_id),
@@ -538,6 +423,56 @@ async def get_report_history(
     
     return runs
 
+def _get_run(supabase, run_id: UUID, user: dict) -> dict:
+    query = supabase.table("report_runs").select("*, scheduled_reports(format)").eq("id", str(run_id))
+    if user.get("role") != "admin":
+        query = query.eq("run_by", user.get("id"))
+    result = query.execute()
+    
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Report run not found")
+    return result.data[0]
+
+@router.get("/runs/{run_id}")
+async def get_report_run(
+    run_id: UUID,
+    user=Depends(require_permission("reports.view"))
+):
+    """Poll a background export: status, row_count and download_url once completed"""
+    run = _get_run(get_db(), run_id, user)
+    return {
+        "id": run["id"],
+        "status": run["status"],
+        "format": run.get("format") or (run.get("scheduled_reports") or {}).get("format"),
+        "row_count": run.get("row_count"),
+        "cache_hit": run.get("cache_hit", False),
+        "download_url": run.get("download_url"),
+        "error_message": run.get("error_message"),
+        "run_at": run.get("run_at"),
+        "completed_at": run.get("completed_at"),
+        "expires_at": run.get("expires_at")
+    }
+
+@router.get("/runs/{run_id}/download")
+async def download_report_run(
+    run_id: UUID,
+    user=Depends(require_permission("reports.view"))
+):
+    """Download the file produced by a background report run"""
+    run = _get_run(get_db(), run_id, user)
+    if run["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Report run is {run['status']}")
+    if run.get("expires_at") and datetime.fromisoformat(run["expires_at"]).timestamp() < datetime.now().timestamp():
+        raise HTTPException(status_code=410, detail="Report file has expired")
+    
+    fmt = run.get("format") or (run.get("scheduled_reports") or {}).get("format", "csv")
+    path = export_path(run["id"], fmt)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Report file is no longer available")
+    
+    media_type = {"parquet": PARQUET_MEDIA_TYPE, "arrow": ARROW_MEDIA_TYPE}.get(fmt)
+    return FileResponse(path, media_type=media_type, filename=f"report_{run['id']}.{EXTENSIONS.get(fmt, 'txt')}")
+
 @router.delete("/{report_id}")
 async def delete_report(
     report_id: str,
@@ -547,12 +482,13 @@ async def delete_report(
     supabase = get_db()
     
     # Check if system report
-    if any(t["id"] == report_id for t in REPORT_TEMPLATES):
+    if is_system_report(report_id):
         raise HTTPException(status_code=403, detail="Cannot delete system reports")
     
     try:
         supabase.table("reports").delete().eq("id", report_id).execute()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting report: {str(e)}")
+    template_registry.remove(report_id)
         
     return {"message": "Report deleted successfully"}
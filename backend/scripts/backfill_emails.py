@@ -1,61 +1,123 @@
+"""
+Copy Supabase Auth emails onto profiles.email.
+
+Pages through every auth user, compares against one bulk fetch of profiles
+(id, email), and writes only the profiles whose email differs, in chunks
+(one update_profile_emails call each, migrations/profile_email_backfill.sql)
+run concurrently. Profiles without an auth user, and auth users without a
+profile, are left alone.
+
+Usage (from backend/):
+    python scripts/backfill_emails.py --dry-run      # print the diff, write nothing
+    python scripts/backfill_emails.py --chunk-size 1000 --workers 4
+"""
 import os
 import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.auth_users import iter_auth_user_pages
+
+PROFILE_PAGE_SIZE = 1000  # PostgREST max rows per response
+
 # Load environment variables
 load_dotenv()
 
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
-if not url or not key:
-    print("Error: Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY in .env")
-    sys.exit(1)
+def fetch_profile_emails(supabase: Client) -> dict:
+    """{profile id: email} for every profile, in keyset pages on id"""
+    emails = {}
+    last_id = None
+    while True:
+        query = supabase.table("profiles").select("id, email").order("id").limit(PROFILE_PAGE_SIZE)
+        if last_id:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        emails.update({row["id"]: row.get("email") for row in rows})
+        if len(rows) < PROFILE_PAGE_SIZE:
+            return emails
+        last_id = rows[-1]["id"]
+
+
+def fetch_auth_emails(supabase: Client, workers: int) -> dict:
+    """{auth user id: email} for every auth user"""
+    emails = {}
+    for users in iter_auth_user_pages(supabase, concurrency=workers):
+        emails.update({str(user.id): user.email for user in users if user.email})
+    return emails
+
+
+def write_chunk(supabase: Client, rows: list) -> tuple:
+    """Update one chunk of {id, email} rows in a single statement. Returns (written, error)."""
+    try:
+        res = supabase.rpc("update_profile_emails", {"p_changes": rows}).execute()
+        return int(res.data or 0), None
+    except Exception as e:
+        return 0, f"{rows[0]['id']}..: {e}"
 
-try:
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:,.0f}/s" if seconds > 0 else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="Print the changes without writing them")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Profiles per update")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent auth page fetches and updates")
+    args = parser.parse_args()
+
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        print("Error: Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY in .env")
+        sys.exit(1)
     supabase: Client = create_client(url, key)
 
-    # Get all users using admin API
-    # Note: Default page size is 50, need pagination for large sets
-    # Assuming small set for now, or just handle first page
-    response = supabase.auth.admin.list_users() # lists 50 by default
-    users = response
-    
-    # If more than 50, fetch next page
-    # user.next_page logic depends on library version
-    # Simple loop for basic needs:
-    while True:
-        # process current batch
-        for user in users:
-            print(f"Processing user: {user.email} ({user.id})")
-            try:
-                # Check if profile exists
-                profile = supabase.table("profiles").select("*").eq("id", user.id).execute()
-                
-                if profile.data:
-                    # Update existing profile
-                    update_data = {"email": user.email}
-                    res = supabase.table("profiles").update(update_data).eq("id", user.id).execute()
-                    if res.data:
-                         print(f"Updated email for {user.email}")
-                    else:
-                         print(f"Create new profile logic skipped (only updating existing)")
-                else:
-                    print(f"No profile found for {user.email}, skipping.")
-            except Exception as e:
-                print(f"Error updating {user.email}: {e}")
-
-        # Check for more pages?
-        # Supabase-py list_users doesn't return 'next_page' token directly usually, 
-        # it returns UserResponse with users list.
-        # Pagination usually handled by `page` and `per_page` args.
-        # But for now, let's assume default is sufficient for small user base.
-        # If needed, add loop with page params.
-        break
+    started = time.perf_counter()
+    auth_emails = fetch_auth_emails(supabase, args.workers)
+    auth_seconds = time.perf_counter() - started
+    print(f"Auth users:  {len(auth_emails):>8,} in {auth_seconds:.1f}s ({rate(len(auth_emails), auth_seconds)})")
 
+    started = time.perf_counter()
+    profile_emails = fetch_profile_emails(supabase)
+    profile_seconds = time.perf_counter() - started
+    print(f"Profiles:    {len(profile_emails):>8,} in {profile_seconds:.1f}s ({rate(len(profile_emails), profile_seconds)})")
+
+    changes = [
+        {"id": user_id, "email": email}
+        for user_id, email in auth_emails.items()
+        if user_id in profile_emails and profile_emails[user_id] != email
+    ]
+    missing = sum(1 for user_id in auth_emails if user_id not in profile_emails)
+    print(f"To update:   {len(changes):>8,} ({missing:,} auth users have no profile)")
+
+    if args.dry_run:
+        for change in changes:
+            print(f"  {change['id']}: {profile_emails[change['id']]!r} -> {change['email']!r}")
+        print("Dry run: nothing written.")
+        return
+
+    started = time.perf_counter()
+    chunks = [changes[i:i + args.chunk_size] for i in range(0, len(changes), args.chunk_size)]
+    written = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for count, error in pool.map(lambda chunk: write_chunk(supabase, chunk), chunks):
+            written += count
+            if error:
+                print(f"Error updating chunk {error}")
+    write_seconds = time.perf_counter() - started
+    print(f"Updated:     {written:>8,} in {write_seconds:.1f}s ({rate(written, write_seconds)})")
+    if written < len(changes):
+        print(f"{len(changes) - written:,} profiles were not updated; rerun to retry them.")
+        sys.exit(1)
     print("Backfill complete.")
 
-except Exception as e:
-    print(f"Critical Error: {e}")
-    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
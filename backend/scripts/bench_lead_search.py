@@ -0,0 +1,93 @@
+"""
+Benchmark the in-process lead typeahead index (services/lead_search.py).
+
+Builds the index from synthetic leads (no database needed) and reports build
+time, memory footprint and suggestion latency.
+
+Usage (from backend/):
+    python scripts/bench_lead_search.py --leads 500000
+"""
+import os
+import sys
+import time
+import random
+import string
+import argparse
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.lead_search import LeadSearchIndex
+
+FIRST = ["Aarav", "Vivaan", "Aditya", "Ananya", "Diya", "Ishaan", "Kavya", "Meera", "Rohan", "Saanvi", "Arjun", "Priya"]
+LAST = ["Sharma", "Reddy", "Iyer", "Patel", "Nair", "Gupta", "Rao", "Menon", "Singh", "Kumar", "Das", "Joshi"]
+STATUSES = ["new", "attempted_contact", "connected", "visit_scheduled", "application_submitted", "enrolled", "lost"]
+
+
+def synthetic_leads(count, owners):
+    rng = random.Random(42)
+    for i in range(count):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        suffix = "".join(rng.choices(string.ascii_lowercase, k=3))
+        yield (
+            str(uuid4()),
+            f"{first} {last}",
+            f"{first.lower()}.{last.lower()}{i}{suffix}@example.com",
+            f"+91 9{rng.randint(100000000, 999999999)}",
+            rng.choice(STATUSES),
+            rng.choice(owners),
+        )
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, default=500000)
+    parser.add_argument("--owners", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    owners = [str(uuid4()) for _ in range(args.owners)]
+    records = list(synthetic_leads(args.leads, owners))
+
+    index = LeadSearchIndex(max_leads=args.leads)
+    started = time.perf_counter()
+    index.rebuild(records)
+    print(f"Build: {args.leads} leads in {time.perf_counter() - started:.2f}s")
+
+    # Simulate API writes landing in the delta
+    for record in records[:1000]:
+        index.upsert({"id": record[0], "parent_name": record[1] + " Jr", "email": record[2],
+                      "phone": record[3], "status": "connected", "assigned_to": record[5]})
+
+    stats = index.stats()
+    print(f"Memory: {stats['memory_bytes'] / 1024 / 1024:.1f} MB "
+          f"({stats['memory_bytes'] / max(1, stats['leads']):.0f} bytes/lead, delta={stats['delta_leads']})")
+
+    rng = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(rng.choice(FIRST + LAST)[:rng.randint(2, 5)])
+        elif kind < 0.8:
+            queries.append(rng.choice(FIRST).lower()[:3] + ".")
+        else:
+            queries.append("9" + str(rng.randint(10, 999)))
+
+    for label, owner in (("view_all", None), ("assigned_to", owners[0])):
+        timings = []
+        for q in queries:
+            t0 = time.perf_counter()
+            index.search(q, limit=10, owner_id=owner)
+            timings.append((time.perf_counter() - t0) * 1000)
+        print(f"Search ({label}): p50={percentile(timings, 50):.3f}ms "
+              f"p99={percentile(timings, 99):.3f}ms max={max(timings):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
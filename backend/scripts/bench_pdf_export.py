@@ -0,0 +1,68 @@
+"""
+Benchmark PDF report rendering (services/report_export.py).
+
+Renders synthetic lead rows (no database needed) at increasing sizes and
+reports render time, output size and pages, so the cost per row can be
+checked for linear growth.
+
+Usage (from backend/):
+    python scripts/bench_pdf_export.py --rows 500 2000 5000 20000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.report_export import write_pdf_pages, PDF_ROWS_PER_TABLE
+
+FIELDS = ["parent_name", "email", "phone", "status", "source", "created_at", "assigned_to"]
+STATUSES = ["new", "attempted_contact", "connected", "visit_scheduled", "application_submitted", "enrolled", "lost"]
+SOURCES = ["website", "referral", "walk_in", "social_media", "other"]
+
+
+def synthetic_pages(count, page_size=1000):
+    rng = random.Random(42)
+    page = []
+    for i in range(count):
+        page.append({
+            "parent_name": f"Parent {i}",
+            "email": f"parent{i}@example.com",
+            "phone": f"+91 9{rng.randint(100000000, 999999999)}",
+            "status": rng.choice(STATUSES),
+            "source": rng.choice(SOURCES),
+            "created_at": "2026-01-15T10:30:00+00:00",
+            "assigned_to": str(uuid4()),
+        })
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[500, 2000, 5000, 20000])
+    args = parser.parse_args()
+
+    report = {"name": "Benchmark", "fields": FIELDS}
+    print(f"{'rows':>8} {'rendered':>9} {'seconds':>8} {'ms/1k rows':>11} {'size':>9} {'tables':>7}")
+    for rows in args.rows:
+        with tempfile.TemporaryFile() as out:
+            started = time.perf_counter()
+            # Uncapped so the timings cover the full size requested
+            rendered = write_pdf_pages(report, FIELDS, synthetic_pages(rows), out, max_rows=rows)
+            elapsed = time.perf_counter() - started
+            size = out.tell()
+        tables = -(-rendered // PDF_ROWS_PER_TABLE)
+        print(f"{rows:>8} {rendered:>9} {elapsed:>8.2f} {elapsed * 1000 / max(1, rendered) * 1000:>11.1f} "
+              f"{size / 1024 / 1024:>7.1f}MB {tables:>7}")
+
+
+if __name__ == "__main__":
+    main()
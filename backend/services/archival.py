@@ -0,0 +1,180 @@
+
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from postgrest.exceptions import APIError
+from database import get_db
+from services.audit_log import audit_writer
+from services.lead_search import lead_search_index
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "1000"))  # Leads moved per archive_leads_chunk call
+POLICY_SETTING_KEY = "archive_policy"  # app_settings row used by the scheduled archival job
+ACTIVE_STATUSES = ["pending", "running"]
+
+
+class ArchivalError(Exception):
+    pass
+
+class ArchiveInProgress(ArchivalError):
+    """Another archive job is already queued or running (idx_archive_jobs_one_active)"""
+    pass
+
+def _is_unique_violation(e: APIError) -> bool:
+    return str(e.code) == "23505"
+
+
+def _matching_leads(supabase, cutoff_str: str, statuses: List[str], columns: str = "id",
+                    count: Optional[str] = None, head: Optional[bool] = None):
+    query = supabase.table("leads").select(columns, count=count, head=head).lt("created_at", cutoff_str)
+    if statuses:
+        query = query.in_("status", statuses)
+    return query
+
+def active_archive_job() -> Optional[Dict[str, Any]]:
+    """The queued or running archive job, if any"""
+    res = get_db().table("archive_jobs").select("*").in_("status", ACTIVE_STATUSES) \
+        .order("created_at").limit(1).execute()
+    return res.data[0] if res.data else None
+
+def archive_leads(days_older_than: int, statuses: List[str], dry_run: bool = True,
+                  archived_by: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Queue the archival of leads created more than days_older_than days ago
+    (optionally only the given statuses). The scheduler runs the job
+    (run_archive_job); a dry run only counts the matching leads.
+    """
+    supabase = get_db()
+
+    # Calculate cutoff
+    cutoff = datetime.now() - timedelta(days=days_older_than)
+    cutoff_str = cutoff.isoformat()
+
+    count = _matching_leads(supabase, cutoff_str, statuses, count="exact", head=True).execute().count or 0
+    if not count:
+        return {"message": "No leads match criteria", "count": 0, "dry_run": dry_run}
+
+    if dry_run:
+        preview = _matching_leads(supabase, cutoff_str, statuses, columns="*") \
+            .order("created_at").order("id").limit(5).execute()
+        return {
+            "message": "Dry Run Result",
+            "count": count,
+            "preview": preview.data or []
+        }
+
+    try:
+        res = supabase.table("archive_jobs").insert({
+            "cutoff": cutoff_str,
+            "statuses": statuses or None,
+            "archived_reason": f"older_than_{days_older_than}_days",
+            "requested_by": archived_by,
+            "total_estimate": count
+        }).execute()
+    except APIError as e:
+        if _is_unique_violation(e):
+            raise ArchiveInProgress("An archive job is already queued or running")
+        raise ArchivalError(f"Failed to queue archival: {str(e)}")
+    except Exception as e:
+        raise ArchivalError(f"Failed to queue archival: {str(e)}")
+    job = res.data[0]
+    return {
+        "message": "Archival queued",
+        "count": count,
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/api/v1/admin/archive-jobs/{job['id']}"
+    }
+
+def run_archive_job(job: Dict[str, Any], worker_id: str, lease_seconds: int) -> Dict[str, Any]:
+    """
+    Scheduler job for one claimed archive_jobs row. Each archive_leads_chunk
+    call (migrations/lead_archival_jobs.sql) moves the next CHUNK_SIZE leads
+    after the job's (created_at, id) checkpoint in one transaction and renews
+    the lease, so nothing is held in memory here and an interrupted job
+    resumes where it stopped.
+    """
+    supabase = get_db()
+    archived = 0
+    update: Dict[str, Any] = {"locked_by": None, "locked_until": None}
+    try:
+        while True:
+            res = supabase.rpc("archive_leads_chunk", {
+                "p_job_id": job["id"],
+                "p_worker": worker_id,
+                "p_limit": CHUNK_SIZE,
+                "p_lease_seconds": lease_seconds
+            }).execute()
+            archived += res.data["archived"]
+            # Archived leads drop out of typeahead suggestions right away
+            lead_search_index.remove_many(res.data.get("ids") or [])
+            if res.data["done"]:
+                break
+        update.update(status="completed", error=None, completed_at=datetime.now().isoformat())
+    except Exception as e:
+        # The checkpoint stays put: resume_archive_job() picks up from the last committed chunk
+        logger.error(f"Archive job {job['id']} failed after {archived} leads: {e}")
+        update.update(status="failed", error=str(e))
+    update["updated_at"] = datetime.now().isoformat()
+
+    res = supabase.table("archive_jobs").update(update) \
+        .eq("id", job["id"]).eq("locked_by", worker_id).execute()
+    total = res.data[0]["archived_count"] if res.data else job.get("archived_count", 0) + archived
+
+    if update["status"] == "completed":
+        # Log Audit
+        audit_writer.log(job.get("requested_by"), "archived", "leads", resource_id=job["id"], details={
+            "count": total,
+            "cutoff_date": job["cutoff"],
+            "statuses": job.get("statuses") or []
+        })
+    return {"job_id": job["id"], "status": update["status"], "archived": total}
+
+def get_archive_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Job row plus percent done (against the count taken when it was queued)"""
+    res = get_db().table("archive_jobs").select("*").eq("id", job_id).execute()
+    if not res.data:
+        return None
+    job = res.data[0]
+    total = job.get("total_estimate") or 0
+    if job["status"] == "completed":
+        job["percent"] = 100.0
+    else:
+        job["percent"] = round(min(job["archived_count"] / total, 1) * 100, 1) if total else 0.0
+    return job
+
+def resume_archive_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Queue a failed job again; it continues from its checkpoint"""
+    try:
+        res = get_db().table("archive_jobs").update({
+            "status": "pending",
+            "error": None,
+            "updated_at": datetime.now().isoformat()
+        }).eq("id", job_id).eq("status", "failed").execute()
+    except APIError as e:
+        if _is_unique_violation(e):
+            raise ArchiveInProgress("Another archive job is already queued or running")
+        raise
+    return res.data[0] if res.data else None
+
+def run_archive_policy() -> Dict[str, Any]:
+    """
+    Scheduled archival job. Reads app_settings.archive_policy, e.g.
+    {"enabled": true, "days_older_than": 365, "statuses": ["lost"]}; does nothing unless enabled.
+    Queues an archive job unless one is already queued or running.
+    """
+    supabase = get_db()
+    res = supabase.table("app_settings").select("value").eq("key", POLICY_SETTING_KEY).execute()
+    policy = res.data[0]["value"] if res.data else None
+    if not policy or not policy.get("enabled"):
+        return {"message": "Archive policy disabled", "count": 0}
+    active = active_archive_job()
+    if active:
+        return {"message": "Archival already in progress", "job_id": active["id"]}
+    try:
+        return archive_leads(int(policy.get("days_older_than", 365)), policy.get("statuses") or [], dry_run=False)
+    except ArchiveInProgress:
+        # Queued by someone else since the check above
+        return {"message": "Archival already in progress"}
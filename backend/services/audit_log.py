@@ -0,0 +1,182 @@
+
+import os
+import json
+import queue
+import logging
+import threading
+from uuid import uuid4, uuid5, NAMESPACE_URL
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from postgrest.exceptions import APIError
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "1000"))
+BATCH_SIZE = 200
+FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+# Entries the database could not take are appended here as JSON lines, and replayed later
+FALLBACK_PATH = os.getenv(
+    "AUDIT_FALLBACK_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs", "audit_fallback.jsonl")
+)
+REJECTED_PATH = f"{FALLBACK_PATH}.rejected"  # Entries the database refused outright, kept for inspection
+
+
+def _is_rejection(e: APIError) -> bool:
+    """
+    True when the entry itself was refused (invalid data, constraint violation,
+    malformed request), so retrying cannot help. Connection errors, timeouts,
+    5xx responses and other server-side failures are worth replaying.
+    """
+    code = str(e.code or "")
+    if code.isdigit() and len(code) == 3:
+        # HTTP status of a non-JSON error response (e.g. from a gateway)
+        return code.startswith("4") and code not in ("408", "429")
+    if code.startswith("PGRST"):
+        # PGRST1xx: bad request, PGRST2xx: unknown table/column; PGRST0xx: database unreachable
+        return code[5:6] in ("1", "2")
+    # SQLSTATE class 22 (data exception) or 23 (integrity constraint violation)
+    return code[:2] in ("22", "23")
+
+
+class AuditWriter:
+    """
+    Buffered audit_logs writer. log() only enqueues (bounded to BUFFER_SIZE
+    entries); a background thread inserts them in batches of up to BATCH_SIZE
+    every FLUSH_SECONDS. Entries that cannot be inserted (database
+    unavailable, buffer full) are appended to FALLBACK_PATH and put back by
+    replay_fallback(), a scheduled job, so none are lost.
+
+    Started and stopped from the FastAPI lifespan (main.py); stop() flushes
+    what is left. Until start() is called, e.g. in scripts, log() inserts directly.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=BUFFER_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._file_lock = threading.Lock()
+
+    def log(self, user_id: Optional[str], action: str, resource: str, resource_id: Optional[str] = None,
+            details: Optional[Dict[str, Any]] = None, before_data: Optional[Dict[str, Any]] = None,
+            after_data: Optional[Dict[str, Any]] = None):
+        entry = {
+            # Client-side id: inserts ignore ids already stored, so replaying an entry twice is harmless
+            "id": str(uuid4()),
+            "user_id": user_id,
+            "action": action,
+            "resource": resource,
+            "resource_id": resource_id,
+            "details": details,
+            "before_data": before_data,
+            "after_data": after_data,
+            # Time of the action, not of the flush
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if not self._thread:
+            self._insert([entry])
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning("Audit buffer full, writing entry to the fallback file")
+            self._append(FALLBACK_PATH, [entry])
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+        # Anything the thread did not get to goes to the file rather than being dropped
+        self._append(FALLBACK_PATH, self._drain(self._queue.qsize()))
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=FLUSH_SECONDS)
+            except queue.Empty:
+                continue
+            self._insert([first] + self._drain(BATCH_SIZE - 1))
+
+    def _insert(self, entries: List[Dict[str, Any]]) -> int:
+        """
+        One batch insert; returns how many entries were stored. If the database
+        rejects the batch's data, retry row by row so one bad entry does not sink
+        the rest; rejected entries are kept in REJECTED_PATH instead of being
+        replayed. Any other failure sends the batch to FALLBACK_PATH for replay.
+        """
+        if not entries:
+            return 0
+        try:
+            get_db().table("audit_logs").upsert(entries, on_conflict="id", ignore_duplicates=True).execute()
+            return len(entries)
+        except APIError as e:
+            if not _is_rejection(e):
+                logger.error(f"Audit insert failed, writing {len(entries)} entries to the fallback file: {e}")
+                self._append(FALLBACK_PATH, entries)
+                return 0
+            if len(entries) == 1:
+                logger.error(f"Audit entry rejected: {e}")
+                self._append(REJECTED_PATH, entries)
+                return 0
+        except Exception as e:
+            logger.error(f"Audit insert failed, writing {len(entries)} entries to the fallback file: {e}")
+            self._append(FALLBACK_PATH, entries)
+            return 0
+        return sum(self._insert([entry]) for entry in entries)
+
+    def _append(self, path: str, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        with self._file_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, default=str) + "\n")
+
+    def replay_fallback(self) -> Dict[str, Any]:
+        """
+        Scheduled job: move the fallback file aside and insert its entries.
+        Entries that still cannot be inserted go back to the fallback file for the next run.
+        A replay interrupted part way is simply run again: entries keep their ids,
+        and ids that are already stored are skipped.
+        """
+        replaying = f"{FALLBACK_PATH}.replaying"
+        with self._file_lock:
+            if not os.path.exists(replaying):
+                if not os.path.exists(FALLBACK_PATH):
+                    return {"replayed": 0}
+                os.replace(FALLBACK_PATH, replaying)
+        with open(replaying, encoding="utf-8") as f:
+            entries = []
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                # Entries written before ids were assigned get a stable one derived from their content
+                entry.setdefault("id", str(uuid5(NAMESPACE_URL, line.strip())))
+                entries.append(entry)
+        stored = sum(self._insert(entries[i:i + BATCH_SIZE]) for i in range(0, len(entries), BATCH_SIZE))
+        os.remove(replaying)
+        return {"replayed": stored, "failed": len(entries) - stored}
+
+# Global instance
+audit_writer = AuditWriter()
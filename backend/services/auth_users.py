@@ -0,0 +1,95 @@
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+AUTH_PAGE_SIZE = 1000  # Supabase Auth admin API maximum per_page
+
+
+def iter_auth_user_pages(supabase, per_page: int = AUTH_PAGE_SIZE, concurrency: int = 1) -> Iterator[List]:
+    """
+    Every Supabase Auth user, one admin API page at a time, in order.
+    With concurrency > 1, that many pages are fetched in parallel per round.
+    """
+    def fetch(page: int) -> List:
+        users = supabase.auth.admin.list_users(page=page, per_page=per_page)
+        # Older clients return an object with .users instead of a list
+        return users if isinstance(users, list) else getattr(users, "users", [])
+
+    page = 1
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        while True:
+            for users in pool.map(fetch, range(page, page + max(1, concurrency))):
+                if users:
+                    yield users
+                if len(users) < per_page:
+                    return
+            page += max(1, concurrency)
+
+class AuthUserDirectory:
+    """
+    Email -> Supabase Auth user id, for linking a profile to an auth user that
+    already exists. Tries the profiles.email index (migrations/profiles_email_index.sql)
+    and ids remembered from earlier lookups, each confirmed with a by-id auth
+    call; only then pages through the auth users, remembering every email seen.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, str] = {}
+        self._emails: Dict[str, str] = {}  # Reverse map, so forget() is O(1)
+        self._lock = threading.Lock()
+
+    def remember(self, email: Optional[str], user_id: str):
+        if email:
+            with self._lock:
+                email = email.strip().lower()
+                self._ids[email] = str(user_id)
+                self._emails[str(user_id)] = email
+
+    def forget(self, user_id: str):
+        with self._lock:
+            email = self._emails.pop(str(user_id), None)
+            if email and self._ids.get(email) == str(user_id):
+                del self._ids[email]
+
+    def _confirmed(self, supabase, user_id: str, email: str) -> bool:
+        try:
+            auth_user = supabase.auth.admin.get_user_by_id(user_id).user
+        except Exception:
+            return False
+        return bool(auth_user and (auth_user.email or "").lower() == email)
+
+    def find_id(self, email: str) -> Optional[str]:
+        supabase = get_db()
+        given = email.strip()
+        email = given.lower()
+
+        # profiles.email keeps the case it was entered with; Auth stores emails lowercased
+        candidates = []
+        res = supabase.table("profiles").select("id").in_("email", list({given, email})).execute()
+        candidates += [p["id"] for p in res.data or []]
+        with self._lock:
+            if email in self._ids:
+                candidates.append(self._ids[email])
+        for user_id in dict.fromkeys(candidates):
+            if self._confirmed(supabase, user_id, email):
+                self.remember(email, user_id)
+                return user_id
+
+        logger.info(f"Auth user {email} not found by index, paging through auth users")
+        for users in iter_auth_user_pages(supabase):
+            found = None
+            for u in users:
+                self.remember(getattr(u, "email", None), u.id)
+                if (getattr(u, "email", None) or "").lower() == email:
+                    found = u.id
+            if found:
+                return found
+        return None
+
+# Global instance
+auth_user_directory = AuthUserDirectory()
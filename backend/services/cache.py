@@ -12,6 +12,8 @@ class CacheService:
         self.redis_client = None
         self.memory_cache: Dict[str, Any] = {}
         self.memory_ttl: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
         
         redis_url = os.getenv("REDIS_URL")
         
@@ -39,11 +41,13 @@ class CacheService:
             if key in self.memory_cache:
                 expiry = self.memory_ttl.get(key, 0)
                 if time.time() < expiry:
+                    self.hits += 1
                     return self.memory_cache[key]
                 else:
                     # Expired
                     del self.memory_cache[key]
                     del self.memory_ttl[key]
+            self.misses += 1
             return None
 
     async def set(self, key: str, value: Any, ttl: int = 300):
@@ -103,6 +107,22 @@ class CacheService:
             
             return new_val
 
+    def stats(self) -> Dict[str, Any]:
+        """Backend, key count and hit/miss counters (Redis: server-wide keyspace stats)"""
+        if self.redis_client:
+            try:
+                info = self.redis_client.info("stats")
+                return {
+                    "backend": "redis",
+                    "keys": self.redis_client.dbsize(),
+                    "hits": info.get("keyspace_hits", 0),
+                    "misses": info.get("keyspace_misses", 0),
+                }
+            except Exception as e:
+                logger.error(f"Redis stats error: {e}")
+                return {"backend": "redis", "keys": 0, "hits": 0, "misses": 0}
+        return {"backend": "memory", "keys": len(self.memory_cache), "hits": self.hits, "misses": self.misses}
+
     def _cleanup(self):
         now = time.time()
         expired = [k for k, t in self.memory_ttl.items() if t < now]
@@ -0,0 +1,132 @@
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from database import get_db
+from services.lead_search import normalize_email, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Leads table fields a merge may fill in when the existing lead has them empty
+MERGE_FIELDS = ("parent_name", "email", "phone")
+LOOKUP_CHUNK_SIZE = 200  # Values per in.() list, keeps the PostgREST URL short
+
+# A match is ("existing", lead_row) or ("batch", index of the first occurrence in the same batch)
+Match = Optional[Tuple[str, Any]]
+
+
+def _quote(value: str) -> str:
+    """Quote a value for a PostgREST in.() list"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def dedup_keys(lead: Dict[str, Any]) -> List[str]:
+    """Normalized identity keys for a lead, email first (it wins over phone on conflicts)"""
+    keys = []
+    email = normalize_email(lead.get("email"))
+    if email:
+        keys.append(f"email:{email}")
+    phone = normalize_phone(lead.get("phone"))
+    if phone:
+        keys.append(f"phone:{phone}")
+    return keys
+
+
+class LeadDeduplicator:
+    """
+    Finds existing leads with the same normalized email or phone.
+
+    Lookups hit the email_normalized / phone_normalized partial indexes
+    (migrations/lead_dedup.sql): one indexed query per insert, or per chunk
+    of LOOKUP_CHUNK_SIZE values for batch imports.
+    """
+
+    def _fetch_existing(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        supabase = get_db()
+        emails = sorted({k[6:] for k in keys if k.startswith("email:")})
+        phones = sorted({k[6:] for k in keys if k.startswith("phone:")})
+        found: Dict[str, Dict[str, Any]] = {}
+
+        for i in range(0, max(len(emails), len(phones)), LOOKUP_CHUNK_SIZE):
+            conditions = []
+            email_chunk = emails[i:i + LOOKUP_CHUNK_SIZE]
+            phone_chunk = phones[i:i + LOOKUP_CHUNK_SIZE]
+            if email_chunk:
+                conditions.append(f"email_normalized.in.({','.join(_quote(e) for e in email_chunk)})")
+            if phone_chunk:
+                conditions.append(f"phone_normalized.in.({','.join(_quote(p) for p in phone_chunk)})")
+
+            rows = supabase.table("leads").select("*, students(*)") \
+                .or_(",".join(conditions)) \
+                .order("created_at") \
+                .execute().data or []
+
+            # Oldest lead wins when several already share a key
+            for row in rows:
+                if row.get("email_normalized"):
+                    found.setdefault(f"email:{row['email_normalized']}", row)
+                if row.get("phone_normalized"):
+                    found.setdefault(f"phone:{row['phone_normalized']}", row)
+        return found
+
+    def find(self, leads: List[Dict[str, Any]]) -> List[Match]:
+        """
+        Match each incoming lead against the DB and against earlier leads in the same list.
+        Returns one Match per input, None when the lead is new.
+        """
+        row_keys = [dedup_keys(lead) for lead in leads]
+        all_keys = [k for keys in row_keys for k in keys]
+        if not all_keys:
+            return [None] * len(leads)
+
+        existing = self._fetch_existing(all_keys)
+        first_seen: Dict[str, int] = {}
+        matches: List[Match] = []
+
+        for index, keys in enumerate(row_keys):
+            match: Match = None
+            for key in keys:
+                if key in existing:
+                    match = ("existing", existing[key])
+                    break
+            if match is None:
+                for key in keys:
+                    if key in first_seen:
+                        match = ("batch", first_seen[key])
+                        break
+            if match is None:
+                for key in keys:
+                    first_seen.setdefault(key, index)
+            matches.append(match)
+        return matches
+
+    def find_one(self, lead: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        match = self.find([lead])[0]
+        return match[1] if match else None
+
+    @staticmethod
+    def fill_blanks(target: Dict[str, Any], source: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy MERGE_FIELDS that are empty on target from source. Returns the changed fields."""
+        updates = {f: source[f] for f in MERGE_FIELDS if source.get(f) and not target.get(f)}
+        target.update(updates)
+        return updates
+
+    def merge(self, existing: Dict[str, Any], lead_data: Dict[str, Any], students: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge an incoming lead into an existing one: fill empty fields and add new students."""
+        supabase = get_db()
+        merged = dict(existing)
+        updates = self.fill_blanks(merged, lead_data)
+        if updates:
+            supabase.table("leads").update(updates).eq("id", existing["id"]).execute()
+
+        merged["students"] = list(existing.get("students") or [])
+        known = {(s.get("name") or "").strip().lower() for s in merged["students"]}
+        new_students = [
+            dict(s, lead_id=existing["id"]) for s in students
+            if (s.get("name") or "").strip().lower() not in known
+        ]
+        if new_students:
+            student_res = supabase.table("students").insert(new_students).execute()
+            merged["students"].extend(student_res.data or [])
+        return merged
+
+# Global instance
+lead_deduplicator = LeadDeduplicator()
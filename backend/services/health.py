@@ -0,0 +1,111 @@
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+from database import get_db
+from services.cache import cache_service
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SECONDS = int(os.getenv("HEALTH_SAMPLE_SECONDS", "15"))
+HISTORY_SIZE = 40  # Samples kept: 10 minutes at the default interval
+HIGH_LOOP_LAG_MS = 500
+
+
+class HealthSampler:
+    """
+    Background sampler behind GET /admin/health. Every SAMPLE_SECONDS it
+    records CPU, memory, disk, event-loop lag, DB ping latency, open DB
+    connections, queued jobs and cache stats into a ring buffer of
+    HISTORY_SIZE samples, so the endpoint answers from memory.
+
+    Event-loop lag is how late the sampler's own sleep wakes up. The blocking
+    part (psutil, DB ping) runs in a worker thread. Started from the FastAPI lifespan.
+    """
+
+    def __init__(self):
+        self.samples: Deque[Dict[str, Any]] = deque(maxlen=HISTORY_SIZE)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task:
+            return
+        self._prime_cpu()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        return self.samples[-1] if self.samples else None
+
+    def history(self) -> List[Dict[str, Any]]:
+        return list(self.samples)
+
+    @staticmethod
+    def _prime_cpu():
+        # cpu_percent(interval=None) reports usage since the previous call; the first call returns 0
+        try:
+            import psutil
+            psutil.cpu_percent(interval=None)
+        except ImportError:
+            pass
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        lag_ms = 0.0
+        while True:
+            try:
+                await self.sample(lag_ms)
+            except Exception as e:
+                logger.error(f"Health sample failed: {e}")
+            started = loop.time()
+            await asyncio.sleep(SAMPLE_SECONDS)
+            lag_ms = max(0.0, (loop.time() - started - SAMPLE_SECONDS) * 1000)
+
+    async def sample(self, loop_lag_ms: float = 0.0) -> Dict[str, Any]:
+        """Take one sample now and add it to the history"""
+        sample = await asyncio.to_thread(self._collect)
+        sample["event_loop_lag_ms"] = round(loop_lag_ms, 1)
+        sample["server_status"] = (
+            "high_load"
+            if sample["cpu_usage"] > 90 or sample["memory_usage"] > 95 or loop_lag_ms > HIGH_LOOP_LAG_MS
+            else "healthy"
+        )
+        self.samples.append(sample)
+        return sample
+
+    def _collect(self) -> Dict[str, Any]:
+        sample: Dict[str, Any] = {"sampled_at": datetime.now(timezone.utc).isoformat()}
+        try:
+            import psutil
+            sample["cpu_usage"] = psutil.cpu_percent(interval=None)
+            sample["memory_usage"] = psutil.virtual_memory().percent
+            sample["disk_usage"] = psutil.disk_usage('/').percent
+        except ImportError:
+            disk = shutil.disk_usage('/')
+            sample.update(cpu_usage=0.0, memory_usage=0.0, disk_usage=round(disk.used / disk.total * 100, 1))
+
+        started = time.perf_counter()
+        try:
+            stats = get_db().rpc("system_health_stats", {}).execute().data or {}
+            sample["database_status"] = "healthy"
+        except Exception as e:
+            logger.warning(f"Health check DB error: {e}")
+            stats = {}
+            sample["database_status"] = "disconnected"
+        sample["database_latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        sample["database_connections"] = int(stats.get("database_connections") or 0)
+        sample["jobs_queue_size"] = int(stats.get("jobs_queue_size") or 0)
+        sample["cache"] = cache_service.stats()
+        return sample
+
+# Global instance
+health_sampler = HealthSampler()
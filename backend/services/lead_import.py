@@ -0,0 +1,267 @@
+
+import io
+import csv
+import time
+import logging
+from uuid import uuid4
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from fastapi import UploadFile
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from database import get_db
+from models import LeadCreate, DedupMode
+from services.webhook import webhook_service
+from services.lead_search import lead_search_index
+from services.dedup import lead_deduplicator
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000          # Leads per insert round-trip
+MAX_REPORTED_ERRORS = 1000 # Per-row errors returned to the client (the rest are only counted)
+
+# Spreadsheet header -> LeadCreate / StudentCreate field
+COLUMN_ALIASES = {
+    "parent_name": "parent_name", "parent": "parent_name", "name": "parent_name",
+    "email": "email", "email_address": "email",
+    "phone": "phone", "phone_number": "phone", "mobile": "phone",
+    "status": "status",
+    "source": "source",
+    "assigned_to": "assigned_to",
+    "student_name": "student_name", "student": "student_name", "child_name": "student_name",
+    "grade_applying_for": "grade_applying_for", "grade": "grade_applying_for",
+    "dob": "dob", "date_of_birth": "dob",
+}
+
+ParsedRow = Tuple[int, LeadCreate]
+
+
+def _normalize_header(value: Any) -> str:
+    key = str(value or "").strip().lower().replace(" ", "_").replace("-", "_")
+    return COLUMN_ALIASES.get(key, key)
+
+def _clean(value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    return value or None
+
+def iter_csv_rows(upload: UploadFile) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yield (row_number, row) lazily from the spooled upload; never reads the whole file."""
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if not header:
+        return
+    columns = [_normalize_header(h) for h in header]
+    for row_number, values in enumerate(reader, start=2):
+        if not any(v.strip() for v in values):
+            continue
+        yield row_number, {col: _clean(v) for col, v in zip(columns, values)}
+
+def iter_xlsx_rows(upload: UploadFile) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yield rows from the first sheet using openpyxl's streaming read-only mode."""
+    from openpyxl import load_workbook
+    wb = load_workbook(upload.file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return
+        columns = [_normalize_header(h) for h in header]
+        for row_number, values in enumerate(rows, start=2):
+            if not any(v not in (None, "") for v in values):
+                continue
+            yield row_number, {col: _clean(v) for col, v in zip(columns, values)}
+    finally:
+        wb.close()
+
+def parse_row(row: Dict[str, Any]) -> LeadCreate:
+    """Validate one spreadsheet row against LeadCreate/StudentCreate"""
+    lead = {k: row[k] for k in ("parent_name", "email", "phone", "assigned_to") if row.get(k)}
+    for enum_field in ("status", "source"):
+        if row.get(enum_field):
+            lead[enum_field] = str(row[enum_field]).lower().replace(" ", "_")
+    if row.get("student_name"):
+        lead["students"] = [{
+            "name": row["student_name"],
+            "grade_applying_for": row.get("grade_applying_for"),
+            "dob": row.get("dob"),
+        }]
+    return LeadCreate(**lead)
+
+def _format_validation_error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+class LeadImporter:
+    """
+    Streams an uploaded CSV/XLSX into leads + students.
+
+    Rows are validated as they are read and inserted BATCH_SIZE at a time
+    (one dedup lookup + one import_leads_batch call per batch), so memory
+    stays bounded by the batch rather than the file. lead.created webhooks
+    go out in the background and do not hold up the upload.
+    """
+
+    def __init__(self, user: Dict[str, Any], dedup: DedupMode = DedupMode.flag):
+        self.user_id = user["id"]
+        self.dedup = dedup
+        self.total_rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.duplicates: Dict[str, int] = {"flagged": 0, "skipped": 0, "merged": 0}
+        self.duplicate_rows: List[Dict[str, Any]] = []
+
+    def _record_error(self, row_number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def _record_duplicate(self, row_number: int, action: str, duplicate_of: Any):
+        self.duplicates[action] += 1
+        if len(self.duplicate_rows) < MAX_REPORTED_ERRORS:
+            self.duplicate_rows.append({"row": row_number, "action": action, "duplicate_of": duplicate_of})
+
+    def _next_batch(self, rows: Iterator[Tuple[int, Dict[str, Any]]]) -> Optional[List[ParsedRow]]:
+        """Read and validate up to BATCH_SIZE rows. Returns None when the file is exhausted."""
+        batch: List[ParsedRow] = []
+        for row_number, row in rows:
+            self.total_rows += 1
+            try:
+                batch.append((row_number, parse_row(row)))
+            except ValidationError as e:
+                self._record_error(row_number, _format_validation_error(e))
+            except Exception as e:
+                self._record_error(row_number, str(e))
+            if len(batch) >= BATCH_SIZE:
+                return batch
+        return batch or None
+
+    def _prepare(self, lead: LeadCreate) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        lead_data = lead.model_dump(mode="json", exclude={"students"})
+        lead_data["created_by"] = self.user_id
+        if not lead_data.get("assigned_to"):
+            lead_data["assigned_to"] = self.user_id
+        return lead_data, [s.model_dump(mode="json") for s in lead.students]
+
+    def _insert_leads(self, rows: List[Tuple[int, Dict[str, Any], List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """
+        Insert the given (row_number, lead, students) rows through one
+        import_leads_batch call (migrations/lead_import_batch.sql): leads and
+        their students are written in one transaction, so a batch either lands
+        whole or every row in it is reported as failed.
+        """
+        if not rows:
+            return []
+        leads, students = [], []
+        for _, lead, lead_students in rows:
+            # Ids are assigned here so students can reference their lead in the same call
+            lead["id"] = str(uuid4())
+            leads.append(lead)
+            students.extend(dict(student, lead_id=lead["id"]) for student in lead_students)
+
+        try:
+            response = get_db().rpc("import_leads_batch", {"p_leads": leads, "p_students": students}).execute()
+        except Exception as e:
+            for row_number, _, _ in rows:
+                self._record_error(row_number, f"Insert failed: {e}")
+            return []
+
+        new_leads = response.data or []
+        self.imported += len(new_leads)
+        return new_leads
+
+    def _insert_batch(self, batch: List[ParsedRow]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Returns (inserted leads, merged leads)"""
+        rows = [(row_number,) + self._prepare(lead) for row_number, lead in batch]
+        try:
+            matches = lead_deduplicator.find([lead for _, lead, _ in rows])
+        except Exception as e:
+            logger.error(f"Duplicate lookup failed for import batch, inserting unchecked: {e}")
+            matches = [None] * len(rows)
+
+        primary = []        # Rows inserted in the first pass
+        primary_pos = {}    # Batch index -> position in primary
+        flagged_in_batch = []  # (row, batch index of the first occurrence) inserted after the first pass
+        merged = []
+
+        for index, (row, match) in enumerate(zip(rows, matches)):
+            row_number, lead, students = row
+            if match is None:
+                primary_pos[index] = len(primary)
+                primary.append(row)
+                continue
+
+            kind, target = match
+            if self.dedup == DedupMode.skip:
+                self._record_duplicate(row_number, "skipped", target["id"] if kind == "existing" else f"row {rows[target][0]}")
+            elif self.dedup == DedupMode.merge:
+                if kind == "existing":
+                    try:
+                        merged.append(lead_deduplicator.merge(target, lead, students))
+                        self._record_duplicate(row_number, "merged", target["id"])
+                    except Exception as e:
+                        self._record_error(row_number, f"Merge failed: {e}")
+                else:
+                    # Not inserted yet: fold into the first occurrence before it is written
+                    _, first_lead, first_students = primary[primary_pos[target]]
+                    lead_deduplicator.fill_blanks(first_lead, lead)
+                    first_students.extend(students)
+                    self._record_duplicate(row_number, "merged", f"row {rows[target][0]}")
+            elif kind == "existing":
+                lead["duplicate_of"] = target["id"]
+                primary_pos[index] = len(primary)
+                primary.append(row)
+                self._record_duplicate(row_number, "flagged", target["id"])
+            else:
+                flagged_in_batch.append((row, target))
+
+        inserted = self._insert_leads(primary)
+
+        # Second pass: duplicates of rows that only got an id in the first pass
+        if flagged_in_batch:
+            second = []
+            for (row_number, lead, students), target in flagged_in_batch:
+                pos = primary_pos[target]
+                if pos >= len(inserted):
+                    self._record_error(row_number, "Insert failed: first occurrence was not inserted")
+                    continue
+                lead["duplicate_of"] = inserted[pos]["id"]
+                second.append((row_number, lead, students))
+                self._record_duplicate(row_number, "flagged", inserted[pos]["id"])
+            inserted += self._insert_leads(second)
+
+        return inserted, merged
+
+    async def run(self, upload: UploadFile) -> Dict[str, Any]:
+        started = time.perf_counter()
+        filename = (upload.filename or "").lower()
+        rows = iter_xlsx_rows(upload) if filename.endswith(".xlsx") else iter_csv_rows(upload)
+
+        # Parsing and the (sync) Supabase client run off the event loop, one batch at a time
+        while True:
+            batch = await run_in_threadpool(self._next_batch, rows)
+            if not batch:
+                break
+            new_leads, merged = await run_in_threadpool(self._insert_batch, batch)
+            lead_search_index.upsert_many(new_leads + merged)
+            webhook_service.dispatch_batch_in_background("lead.created", new_leads)
+
+        duration = time.perf_counter() - started
+        logger.info(f"Lead import: {self.imported}/{self.total_rows} rows in {duration:.1f}s")
+        return {
+            "total_rows": self.total_rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "duplicates": self.duplicates,
+            "duplicate_rows": self.duplicate_rows,
+            "duration_seconds": round(duration, 2),
+        }
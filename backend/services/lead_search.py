@@ -0,0 +1,477 @@
+
+import os
+import sys
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from array import array
+from uuid import UUID
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Memory budget: the index refuses to grow past this many leads (see stats()["truncated"])
+MAX_LEADS = int(os.getenv("LEAD_SEARCH_MAX_LEADS", "500000"))
+# Full reload interval, picks up edits made outside the hooked endpoints
+REFRESH_SECONDS = int(os.getenv("LEAD_SEARCH_REFRESH_SECONDS", "900"))
+# Writes kept in the mutable delta before a rebuild folds them into the arrays
+COMPACT_THRESHOLD = 5000
+PAGE_SIZE = 1000
+SCAN_FACTOR = 50  # Max entries inspected per requested suggestion (bounds scoped scans)
+
+FIELDS = ("name", "email", "phone")
+_SEP = "\x1f"
+_ID_BYTES = 16
+_SELECT = "id, parent_name, email, phone, status, assigned_to"
+
+# Record layout: (id, parent_name, email, phone, status, assigned_to)
+Record = Tuple[str, Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def normalize_name(value: Optional[str]) -> str:
+    return " ".join(value.lower().split()) if value else ""
+
+def normalize_email(value: Optional[str]) -> str:
+    return value.strip().lower() if value else ""
+
+def normalize_phone(value: Optional[str]) -> str:
+    """Digits only, national number (last 10 digits) so '+91 98...' matches '98...'"""
+    digits = "".join(ch for ch in value if ch.isdigit()) if value else ""
+    return digits[-10:]
+
+
+def _to_record(lead: Dict[str, Any]) -> Optional[Record]:
+    if not lead or not lead.get("id"):
+        return None
+    assigned_to = lead.get("assigned_to")
+    return (
+        str(lead["id"]).lower(),
+        lead.get("parent_name"),
+        lead.get("email"),
+        lead.get("phone"),
+        lead.get("status"),
+        str(assigned_to) if assigned_to else None,
+    )
+
+def _record_keys(record: Record) -> Dict[str, List[str]]:
+    """Searchable keys per field. Names are indexed from every word so 'smi' finds 'John Smith'."""
+    keys: Dict[str, List[str]] = {field: [] for field in FIELDS}
+    name = normalize_name(record[1])
+    if name:
+        tokens = name.split(" ")
+        keys["name"] = list(dict.fromkeys(" ".join(tokens[i:]) for i in range(len(tokens))))
+    email = normalize_email(record[2])
+    if email:
+        keys["email"] = [email]
+    phone = normalize_phone(record[3])
+    if phone:
+        keys["phone"] = [phone]
+    return keys
+
+def _query_prefixes(query: str) -> List[Tuple[str, str]]:
+    """Pick the fields a query can match: emails contain '@', phones are digits/punctuation."""
+    q = query.strip()
+    if not q:
+        return []
+    if "@" in q:
+        return [("email", normalize_email(q))]
+    if all(ch.isdigit() or ch in "+-() ." for ch in q):
+        digits = "".join(ch for ch in q if ch.isdigit())
+        # Keys hold the national number (normalize_phone), so drop a country code the same way
+        return [("phone", normalize_phone(digits))] if digits else []
+    return [("name", normalize_name(q)), ("email", normalize_email(q))]
+
+
+class _Segment:
+    """Immutable sorted key array: one bytes blob + offsets + owning slot per key"""
+
+    def __init__(self, entries: List[Tuple[bytes, int]]):
+        entries.sort()
+        self.blob = b"".join(key for key, _ in entries)
+        self.offsets = array("I", [0])
+        total = 0
+        for key, _ in entries:
+            total += len(key)
+            self.offsets.append(total)
+        self.slots = array("I", (slot for _, slot in entries))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _key(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+    def scan(self, prefix: bytes):
+        lo, hi = 0, len(self.slots)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in range(lo, len(self.slots)):
+            key = self._key(i)
+            if not key.startswith(prefix):
+                break
+            yield key, self.slots[i]
+
+    def nbytes(self) -> int:
+        return len(self.blob) + self.offsets.itemsize * len(self.offsets) + self.slots.itemsize * len(self.slots)
+
+
+class _Snapshot:
+    """Compact, read-only image of the leads table. Slot = position in id-sorted order."""
+
+    def __init__(self, records: List[Record]):
+        records.sort(key=lambda r: r[0])
+        self.size = len(records)
+        self.ids = b"".join(UUID(r[0]).bytes for r in records)
+
+        self.owners: List[Optional[str]] = [None]
+        self.statuses: List[Optional[str]] = [None]
+        owner_index: Dict[Optional[str], int] = {None: 0}
+        status_index: Dict[Optional[str], int] = {None: 0}
+        self.owner_of = array("I")
+        self.status_of = array("B")
+
+        display = []
+        self.display_offsets = array("I", [0])
+        total = 0
+        entries: Dict[str, List[Tuple[bytes, int]]] = {field: [] for field in FIELDS}
+
+        for slot, record in enumerate(records):
+            owner = record[5]
+            if owner not in owner_index:
+                owner_index[owner] = len(self.owners)
+                self.owners.append(owner)
+            self.owner_of.append(owner_index[owner])
+
+            status = record[4]
+            if status not in status_index:
+                status_index[status] = len(self.statuses)
+                self.statuses.append(status)
+            self.status_of.append(status_index[status])
+
+            text = _SEP.join(v or "" for v in record[1:4]).encode()
+            display.append(text)
+            total += len(text)
+            self.display_offsets.append(total)
+
+            for field, keys in _record_keys(record).items():
+                for key in keys:
+                    entries[field].append((key.encode(), slot))
+
+        self.display = b"".join(display)
+        self.owner_lookup = owner_index
+        self.segments = {field: _Segment(entries[field]) for field in FIELDS}
+
+    def __len__(self):
+        return self.size
+
+    def slot_of(self, lead_id: str) -> Optional[int]:
+        try:
+            target = UUID(lead_id).bytes
+        except ValueError:
+            return None
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ids[mid * _ID_BYTES:(mid + 1) * _ID_BYTES] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.size and self.ids[lo * _ID_BYTES:(lo + 1) * _ID_BYTES] == target:
+            return lo
+        return None
+
+    def record(self, slot: int) -> Record:
+        text = self.display[self.display_offsets[slot]:self.display_offsets[slot + 1]].decode()
+        name, email, phone = text.split(_SEP)
+        return (
+            str(UUID(bytes=self.ids[slot * _ID_BYTES:(slot + 1) * _ID_BYTES])),
+            name or None,
+            email or None,
+            phone or None,
+            self.statuses[self.status_of[slot]],
+            self.owners[self.owner_of[slot]],
+        )
+
+    def nbytes(self) -> int:
+        size = len(self.ids) + len(self.display)
+        for arr in (self.display_offsets, self.owner_of, self.status_of):
+            size += arr.itemsize * len(arr)
+        size += sum(sys.getsizeof(v) for v in self.owners if v)
+        size += sys.getsizeof(self.owner_lookup)
+        return size + sum(segment.nbytes() for segment in self.segments.values())
+
+
+class LeadSearchIndex:
+    """
+    Prefix index over lead name/email/phone for typeahead suggestions.
+
+    The bulk of the data lives in an immutable _Snapshot; writes from the lead
+    endpoints go to a small sorted delta (and mark the snapshot slot stale)
+    until the next rebuild. Rebuilds run in a worker thread and replay any
+    writes that arrived while they were loading.
+    """
+
+    def __init__(self, max_leads: int = MAX_LEADS, refresh_seconds: int = REFRESH_SECONDS):
+        self.max_leads = max_leads
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot([])
+        self._stale = bytearray()
+        self._delta: Dict[str, Record] = {}
+        self._delta_keys: Dict[str, List[str]] = {field: [] for field in FIELDS}
+        # Writes seen while a rebuild is in flight: records, or lead ids that were removed
+        self._pending: Optional[List[Union[Record, str]]] = None
+        self._loaded_at: Optional[float] = None
+        self._build_seconds = 0.0
+        self._truncated = False
+        self._rebuild_task: Optional[asyncio.Future] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded_at is not None
+
+    # ---------- Writes ----------
+
+    def upsert(self, lead: Dict[str, Any]):
+        """Hook for create/update endpoints. Expects the full lead row."""
+        record = _to_record(lead)
+        if record is None:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(record)
+            if self._loaded_at is None:
+                return
+            self._apply(record)
+            needs_compact = len(self._delta) >= COMPACT_THRESHOLD
+        if needs_compact:
+            self.refresh_in_background()
+
+    def upsert_many(self, leads: Iterable[Dict[str, Any]]):
+        for lead in leads:
+            self.upsert(lead)
+
+    def remove(self, lead_id: str):
+        """Hook for paths that delete leads (e.g. archival)."""
+        lead_id = str(lead_id).lower()
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(lead_id)
+            if self._loaded_at is None:
+                return
+            self._discard(lead_id)
+
+    def remove_many(self, lead_ids: Iterable[str]):
+        for lead_id in lead_ids:
+            self.remove(lead_id)
+
+    def _discard(self, lead_id: str):
+        previous = self._delta.pop(lead_id, None)
+        if previous is not None:
+            self._drop_delta_keys(previous)
+        slot = self._snapshot.slot_of(lead_id)
+        if slot is not None:
+            self._stale[slot] = 1
+
+    def _apply(self, record: Record):
+        lead_id = record[0]
+        previous = self._delta.get(lead_id)
+        if previous is not None:
+            self._drop_delta_keys(previous)
+        else:
+            slot = self._snapshot.slot_of(lead_id)
+            if slot is not None:
+                self._stale[slot] = 1
+            elif len(self._snapshot) + len(self._delta) >= self.max_leads:
+                self._truncated = True
+                return
+        self._delta[lead_id] = record
+        for field, keys in _record_keys(record).items():
+            for key in keys:
+                bisect.insort(self._delta_keys[field], key + _SEP + lead_id)
+
+    def _drop_delta_keys(self, record: Record):
+        for field, keys in _record_keys(record).items():
+            entries = self._delta_keys[field]
+            for key in keys:
+                entry = key + _SEP + record[0]
+                i = bisect.bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+
+    # ---------- Rebuilds ----------
+
+    def _load_from_db(self) -> Tuple[List[Record], bool]:
+        """Keyset-page through leads ordered by id."""
+        db = get_db()
+        records: List[Record] = []
+        last_id = None
+        while True:
+            query = db.table("leads").select(_SELECT).order("id").limit(PAGE_SIZE)
+            if last_id:
+                query = query.gt("id", last_id)
+            rows = query.execute().data or []
+            for row in rows:
+                record = _to_record(row)
+                if record:
+                    records.append(record)
+            if len(records) >= self.max_leads:
+                return records[:self.max_leads], True
+            if len(rows) < PAGE_SIZE:
+                return records, False
+            last_id = rows[-1]["id"]
+
+    def rebuild(self, records: Optional[List[Record]] = None):
+        """Blocking rebuild. Loads from the DB unless records are supplied (benchmarks)."""
+        with self._lock:
+            self._pending = []
+        started = time.perf_counter()
+        try:
+            truncated = False
+            if records is None:
+                records, truncated = self._load_from_db()
+            elif len(records) > self.max_leads:
+                records, truncated = records[:self.max_leads], True
+            snapshot = _Snapshot(records)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._snapshot = snapshot
+            self._stale = bytearray(len(snapshot))
+            self._delta = {}
+            self._delta_keys = {field: [] for field in FIELDS}
+            self._truncated = truncated
+            self._loaded_at = time.time()
+            for write in pending:
+                if isinstance(write, str):
+                    self._discard(write)
+                else:
+                    self._apply(write)
+            self._build_seconds = time.perf_counter() - started
+        logger.info(f"Lead search index built: {len(snapshot)} leads in {self._build_seconds:.2f}s")
+
+    def refresh_in_background(self):
+        """Schedule a rebuild on a worker thread unless one is already running."""
+        if self._rebuild_task and not self._rebuild_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._rebuild_task = loop.run_in_executor(None, self._safe_rebuild)
+
+    def _safe_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f"Lead search index rebuild failed: {e}")
+
+    def ensure_fresh(self):
+        if self._loaded_at is None or time.time() - self._loaded_at > self.refresh_seconds:
+            self.refresh_in_background()
+
+    # ---------- Reads ----------
+
+    def search(self, query: str, limit: int = 10, owner_id: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Prefix-match query against name/email/phone.
+        owner_id restricts results to leads assigned to that user.
+        Returns None while the index has never been built, or when the scan cap
+        was reached before `limit` matches were found (e.g. a common prefix whose
+        first entries belong to other owners): the caller should fall back to the DB.
+        """
+        if self._loaded_at is None:
+            return None
+
+        max_scan = limit * SCAN_FACTOR
+        matches: Dict[str, Tuple[str, Record]] = {}
+        capped = False
+
+        with self._lock:
+            snapshot, stale = self._snapshot, self._stale
+            owner_slot = snapshot.owner_lookup.get(owner_id) if owner_id else None
+
+            for field, prefix in _query_prefixes(query):
+                if not prefix:
+                    continue
+
+                # Snapshot (skipped entirely when the owner has no leads in it)
+                if not owner_id or owner_slot is not None:
+                    found = scanned = 0
+                    for key, slot in snapshot.segments[field].scan(prefix.encode()):
+                        scanned += 1
+                        if found >= limit:
+                            break
+                        if scanned > max_scan:
+                            capped = True
+                            break
+                        if stale[slot] or (owner_id and snapshot.owner_of[slot] != owner_slot):
+                            continue
+                        record = snapshot.record(slot)
+                        if record[0] not in matches:
+                            matches[record[0]] = (key.decode(), record)
+                            found += 1
+
+                # Delta
+                entries = self._delta_keys[field]
+                found = 0
+                i = bisect.bisect_left(entries, prefix)
+                while i < len(entries) and entries[i].startswith(prefix) and found < limit:
+                    key, lead_id = entries[i].split(_SEP)
+                    record = self._delta[lead_id]
+                    if (not owner_id or record[5] == owner_id) and lead_id not in matches:
+                        matches[lead_id] = (key, record)
+                        found += 1
+                    i += 1
+
+        ranked = sorted(matches.values(), key=lambda m: m[0])[:limit]
+        if capped and len(ranked) < limit:
+            return None
+        return [
+            {
+                "id": r[0],
+                "parent_name": r[1],
+                "email": r[2],
+                "phone": r[3],
+                "status": r[4],
+                "assigned_to": r[5],
+            }
+            for _, r in ranked
+        ]
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            size = self._snapshot.nbytes() + len(self._stale)
+            size += sys.getsizeof(self._delta)
+            for record in self._delta.values():
+                size += sys.getsizeof(record) + sum(sys.getsizeof(v) for v in record if v)
+            for entries in self._delta_keys.values():
+                size += sys.getsizeof(entries) + sum(sys.getsizeof(e) for e in entries)
+            return size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "leads": len(self._snapshot) + len(self._delta) - self._stale.count(1),
+            "snapshot_leads": len(self._snapshot),
+            "delta_leads": len(self._delta),
+            "max_leads": self.max_leads,
+            "truncated": self._truncated,
+            "memory_bytes": self.memory_bytes(),
+            "build_seconds": round(self._build_seconds, 3),
+            "loaded_at": self._loaded_at,
+        }
+
+# Global instance
+lead_search_index = LeadSearchIndex()
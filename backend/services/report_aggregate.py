@@ -0,0 +1,93 @@
+
+from typing import Any, Dict, List, Optional, Tuple
+from services.report_query import parse_json, can_view_all, FILTERS
+
+# Report field -> the grouping column it labels
+GROUP_FIELDS = {
+    "status": "status",
+    "source": "source",
+    "assigned_to": "assigned_to",
+    "counselor_name": "assigned_to",
+}
+
+# Aggregate report fields; any of them (or a grouping) makes a report grouped
+AGGREGATE_FIELDS = {
+    "count", "total_leads", "enrolled", "enrollments", "interactions", "percentage", "conversion_rate",
+}
+
+
+def _grouping(report: Dict[str, Any], fields: List[str]) -> Optional[str]:
+    grouping = report.get("grouping")
+    if grouping:
+        if grouping not in GROUP_FIELDS:
+            raise ValueError(f"Unsupported report grouping: {grouping}")
+        return GROUP_FIELDS[grouping]
+    # Aggregate fields without an explicit grouping: group by the first label field shown
+    return next((GROUP_FIELDS[f] for f in fields if f in GROUP_FIELDS), None)
+
+def is_aggregate(report: Dict[str, Any]) -> bool:
+    fields = parse_json(report.get("fields")) or []
+    aggregations = parse_json(report.get("aggregations")) or {}
+    return bool(report.get("grouping") or aggregations or any(f in AGGREGATE_FIELDS for f in fields))
+
+def output_fields(report: Dict[str, Any]) -> List[str]:
+    """Columns a report renders: its fields plus any aggregation aliases not already listed"""
+    fields = parse_json(report.get("fields")) or []
+    aggregations = parse_json(report.get("aggregations")) or {}
+    return fields + [alias for alias in aggregations if alias not in fields]
+
+def _counselor_names(supabase, ids: List[str]) -> Dict[str, str]:
+    if not ids:
+        return {}
+    res = supabase.table("profiles").select("id, full_name").in_("id", ids).execute()
+    return {p["id"]: p.get("full_name") for p in res.data or []}
+
+def aggregate_report(supabase, report: Dict[str, Any], user: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Grouped result set for a report: one report_aggregate RPC call
+    (migrations/report_aggregate.sql) does the GROUP BY in Postgres; only the
+    derived fields (percentage, conversion rate, counselor names) are computed here.
+    Returns (fields, rows), one row per group, largest group first.
+    """
+    fields = output_fields(report)
+    aggregations: Dict[str, str] = parse_json(report.get("aggregations")) or {}
+    filters = {
+        k: v for k, v in (parse_json(report.get("filters")) or {}).items()
+        if k in FILTERS and v not in (None, "", [])
+    }
+    group_column = _grouping(report, fields)
+
+    res = supabase.rpc("report_aggregate", {
+        "p_group_column": group_column,
+        "p_filters": filters,
+        "p_assigned_to": None if can_view_all(user) else user.get("id")
+    }).execute()
+    groups = res.data or []
+
+    grand_total = sum(g["total_leads"] for g in groups)
+    names = _counselor_names(supabase, [g["group_key"] for g in groups if g["group_key"]]) \
+        if group_column == "assigned_to" and "counselor_name" in fields else {}
+
+    rows = []
+    for g in groups:
+        total, enrolled = g["total_leads"], g["enrolled"]
+        key = g["group_key"]
+        values = {
+            "count": total,
+            "total_leads": total,
+            "enrolled": enrolled,
+            "enrollments": enrolled,
+            "interactions": g["interactions"],
+            "percentage": round(total / grand_total * 100, 2) if grand_total else 0.0,
+            "conversion_rate": round(enrolled / total * 100, 2) if total else 0.0,
+        }
+        if group_column:
+            values[group_column] = key
+            if group_column == "assigned_to":
+                values["counselor_name"] = names.get(key) or (f"Counselor {key[:8]}" if key else "Unassigned")
+        # Custom aliases, e.g. {"leads": "count"}
+        for alias, aggregate in aggregations.items():
+            if aggregate in values:
+                values[alias] = values[aggregate]
+        rows.append({field: values.get(field) for field in fields})
+    return fields, rows
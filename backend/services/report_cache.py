@@ -0,0 +1,47 @@
+
+import json
+import hashlib
+from typing import Any, Dict, Optional
+from services.report_query import parse_json, can_view_all
+
+# Cached previews live this long at most; a data generation change retires them sooner
+PREVIEW_TTL_SECONDS = 3600
+
+
+def data_generation(supabase) -> Optional[int]:
+    """
+    Current report data generation (migrations/report_cache.sql): advanced
+    when a transaction writing to leads, students or interactions commits.
+    None while such a transaction is committing: its data may not be visible
+    yet, so results computed now must not be cached.
+    """
+    generation = supabase.rpc("report_data_generation", {}).execute().data
+    return int(generation) if generation is not None else None
+
+def permission_scope(user: Dict[str, Any]) -> str:
+    """Users who see every lead share cached results; everyone else gets their own"""
+    return "all" if can_view_all(user) else f"user:{user.get('id')}"
+
+def report_cache_key(report: Dict[str, Any], user: Dict[str, Any], variant: str,
+                     generation: Optional[int]) -> Optional[str]:
+    """
+    Hash of everything that determines a report's result: the definition,
+    the user's permission scope, the output variant (export format or preview)
+    and the data generation. None (don't cache) when the generation is unknown.
+    """
+    if generation is None:
+        return None
+    payload = {
+        "fields": parse_json(report.get("fields")) or [],
+        "filters": parse_json(report.get("filters")) or {},
+        "sorting": parse_json(report.get("sorting")),
+        "grouping": report.get("grouping"),
+        "aggregations": parse_json(report.get("aggregations")) or {},
+        "scope": permission_scope(user),
+        "variant": variant,
+        "generation": generation,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def preview_cache_key(cache_key: Optional[str]) -> Optional[str]:
+    return f"report:preview:{cache_key}" if cache_key else None
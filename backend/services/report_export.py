@@ -0,0 +1,510 @@
+
+import io
+import csv
+import os
+import shutil
+import tempfile
+import logging
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+from database import get_db
+from services.report_query import compile_report, parse_json
+from services.report_aggregate import is_aggregate, aggregate_report, output_fields
+from services.report_cache import data_generation, report_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Rendered report files (scheduled runs) are written here and served by
+# GET /api/v1/reports/runs/{run_id}/download until expires_at
+EXPORT_DIR = os.getenv("REPORT_EXPORT_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "exports"))
+EXPORT_TTL_DAYS = 7
+PAGE_SIZE = 1000  # Leads per keyset page when streaming exports
+
+SPOOL_MAX_BYTES = 8 * 1024 * 1024  # Rendered files bigger than this spill from memory to a temp file
+STREAM_CHUNK_BYTES = 64 * 1024
+
+EXTENSIONS = {"csv": "csv", "xlsx": "xlsx", "pdf": "pdf", "parquet": "parquet", "arrow": "arrow"}
+PLACEHOLDER_FORMATS = {"sheets"}  # Accepted by sync exports, answered with a notice instead of data
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.file"
+
+# Parquet/Arrow column types: report fields that are not listed here are strings
+TIMESTAMP_FIELDS = {"created_at", "updated_at", "last_interaction_at", "status_changed_at", "enrolled_date"}
+UUID_FIELDS = {"id", "assigned_to", "created_by", "duplicate_of"}
+INTEGER_FIELDS = {"count", "total_leads", "enrolled", "enrollments", "interactions"}
+FLOAT_FIELDS = {"percentage", "conversion_rate"}
+PARQUET_ROW_GROUP_ROWS = 50000  # Pages are buffered as Arrow batches up to this many rows per row group
+
+# PDF layout (landscape letter): one table per PDF_ROWS_PER_TABLE rows, fixed sizes so
+# reportlab never has to measure every cell; cells longer than the column are cut
+PDF_MAX_ROWS = int(os.getenv("REPORT_PDF_MAX_ROWS", "5000"))
+PDF_ROWS_PER_TABLE = 30
+PDF_HEADER_HEIGHT = 24
+PDF_ROW_HEIGHT = 13
+PDF_CHAR_WIDTH = 4.6  # Average Helvetica 8pt glyph width, for cutting cells to the column
+PDF_TABLE_STYLE = [
+    ('BACKGROUND', (0, 0), (-1, 0), "grey"),
+    ('TEXTCOLOR', (0, 0), (-1, 0), "whitesmoke"),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), "beige"),
+    ('GRID', (0, 0), (-1, -1), 1, "black"),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+]
+
+
+
+def load_run_user(user_id: str) -> Dict[str, Any]:
+    """
+    Rebuild the user dict get_current_user would produce (id, role, permissions)
+    for work that runs without a request, e.g. a scheduled report run on behalf of its creator.
+    """
+    supabase = get_db()
+    profile = supabase.table("profiles").select("id, role").eq("id", user_id).execute().data
+    role = profile[0].get("role", "counselor") if profile else "counselor"
+    permissions = {}
+    role_res = supabase.table("custom_roles").select("permissions").ilike("name", role).execute()
+    if role_res.data:
+        permissions = parse_json(role_res.data[0]["permissions"]) or {}
+    return {"id": user_id, "role": role, "permissions": permissions}
+
+def compute_next_run(frequency: str, schedule_time: Optional[time], now: datetime) -> datetime:
+    """Next run time for a schedule, counted from now"""
+    if frequency == "daily":
+        next_run = now.replace(
+            hour=schedule_time.hour if schedule_time else 9,
+            minute=schedule_time.minute if schedule_time else 0,
+            second=0, microsecond=0
+        )
+        if next_run <= now:
+            next_run += timedelta(days=1)
+    elif frequency == "weekly":
+        next_run = now + timedelta(days=7)
+    elif frequency == "monthly":
+        next_run = now + timedelta(days=30)
+    else:  # once
+        next_run = now + timedelta(hours=1)
+    return next_run
+
+def iter_report_pages(report: Dict[str, Any], user: Dict[str, Any], page_size: int = PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield the report's rows page by page (services/report_query.py): keyset-paginated
+    whenever the report's ordering allows, so only one page is held in memory at a time.
+    Grouped reports (services/report_aggregate.py) come back as a single page of groups.
+    """
+    if is_aggregate(report):
+        return iter([aggregate_report(get_db(), report, user)[1]])
+    return compile_report(report).pages(get_db(), user, page_size)
+
+def stream_csv(report: Dict[str, Any], user: Dict[str, Any],
+               on_complete: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """
+    CSV export as a generator: the header goes out before the first query,
+    then one encoded chunk per page. on_complete(row_count) runs after the last page.
+    """
+    fields = output_fields(report)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+
+    def drain() -> bytes:
+        chunk = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writeheader()
+    yield drain()
+
+    row_count = 0
+    for page in iter_report_pages(report, user):
+        writer.writerows(page)
+        row_count += len(page)
+        yield drain()
+
+    if on_complete:
+        on_complete(row_count)
+
+def write_xlsx(report: Dict[str, Any], user: Dict[str, Any], out: IO[bytes]) -> int:
+    """
+    Write the report as XLSX to out using openpyxl's write-only mode: rows are
+    serialized as they are appended, so memory is bounded by one page of leads.
+    Returns the row count.
+    """
+    from openpyxl import Workbook
+    fields = output_fields(report)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Report")
+    ws.append(fields)
+
+    row_count = 0
+    for page in iter_report_pages(report, user):
+        for row in page:
+            ws.append([row.get(field, "") for field in fields])
+        row_count += len(page)
+
+    wb.save(out)
+    return row_count
+
+def _stream_spooled(write: Callable[[IO[bytes]], int],
+                    on_complete: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """
+    Run write(file) -> row_count into a spooled temp file (in memory up to
+    SPOOL_MAX_BYTES, on disk beyond) and stream the result in STREAM_CHUNK_BYTES chunks.
+    For formats whose container can only be finalized once all rows are written.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        row_count = write(spool)
+        if on_complete:
+            on_complete(row_count)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+def stream_xlsx(report: Dict[str, Any], user: Dict[str, Any],
+                on_complete: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    return _stream_spooled(lambda out: write_xlsx(report, user, out), on_complete)
+
+def write_pdf_pages(report: Dict[str, Any], fields: List[str], pages: Iterable[List[Dict[str, Any]]],
+                    out: IO[bytes], max_rows: int = PDF_MAX_ROWS) -> int:
+    """
+    Lay out rows as a series of page-sized tables (PDF_ROWS_PER_TABLE rows each,
+    fixed column widths and row heights) instead of one table holding every row,
+    so layout cost stays linear. Stops after max_rows and says so at the end.
+    Returns the number of rows rendered.
+    """
+    from reportlab.lib.pagesizes import letter, landscape
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    doc = SimpleDocTemplate(out, pagesize=landscape(letter))
+    styles = getSampleStyleSheet()
+    elements = [Paragraph(f"Report: {report.get('name', 'Export')}", styles['Title']), Spacer(1, 12)]
+
+    header = [f.replace('_', ' ').title() for f in fields] or ["No Data"]
+    col_width = doc.width / len(header)
+    max_chars = max(4, int(col_width / PDF_CHAR_WIDTH))
+    style = TableStyle(PDF_TABLE_STYLE)
+
+    def cell(value: Any) -> str:
+        text = "" if value is None else str(value)
+        return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+    def add_table(rows: List[List[str]]):
+        t = Table([header] + rows, colWidths=[col_width] * len(header),
+                  rowHeights=[PDF_HEADER_HEIGHT] + [PDF_ROW_HEIGHT] * len(rows), repeatRows=1)
+        t.setStyle(style)
+        elements.append(t)
+
+    row_count = 0
+    truncated = False
+    pending: List[List[str]] = []
+    for page in pages:
+        for row in page:
+            if row_count >= max_rows:
+                truncated = True
+                break
+            pending.append([cell(row.get(field)) for field in fields])
+            row_count += 1
+            if len(pending) == PDF_ROWS_PER_TABLE:
+                add_table(pending)
+                pending = []
+        if truncated:
+            break
+    if pending or row_count == 0:
+        add_table(pending)
+
+    if truncated:
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph(
+            f"Showing the first {max_rows:,} rows only. Export as CSV or XLSX for the full report.",
+            styles['Italic']
+        ))
+
+    doc.build(elements)
+    return row_count
+
+def write_pdf(report: Dict[str, Any], user: Dict[str, Any], out: IO[bytes]) -> int:
+    return write_pdf_pages(report, output_fields(report), iter_report_pages(report, user), out)
+
+def stream_pdf(report: Dict[str, Any], user: Dict[str, Any],
+               on_complete: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    return _stream_spooled(lambda out: write_pdf(report, user, out), on_complete)
+
+def _column_kind(report: Dict[str, Any], field: str) -> str:
+    # Aggregation aliases take the type of the aggregate they name
+    field = (parse_json(report.get("aggregations")) or {}).get(field, field)
+    if field in TIMESTAMP_FIELDS:
+        return "timestamp"
+    if field in UUID_FIELDS:
+        return "uuid"
+    if field in INTEGER_FIELDS:
+        return "int"
+    if field in FLOAT_FIELDS:
+        return "float"
+    return "string"
+
+def arrow_schema(report: Dict[str, Any]):
+    """Typed Arrow schema for a report: UTC timestamps, arrow.uuid for ids, numbers for aggregates"""
+    import pyarrow as pa
+    types = {
+        "timestamp": pa.timestamp("us", tz="UTC"),
+        "uuid": pa.uuid(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "string": pa.string(),
+    }
+    return pa.schema([pa.field(f, types[_column_kind(report, f)]) for f in output_fields(report)])
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(str(value))
+    # Naive timestamps are taken as UTC
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def _record_batch(schema, page: List[Dict[str, Any]]):
+    """One page of report rows as an Arrow record batch with the report's column types"""
+    import pyarrow as pa
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in page]
+        if field.type == pa.uuid():  # Extension type over 16-byte storage
+            storage = pa.array([UUID(str(v)).bytes if v else None for v in values], type=pa.binary(16))
+            arrays.append(pa.ExtensionArray.from_storage(field.type, storage))
+        elif pa.types.is_timestamp(field.type):
+            arrays.append(pa.array([_parse_timestamp(v) for v in values], type=field.type))
+        elif pa.types.is_string(field.type):
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=field.type))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def write_parquet(report: Dict[str, Any], user: Dict[str, Any], out: IO[bytes]) -> int:
+    """
+    Write the report as Parquet. Each fetched page is converted to an Arrow
+    batch as it arrives; batches are flushed as one row group every
+    PARQUET_ROW_GROUP_ROWS rows, so memory holds columnar data for one row group.
+    Returns the row count.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = arrow_schema(report)
+    row_count = 0
+    pending: List[Any] = []
+    pending_rows = 0
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        for page in iter_report_pages(report, user):
+            pending.append(_record_batch(schema, page))
+            pending_rows += len(page)
+            row_count += len(page)
+            if pending_rows >= PARQUET_ROW_GROUP_ROWS:
+                writer.write_table(pa.Table.from_batches(pending, schema=schema), row_group_size=pending_rows)
+                pending, pending_rows = [], 0
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending, schema=schema), row_group_size=pending_rows)
+    return row_count
+
+def write_arrow(report: Dict[str, Any], user: Dict[str, Any], out: IO[bytes]) -> int:
+    """Write the report as an Arrow IPC file, one record batch per fetched page. Returns the row count."""
+    import pyarrow as pa
+    schema = arrow_schema(report)
+    row_count = 0
+    with pa.ipc.new_file(out, schema) as writer:
+        for page in iter_report_pages(report, user):
+            writer.write_batch(_record_batch(schema, page))
+            row_count += len(page)
+    return row_count
+
+def stream_parquet(report: Dict[str, Any], user: Dict[str, Any],
+                   on_complete: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    return _stream_spooled(lambda out: write_parquet(report, user, out), on_complete)
+
+def stream_arrow(report: Dict[str, Any], user: Dict[str, Any],
+                 on_complete: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    return _stream_spooled(lambda out: write_arrow(report, user, out), on_complete)
+
+def render_report(format: str) -> Tuple[bytes, str, str]:
+    """Render formats that are not streamed (placeholders, no data). Returns (content, media_type, filename)."""
+    # Phase 5 Placeholder
+    msg = f"The Google Sheets export feature is part of Phase 5.\nPlease use 'Export as CSV' for now to get your data."
+    return msg.encode(), "text/plain", f"feature_coming_soon_{format}.txt"
+
+def export_path(run_id: str, format: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{run_id}.{EXTENSIONS.get(format, 'txt')}")
+
+def write_report_file(run_id: str, report: Dict[str, Any], user: Dict[str, Any], fmt: str) -> int:
+    """Render a report to its file in EXPORT_DIR. Returns the row count."""
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Format '{fmt}' is not supported for background exports")
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with open(export_path(run_id, fmt), "wb") as f:
+        if fmt == "csv":
+            counted = []
+            for chunk in stream_csv(report, user, on_complete=counted.append):
+                f.write(chunk)
+            return counted[0]
+        if fmt == "xlsx":
+            return write_xlsx(report, user, f)
+        if fmt == "parquet":
+            return write_parquet(report, user, f)
+        if fmt == "arrow":
+            return write_arrow(report, user, f)
+        return write_pdf(report, user, f)
+
+def tee_to_file(chunks: Iterator[bytes], path: str) -> Iterator[bytes]:
+    """
+    Pass a streamed export through while writing it to path, so it can be
+    reused from the cache. The file only appears once the stream completes;
+    an interrupted download leaves nothing behind.
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    partial = f"{path}.part"
+    try:
+        with open(partial, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def find_cached_run(cache_key: str) -> Optional[Dict[str, Any]]:
+    """
+    Latest completed, unexpired run that rendered this cache key
+    (services/report_cache.py) and whose file is still on disk.
+    """
+    res = get_db().table("report_runs").select("id, format, row_count") \
+        .eq("cache_key", cache_key).eq("status", "completed").eq("cache_hit", False) \
+        .gt("expires_at", datetime.now().isoformat()) \
+        .order("completed_at", desc=True).limit(5).execute()
+    for run in res.data or []:
+        if os.path.exists(export_path(run["id"], run.get("format") or "csv")):
+            return run
+    return None
+
+def copy_cached_file(source_run: Dict[str, Any], run_id: str, fmt: str):
+    """Give a run its own copy of a cached file: a hard link where the filesystem allows"""
+    source, target = export_path(source_run["id"], fmt), export_path(run_id, fmt)
+    try:
+        os.link(source, target)
+        # A link shares the source's mtime; restart the TTL purge_expired_exports goes by
+        os.utime(target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def _execute_run(run: Dict[str, Any], report: Optional[Dict[str, Any]], fmt: str) -> Dict[str, Any]:
+    """
+    Render a report_runs row and record the outcome on it. If an earlier run
+    rendered the same result (same cache key), its file is reused instead.
+    """
+    supabase = get_db()
+    try:
+        if not report:
+            raise ValueError("Report definition not found")
+
+        user = load_run_user(run["run_by"])
+        cache_key = report_cache_key(report, user, fmt, data_generation(supabase))
+        cached = find_cached_run(cache_key) if cache_key else None
+        if cached:
+            copy_cached_file(cached, run["id"], fmt)
+            row_count = cached.get("row_count") or 0
+        else:
+            row_count = write_report_file(run["id"], report, user, fmt)
+
+        now = datetime.now()
+        supabase.table("report_runs").update({
+            "status": "completed",
+            "row_count": row_count,
+            "cache_key": cache_key,
+            "cache_hit": bool(cached),
+            "download_url": f"/api/v1/reports/runs/{run['id']}/download",
+            "completed_at": now.isoformat(),
+            "expires_at": (now + timedelta(days=EXPORT_TTL_DAYS)).isoformat(),
+            "locked_by": None,
+            "locked_until": None
+        }).eq("id", run["id"]).execute()
+        return {"run_id": run["id"], "status": "completed", "row_count": row_count, "cache_hit": bool(cached)}
+    except Exception as e:
+        logger.error(f"Report run {run['id']} failed: {e}")
+        supabase.table("report_runs").update({
+            "status": "failed",
+            "error_message": str(e),
+            "completed_at": datetime.now().isoformat(),
+            "locked_by": None,
+            "locked_until": None
+        }).eq("id", run["id"]).execute()
+        return {"run_id": run["id"], "status": "failed", "error": str(e)}
+
+def run_scheduled_report(schedule: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Render one scheduled report to EXPORT_DIR and record it in report_runs.
+    Blocking: called by services/scheduler.py from its worker pool.
+    """
+    supabase = get_db()
+    run = supabase.table("report_runs").insert({
+        "report_id": schedule["report_id"],
+        "scheduled_report_id": schedule["id"],
+        "status": "running",
+        "format": schedule["format"],
+        "run_by": schedule.get("created_by"),
+    }).execute().data[0]
+
+    report_res = supabase.table("reports").select("*").eq("id", schedule["report_id"]).execute()
+    return _execute_run(run, report_res.data[0] if report_res.data else None, schedule["format"])
+
+def enqueue_export(report: Dict[str, Any], fmt: str, user: Dict[str, Any], report_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Queue an export job: a pending report_runs row carrying the resolved report
+    definition, picked up by the scheduler (claim_pending_export_runs).
+    """
+    supabase = get_db()
+    return supabase.table("report_runs").insert({
+        "report_id": report_id,
+        "status": "pending",
+        "format": fmt,
+        "report_config": {k: report.get(k) for k in ("name", "fields", "filters", "sorting", "grouping", "aggregations")},
+        "run_by": user.get("id"),
+    }).execute().data[0]
+
+def run_export_job(run: Dict[str, Any]) -> Dict[str, Any]:
+    """Render a claimed export job and tell its owner the file is ready"""
+    result = _execute_run(run, parse_json(run.get("report_config")), run.get("format") or "csv")
+    name = (parse_json(run.get("report_config")) or {}).get("name") or "Report"
+    try:
+        if result["status"] == "completed":
+            title, message = "Export ready", f"{name} export is ready ({result['row_count']} rows)."
+        else:
+            title, message = "Export failed", f"{name} export failed: {result['error']}"
+        get_db().table("notifications").insert({
+            "user_id": run["run_by"],
+            "title": title,
+            "message": message,
+            "read": False,
+            "type": "info" if result["status"] == "completed" else "alert",
+            "link": "/reports"
+        }).execute()
+    except Exception as e:
+        logger.error(f"Failed to notify export owner for run {run['id']}: {e}")
+    return result
+
+def purge_expired_exports() -> Dict[str, Any]:
+    """Delete export files older than EXPORT_TTL_DAYS (their runs have expired)"""
+    if not os.path.isdir(EXPORT_DIR):
+        return {"deleted": 0}
+    cutoff = datetime.now().timestamp() - EXPORT_TTL_DAYS * 86400
+    deleted = 0
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            deleted += 1
+    return {"deleted": deleted}
@@ -0,0 +1,183 @@
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# Real columns of the leads table
+LEAD_COLUMNS = {
+    "id", "parent_name", "email", "phone", "status", "source", "assigned_to", "created_by",
+    "created_at", "updated_at", "last_interaction_at", "status_changed_at", "duplicate_of",
+}
+# Lead columns that are never NULL, so they can carry a keyset cursor
+NOT_NULL_COLUMNS = {"id", "parent_name", "status", "source", "created_at", "updated_at"}
+
+# Report fields that are lead columns under another name
+LEAD_FIELD_ALIASES = {"enrolled_date": "status_changed_at"}
+
+# Report fields read from the embedded students(...) resource
+STUDENT_FIELDS = {
+    "student_name": "name",
+    "grade": "grade_applying_for",
+    "grade_applying_for": "grade_applying_for",
+    "dob": "dob",
+}
+
+# Filter key -> (PostgREST operator, lead column); list values become in.()
+FILTERS = {
+    "status": ("eq", "status"),
+    "source": ("eq", "source"),
+    "assigned_to": ("eq", "assigned_to"),
+    "date_from": ("gte", "created_at"),
+    "date_to": ("lte", "created_at"),
+}
+
+
+def parse_json(value: Any) -> Any:
+    """JSONB columns may come back as strings or already decoded"""
+    return json.loads(value) if isinstance(value, str) else value
+
+def can_view_all(user: Dict[str, Any]) -> bool:
+    perms = user.get("permissions", {}) or {}
+    return bool(perms.get("leads.view_all") or perms.get("*"))
+
+def _quote(value: Any) -> str:
+    """Quote a value inside a PostgREST or=() expression"""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _lead_column(field: str) -> Optional[str]:
+    field = LEAD_FIELD_ALIASES.get(field, field)
+    return field if field in LEAD_COLUMNS else None
+
+
+class ReportQuery:
+    """
+    A row-level report definition (fields, filters, sorting) compiled into one
+    projected, filtered, ordered PostgREST query on leads. Grouped reports go
+    through services/report_aggregate.py instead.
+
+    Only the columns the report displays are selected; student fields come
+    from an embedded students(...) select rather than a second query. Rows
+    are returned one per lead, with multiple students joined by ", ".
+    """
+
+    def __init__(self, report: Dict[str, Any]):
+        self.fields: List[str] = parse_json(report.get("fields")) or []
+        self.filters: Dict[str, Any] = parse_json(report.get("filters")) or {}
+
+        # Ordering: sorting, then id as the tie-breaker
+        self.order: List[Tuple[str, bool]] = []
+        for field, direction in self._sorting(parse_json(report.get("sorting"))):
+            column = _lead_column(field)
+            if column and column not in [c for c, _ in self.order]:
+                self.order.append((column, str(direction).lower() == "desc"))
+        if "id" not in [c for c, _ in self.order]:
+            self.order.append(("id", False))
+
+        # Order columns are selected too: the keyset cursor reads them from the last row
+        columns = [c for c, _ in self.order]
+        for field in self.fields:
+            column = _lead_column(field)
+            if column and column not in columns:
+                columns.append(column)
+        student_columns = sorted({STUDENT_FIELDS[f] for f in self.fields if f in STUDENT_FIELDS})
+        if student_columns:
+            columns.append(f"students({','.join(student_columns)})")
+        self.select = ",".join(columns)
+
+    @staticmethod
+    def _sorting(sorting: Any) -> List[Tuple[str, str]]:
+        """Accepts {"field": ..., "direction": ...} or {column: direction, ...}"""
+        if not sorting:
+            return []
+        if isinstance(sorting, dict) and "field" in sorting:
+            return [(sorting["field"], sorting.get("direction", "asc"))]
+        if isinstance(sorting, dict):
+            return list(sorting.items())
+        return []
+
+    @property
+    def keyset(self) -> bool:
+        """Keyset paging needs a single non-null order column before the id tie-breaker"""
+        return len(self.order) <= 2 and all(c in NOT_NULL_COLUMNS for c, _ in self.order)
+
+    def build(self, supabase, user: Dict[str, Any], columns: Optional[str] = None,
+              count: Optional[str] = None, head: Optional[bool] = None):
+        """Filtered, scoped query on leads (no ordering or paging)"""
+        query = supabase.table("leads").select(columns or self.select, count=count, head=head)
+        for key, value in self.filters.items():
+            if key not in FILTERS or value in (None, "", []):
+                continue
+            op, column = FILTERS[key]
+            if isinstance(value, list):
+                query = query.in_(column, value)
+            else:
+                query = getattr(query, op)(column, value)
+
+        # Apply permission-based filtering (Role Agnostic)
+        if not can_view_all(user):
+            query = query.eq("assigned_to", user.get("id"))
+        return query
+
+    def count(self, supabase, user: Dict[str, Any], method: str = "exact") -> int:
+        """Matching row count from a HEAD request: no rows are transferred"""
+        return self.build(supabase, user, columns="id", count=method, head=True).execute().count or 0
+
+    def preview(self, supabase, user: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+        """First `limit` projected rows in report order"""
+        data = self.ordered(self.build(supabase, user)).limit(limit).execute().data or []
+        return [self.project(row) for row in data]
+
+    def ordered(self, query):
+        for column, desc in self.order:
+            query = query.order(column, desc=desc)
+        return query
+
+    def after(self, query, last_row: Dict[str, Any]):
+        """Keyset condition: rows strictly after last_row in self.order"""
+        if len(self.order) == 1:
+            return query.lt("id", last_row["id"]) if self.order[0][1] else query.gt("id", last_row["id"])
+        (column, desc), (_, id_desc) = self.order
+        op = "lt" if desc else "gt"
+        id_op = "lt" if id_desc else "gt"
+        value = _quote(last_row[column])
+        return query.or_(f"{column}.{op}.{value},and({column}.eq.{value},id.{id_op}.{_quote(last_row['id'])})")
+
+    def project(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape one lead row into the report's fields"""
+        students = row.get("students") or []
+        out = {}
+        for field in self.fields:
+            if field in STUDENT_FIELDS:
+                values = [str(s.get(STUDENT_FIELDS[field])) for s in students if s.get(STUDENT_FIELDS[field]) is not None]
+                out[field] = ", ".join(values) if values else None
+            else:
+                column = _lead_column(field)
+                out[field] = row.get(column) if column else None
+        return out
+
+    def pages(self, supabase, user: Dict[str, Any], page_size: int):
+        """
+        Yield projected rows page by page. Uses keyset paging when the order
+        allows it (the default id order, or one non-null column + id), and
+        offset paging otherwise.
+        """
+        last_row = None
+        offset = 0
+        while True:
+            query = self.ordered(self.build(supabase, user))
+            if self.keyset:
+                if last_row:
+                    query = self.after(query, last_row)
+                query = query.limit(page_size)
+            else:
+                query = query.range(offset, offset + page_size - 1)
+            data = query.execute().data or []
+            if not data:
+                return
+            last_row = data[-1]
+            offset += len(data)
+            yield [self.project(row) for row in data]
+            if len(data) < page_size:
+                return
+
+def compile_report(report: Dict[str, Any]) -> ReportQuery:
+    return ReportQuery(report)
@@ -0,0 +1,144 @@
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from database import get_db
+from models import ReportTemplate
+from services.report_query import parse_json
+
+logger = logging.getLogger(__name__)
+
+# Other API workers learn about saved/deleted reports when their copy expires
+CUSTOM_TEMPLATES_TTL_SECONDS = int(os.getenv("REPORT_TEMPLATES_CACHE_SECONDS", "300"))
+PAGE_SIZE = 1000  # Reports per request when loading custom templates (PostgREST max rows)
+
+# Pre-built report templates
+REPORT_TEMPLATES = [
+    {
+        "id": "leads_overview",
+        "name": "Leads Overview",
+        "description": "Complete overview of all leads with key metrics",
+        "fields": ["parent_name", "email", "phone", "status", "source", "created_at", "assigned_to"],
+        "filters": {}
+    },
+    {
+        "id": "enrollment_report",
+        "name": "Enrollment Report",
+        "description": "All enrolled students with details",
+        "fields": ["parent_name", "email", "phone", "student_name", "grade", "enrolled_date"],
+        "filters": {"status": "enrolled"}
+    },
+    {
+        "id": "pipeline_status",
+        "name": "Pipeline Status Report",
+        "description": "Current pipeline status breakdown",
+        "fields": ["status", "count", "percentage"],
+        "filters": {},
+        "grouping": "status"
+    },
+    {
+        "id": "counselor_activity",
+        "name": "Counselor Activity Report",
+        "description": "Counselor performance and activity metrics",
+        "fields": ["counselor_name", "total_leads", "interactions", "enrollments", "conversion_rate"],
+        "filters": {},
+        "grouping": "counselor_name"
+    },
+    {
+        "id": "source_analysis",
+        "name": "Lead Source Analysis",
+        "description": "Lead generation and conversion by source",
+        "fields": ["source", "total_leads", "enrolled", "conversion_rate"],
+        "filters": {},
+        "grouping": "source"
+    }
+]
+
+
+def is_system_report(report_id: Any) -> bool:
+    return any(t["id"] == str(report_id) for t in REPORT_TEMPLATES)
+
+class TemplateRegistry:
+    """
+    In-memory registry behind GET /reports/templates. System templates are
+    built once; custom reports are loaded from the reports table (newest first),
+    kept for CUSTOM_TEMPLATES_TTL_SECONDS and updated in place when this worker
+    saves or deletes a report.
+    """
+
+    def __init__(self):
+        self.system: List[ReportTemplate] = [ReportTemplate(**t, is_system=True) for t in REPORT_TEMPLATES]
+        self._custom: Optional[List[Tuple[Optional[str], ReportTemplate]]] = None  # (created_by, template)
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _template(item: Dict[str, Any]) -> ReportTemplate:
+        return ReportTemplate(
+            id=str(item["id"]),
+            name=item["name"],
+            description=item.get("description") or "",
+            fields=parse_json(item.get("fields")) or [],
+            filters=parse_json(item.get("filters")) or {},
+            is_system=False
+        )
+
+    @staticmethod
+    def _load_custom() -> List[Tuple[Optional[str], ReportTemplate]]:
+        """Every saved report, newest first, in keyset pages on (created_at, id)"""
+        supabase = get_db()
+        custom = []
+        last_row = None
+        while True:
+            query = supabase.table("reports") \
+                .select("id, name, description, fields, filters, created_by, created_at") \
+                .order("created_at", desc=True).order("id", desc=True).limit(PAGE_SIZE)
+            if last_row:
+                created_at = last_row["created_at"]
+                query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_row["id"]})')
+            rows = query.execute().data or []
+            custom.extend((item.get("created_by"), TemplateRegistry._template(item)) for item in rows)
+            if len(rows) < PAGE_SIZE:
+                return custom
+            last_row = rows[-1]
+
+    def _custom_templates(self) -> List[Tuple[Optional[str], ReportTemplate]]:
+        with self._lock:
+            if self._custom is None or time.monotonic() - self._loaded_at > CUSTOM_TEMPLATES_TTL_SECONDS:
+                try:
+                    self._custom = self._load_custom()
+                    self._loaded_at = time.monotonic()
+                except Exception as e:
+                    # Serve the last copy (or just system templates) if the DB is unavailable
+                    logger.error(f"Error fetching custom reports: {e}")
+            return self._custom or []
+
+    def add(self, item: Dict[str, Any]):
+        """A report was just saved (build_report with save=True)"""
+        with self._lock:
+            if self._custom is not None:
+                self._custom.insert(0, (item.get("created_by"), self._template(item)))
+
+    def remove(self, report_id: str):
+        """A report was just deleted"""
+        with self._lock:
+            if self._custom is not None:
+                self._custom = [(owner, t) for owner, t in self._custom if t.id != str(report_id)]
+
+    def list_for_user(self, user: Dict[str, Any], limit: Optional[int] = None,
+                      offset: int = 0) -> Tuple[List[ReportTemplate], int]:
+        """
+        System templates, then the custom reports the user may see: their own,
+        or every one for admins. Returns (page, total).
+        """
+        custom = self._custom_templates()
+        if user.get("role") != "admin":
+            custom = [(owner, t) for owner, t in custom if owner == user.get("id")]
+        templates = self.system + [t for _, t in custom]
+        end = offset + limit if limit else None
+        return templates[offset:end], len(templates)
+
+# Global instance
+template_registry = TemplateRegistry()
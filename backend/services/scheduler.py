@@ -0,0 +1,195 @@
+
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timezone
+from typing import Any, Callable, Dict, Optional, Set
+from database import get_db
+from services.report_export import compute_next_run, run_scheduled_report, run_export_job
+from services.archival import run_archive_job
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() != "false"
+POLL_SECONDS = int(os.getenv("SCHEDULER_POLL_SECONDS", "30"))
+MAX_CONCURRENT_JOBS = int(os.getenv("SCHEDULER_MAX_CONCURRENT_JOBS", "2"))
+LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "900"))  # Longer than any single job should take
+
+
+class Scheduler:
+    """
+    In-process background scheduler, started from the FastAPI lifespan (main.py).
+
+    Every POLL_SECONDS it claims due work through DB leases
+    (migrations/background_scheduler.sql), so with several API workers each job
+    still runs once:
+    - periodic jobs registered with register() (SLA check, archival, ...)
+    - due scheduled_reports rows, each recorded in report_runs
+    - queued export jobs (pending report_runs rows from POST /reports/export?mode=async)
+    - queued archive jobs (archive_jobs rows from POST /admin/archive-leads or the archive policy)
+
+    Jobs are blocking functions and run on a dedicated pool of
+    MAX_CONCURRENT_JOBS threads, never on the threadpool that serves requests.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._wake: Optional[asyncio.Event] = None
+
+    def register(self, name: str, interval_seconds: int, func: Callable[[], Any]):
+        """Run func every interval_seconds; an interval of 0 disables the job"""
+        if interval_seconds > 0:
+            self.jobs[name] = {"interval": interval_seconds, "func": func}
+
+    async def start(self):
+        if not SCHEDULER_ENABLED or self._loop_task:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="scheduler")
+        self._wake = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._loop())
+        logger.info(f"Scheduler started on {self.worker_id} with jobs {list(self.jobs)}")
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            self._loop_task = None
+        if self._executor:
+            # Running jobs finish in the background; their leases expire if the process exits first
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def wake(self):
+        """Poll now instead of at the next interval, e.g. right after an export is queued"""
+        if self._wake:
+            self._wake.set()
+
+    def _free_slots(self) -> int:
+        return MAX_CONCURRENT_JOBS - len(self._running)
+
+    def _spawn(self, func: Callable, *args):
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(loop.run_in_executor(self._executor, func, *args))
+        self._running.add(task)
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Future):
+        self._running.discard(task)
+        # A slot just freed up: look for queued work without waiting for the next poll
+        self.wake()
+
+    async def tick(self):
+        """Claim and start whatever is due, up to the free worker slots"""
+        loop = asyncio.get_running_loop()
+
+        for name, job in self.jobs.items():
+            if self._free_slots() <= 0:
+                return
+            claimed = await loop.run_in_executor(self._executor, self._claim_job, name, job["interval"])
+            if claimed:
+                self._spawn(self._run_job, name, job["func"])
+
+        if self._free_slots() > 0:
+            schedules = await loop.run_in_executor(self._executor, self._claim_reports, self._free_slots())
+            for schedule in schedules:
+                self._spawn(self._run_report, schedule)
+
+        if self._free_slots() > 0:
+            runs = await loop.run_in_executor(self._executor, self._claim_exports, self._free_slots())
+            for run in runs:
+                self._spawn(run_export_job, run)
+
+        if self._free_slots() > 0:
+            jobs = await loop.run_in_executor(self._executor, self._claim_archive_jobs, self._free_slots())
+            for job in jobs:
+                self._spawn(run_archive_job, job, self.worker_id, LEASE_SECONDS)
+
+    # --- Periodic jobs ---
+
+    def _claim_job(self, name: str, interval: int) -> bool:
+        res = get_db().rpc("claim_scheduled_job", {
+            "p_name": name,
+            "p_interval_seconds": interval,
+            "p_worker": self.worker_id,
+            "p_lease_seconds": LEASE_SECONDS
+        }).execute()
+        return bool(res.data)
+
+    def _run_job(self, name: str, func: Callable[[], Any]):
+        update: Dict[str, Any] = {"locked_by": None, "locked_until": None}
+        try:
+            result = func()
+            update.update(last_status="completed", last_error=None, last_result=result)
+        except Exception as e:
+            logger.error(f"Scheduled job {name} failed: {e}")
+            update.update(last_status="failed", last_error=str(e))
+        update["last_finished_at"] = datetime.now(timezone.utc).isoformat()
+        try:
+            get_db().table("scheduled_jobs").update(update) \
+                .eq("name", name).eq("locked_by", self.worker_id).execute()
+        except Exception as e:
+            logger.error(f"Failed to release scheduled job {name}: {e}")
+
+    # --- Scheduled reports ---
+
+    def _claim_reports(self, limit: int):
+        res = get_db().rpc("claim_due_scheduled_reports", {
+            "p_worker": self.worker_id,
+            "p_lease_seconds": LEASE_SECONDS,
+            "p_limit": limit
+        }).execute()
+        return res.data or []
+
+    def _claim_exports(self, limit: int):
+        res = get_db().rpc("claim_pending_export_runs", {
+            "p_worker": self.worker_id,
+            "p_lease_seconds": LEASE_SECONDS,
+            "p_limit": limit
+        }).execute()
+        return res.data or []
+
+    def _claim_archive_jobs(self, limit: int):
+        res = get_db().rpc("claim_archive_jobs", {
+            "p_worker": self.worker_id,
+            "p_lease_seconds": LEASE_SECONDS,
+            "p_limit": limit
+        }).execute()
+        return res.data or []
+
+    def _run_report(self, schedule: Dict[str, Any]):
+        try:
+            run_scheduled_report(schedule)
+        finally:
+            now = datetime.now(timezone.utc)
+            update: Dict[str, Any] = {"last_run": now.isoformat(), "locked_by": None, "locked_until": None}
+            if schedule["frequency"] == "once":
+                update.update(status="paused", next_run=None)
+            else:
+                schedule_time = time.fromisoformat(schedule["schedule_time"]) if schedule.get("schedule_time") else None
+                update["next_run"] = compute_next_run(schedule["frequency"], schedule_time, now).isoformat()
+            try:
+                get_db().table("scheduled_reports").update(update) \
+                    .eq("id", schedule["id"]).eq("locked_by", self.worker_id).execute()
+            except Exception as e:
+                logger.error(f"Failed to reschedule report {schedule['id']}: {e}")
+
+# Global instance
+scheduler = Scheduler()
@@ -0,0 +1,89 @@
+
+import os
+import time
+import logging
+from typing import Any, Dict, List
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_COOLDOWN_HOURS = float(os.getenv("SLA_NOTIFY_COOLDOWN_HOURS", "24"))
+INSERT_CHUNK_SIZE = 500  # Notifications per insert round-trip
+PAGE_SIZE = 1000  # Overdue leads per sla_overdue_leads call (PostgREST max rows)
+CHECK_INTERVAL_SECONDS = int(os.getenv("SLA_CHECK_INTERVAL_MINUTES", "60")) * 60
+
+
+def build_notification(lead: Dict[str, Any]) -> Dict[str, Any]:
+    status = lead.get("status")
+    return {
+        "user_id": lead["assigned_to"],
+        "title": "SLA Warning: Overdue Lead",
+        "message": f"Lead {lead.get('parent_name')} is overdue (Status: {status}). Please follow up.",
+        "read": False,
+        "type": "alert",
+        "link": f"/leads/{lead['id']}"
+    }
+
+
+class SLAChecker:
+    """
+    Finds overdue leads and alerts their owners.
+
+    sla_overdue_leads (migrations/sla_check.sql) returns the overdue leads
+    that have not been alerted within NOTIFY_COOLDOWN_HOURS, PAGE_SIZE at a
+    time in id order; each page's notifications are inserted
+    INSERT_CHUNK_SIZE rows at a time before the next page is fetched.
+    Blocking (sync Supabase client): call from a thread, not the event loop.
+    """
+
+    def run(self, cooldown_hours: float = NOTIFY_COOLDOWN_HOURS) -> Dict[str, Any]:
+        supabase = get_db()
+        started = time.perf_counter()
+
+        overdue = 0
+        created = 0
+        failed = 0
+        query_seconds = 0.0
+        after_id = None
+        while True:
+            page_started = time.perf_counter()
+            response = supabase.rpc("sla_overdue_leads", {
+                "p_cooldown_hours": cooldown_hours,
+                "p_after_id": after_id,
+                "p_limit": PAGE_SIZE
+            }).execute()
+            page: List[Dict[str, Any]] = response.data or []
+            query_seconds += time.perf_counter() - page_started
+            overdue += len(page)
+
+            notifications = [build_notification(lead) for lead in page]
+            for i in range(0, len(notifications), INSERT_CHUNK_SIZE):
+                chunk = notifications[i:i + INSERT_CHUNK_SIZE]
+                try:
+                    supabase.table("notifications").insert(chunk).execute()
+                    created += len(chunk)
+                except Exception as e:
+                    failed += len(chunk)
+                    logger.error(f"SLA check: failed to insert {len(chunk)} notifications: {e}")
+
+            if len(page) < PAGE_SIZE:
+                break
+            after_id = page[-1]["id"]
+        total_seconds = time.perf_counter() - started
+
+        result = {
+            "overdue": overdue,
+            "notifications_created": created,
+            "notifications_failed": failed,
+            "cooldown_hours": cooldown_hours,
+            "timings_ms": {
+                "query": round(query_seconds * 1000, 1),
+                "insert": round((total_seconds - query_seconds) * 1000, 1),
+                "total": round(total_seconds * 1000, 1),
+            },
+        }
+        logger.info(f"SLA check: {created} notifications for {overdue} overdue leads in {result['timings_ms']['total']}ms")
+        return result
+
+# Global instance
+sla_checker = SLAChecker()
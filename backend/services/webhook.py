@@ -1,76 +1,111 @@
 
 import logging
 import json
+import asyncio
 import httpx
-from typing import Dict, Any
+from typing import Dict, Any, List, Set, Tuple
 from database import supabase
 
 logger = logging.getLogger(__name__)
 
+BATCH_CONCURRENCY = 20  # Concurrent POSTs for dispatch_batch
+LOG_CHUNK_SIZE = 500
+
 class WebhookService:
+    def __init__(self):
+        self._background: Set[asyncio.Task] = set()
+
+    def _subscribed_targets(self, event_name: str) -> List[Tuple[str, str]]:
+        """(integration_id, url) for every connected webhook subscribed to event_name"""
+        # Filter by type='webhook' and status='connected'
+        # Note: config is JSONB. We check if event_name is in config['events']
+        response = supabase.table("integrations").select("*").eq("type", "webhook").eq("status", "connected").execute()
+        targets = []
+        for integration in response.data or []:
+            config = integration.get("config", {})
+            if isinstance(config, str):
+                try: config = json.loads(config)
+                except: config = {}
+            
+            # Check subscription
+            subscribed_events = config.get("events", [])
+            if event_name in subscribed_events or "*" in subscribed_events:
+                target_url = config.get("url")
+                if target_url:
+                    targets.append((integration["id"], target_url))
+        return targets
+
     async def dispatch_event(self, event_name: str, payload: Dict[str, Any]):
         """Find active webhooks and dispatch event payload"""
         try:
-            # 1. Fetch integrations
-            # Filter by type='webhook' and status='connected'
-            # Note: config is JSONB. We check if event_name is in config['events']?
-            # Or just send to all webhooks? Usually specific events.
-            response = supabase.table("integrations").select("*").eq("type", "webhook").eq("status", "connected").execute()
-            integrations = response.data
-            
-            if not integrations:
+            for integration_id, target_url in self._subscribed_targets(event_name):
+                await self._send_webhook(integration_id, target_url, event_name, payload)
+
+        except Exception as e:
+            logger.error(f"Webhook dispatch error: {e}")
+
+    async def dispatch_batch(self, event_name: str, payloads: List[Dict[str, Any]]):
+        """
+        Dispatch one event for many payloads (bulk import/update paths).
+        Integrations are looked up once, POSTs share a client with bounded
+        concurrency and the integration_logs rows are inserted in chunks.
+        Each payload is still delivered as its own request, same as dispatch_event.
+        """
+        if not payloads:
+            return
+        try:
+            targets = self._subscribed_targets(event_name)
+            if not targets:
                 return
 
-            for integration in integrations:
-                config = integration.get("config", {})
-                if isinstance(config, str):
-                    try: config = json.loads(config)
-                    except: config = {}
-                
-                # Check subscription
-                subscribed_events = config.get("events", [])
-                if event_name in subscribed_events or "*" in subscribed_events:
-                    target_url = config.get("url")
-                    if target_url:
-                        await self._send_webhook(integration["id"], target_url, event_name, payload)
+            semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+            logs = []
+
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                async def send(integration_id, url, payload):
+                    async with semaphore:
+                        logs.append(await self._post(client, integration_id, url, event_name, payload))
+
+                await asyncio.gather(*(
+                    send(integration_id, url, payload)
+                    for integration_id, url in targets
+                    for payload in payloads
+                ))
+
+            for i in range(0, len(logs), LOG_CHUNK_SIZE):
+                try:
+                    supabase.table("integration_logs").insert(logs[i:i + LOG_CHUNK_SIZE]).execute()
+                except Exception as e:
+                    logger.error(f"Failed to save webhook logs: {e}")
 
         except Exception as e:
-            logger.error(f"Webhook dispatch error: {e}")
+            logger.error(f"Webhook batch dispatch error: {e}")
 
-    async def _send_webhook(self, integration_id: str, url: str, event_name: str, payload: Dict[str, Any]):
-        """Send HTTP POST and log result"""
-        log_entry = {
-            "integration_id": integration_id,
-            "event_name": event_name,
-            "payload": payload,
-            "status": "pending"
-        }
-        
-        # Initial Log (Optional, maybe skip pending)
-        # log_res = supabase.table("integration_logs").insert(log_entry).execute()
-        # log_id = log_res.data[0]['id']
-        
+    def dispatch_batch_in_background(self, event_name: str, payloads: List[Dict[str, Any]]):
+        """Run dispatch_batch as a task on the running loop, so the caller does not wait on webhook endpoints"""
+        if not payloads:
+            return
+        task = asyncio.create_task(self.dispatch_batch(event_name, payloads))
+        # The loop only keeps weak references to tasks
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _post(self, client: httpx.AsyncClient, integration_id: str, url: str, event_name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST payload and build the integration_logs row for the result"""
         status = "failed"
         response_status = 0
         response_body = ""
 
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(url, json=payload)
-                response_status = response.status_code
-                response_body = response.text[:1000] # Truncate check
-                
-                if response.is_success:
-                    status = "success"
-                else:
-                    status = "failed"
-                    
+            response = await client.post(url, json=payload)
+            response_status = response.status_code
+            response_body = response.text[:1000] # Truncate check
+            status = "success" if response.is_success else "failed"
         except Exception as e:
             response_body = str(e)
             status = "failed"
-        
-        # Log Result (Final)
-        final_log = {
+
+        return {
             "integration_id": integration_id,
             "event_name": event_name,
             "payload": payload,
@@ -78,6 +113,12 @@ class WebhookService:
             "response_body": response_body,
             "status": status
         }
+
+    async def _send_webhook(self, integration_id: str, url: str, event_name: str, payload: Dict[str, Any]):
+        """Send HTTP POST and log result"""
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            final_log = await self._post(client, integration_id, url, event_name, payload)
+
         try:
             supabase.table("integration_logs").insert(final_log).execute()
         except Exception as e: